@@ -0,0 +1,5 @@
+"""CSC111 Winter 2025 Project 2: Benchmarks
+This package contains the benchmark tools of the search engine, which run without the Kaggle dataset.
+It is responsible for generating synthetic csv files in the format of the dataset (generate.py), measuring the loading,
+indexing and query times of the engine on them (run.py), and comparing the results of two runs (compare.py).
+"""
@@ -0,0 +1,78 @@
+"""CSC111 Winter 2025 Project 2: Benchmark Comparison
+This module compares the results of two benchmark runs (see run.py), e.g. of a commit and of its parent.
+It is responsible for printing the change of every timing, throughput and memory measurement, and for flagging the
+ones that got worse by more than a threshold, so that regressions are caught before they are merged.
+
+Usage (from the scholar-search directory):
+    python -m benchmarks.compare before.json after.json --threshold 10
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+from typing import Any
+
+# Measurements where lower is better, by the suffix of their name; the others (throughputs) are better when higher
+_LOWER_IS_BETTER = ('_ms', '_seconds', '_mb')
+_HIGHER_IS_BETTER = ('_per_second',)
+
+
+def flatten(results: dict[str, Any], prefix: str = '') -> dict[str, float]:
+    """Return the comparable measurements of results, keyed by their dotted path.
+
+    >>> flatten({'meta': {'rows': 10}, 'queries': {'total': {'p50_ms': 2.5, 'count': 3}}, 'peak_rss_mb': 90})
+    {'queries.total.p50_ms': 2.5, 'peak_rss_mb': 90}
+    """
+    flat = {}
+    for key, value in results.items():
+        if key == 'meta':
+            continue
+        path = f'{prefix}{key}'
+        if isinstance(value, dict):
+            flat.update(flatten(value, f'{path}.'))
+        elif isinstance(value, (int, float)) and key.endswith(_LOWER_IS_BETTER + _HIGHER_IS_BETTER):
+            flat[path] = value
+    return flat
+
+
+def compare(before: dict[str, Any], after: dict[str, Any], threshold: float = 10) -> list[str]:
+    """Print the change of every measurement from before to after, and return the paths of those that got worse by
+    more than threshold percent."""
+    old, new = flatten(before), flatten(after)
+    print(f"{'measurement':<40} {'before':>12} {'after':>12} {'change':>9}")
+    regressions = []
+    for path in [path for path in new if path in old]:
+        change = (new[path] - old[path]) / old[path] * 100 if old[path] else 0.0
+        worse = change if path.endswith(_LOWER_IS_BETTER) else -change
+        flag = ''
+        if worse > threshold:
+            regressions.append(path)
+            flag = '  <- regression'
+        print(f"{path:<40} {old[path]:>12g} {new[path]:>12g} {change:>+8.1f}%{flag}")
+    return regressions
+
+
+def main() -> None:
+    """Compare the two benchmark results given on the command line, and exit with status 1 if there is a regression."""
+    parser = argparse.ArgumentParser(description='Compare the results of two benchmark runs.')
+    parser.add_argument('before', help='the results of the baseline run')
+    parser.add_argument('after', help='the results of the new run')
+    parser.add_argument('--threshold', type=float, default=10,
+                        help='the change (in percent) above which a measurement is a regression (default: 10)')
+    args = parser.parse_args()
+
+    with open(args.before, 'r') as file:
+        before = json.load(file)
+    with open(args.after, 'r') as file:
+        after = json.load(file)
+    print(f"before: {before['meta'].get('commit')}, after: {after['meta'].get('commit')}")
+    regressions = compare(before, after, args.threshold)
+    if regressions:
+        print(f"{len(regressions)} regressions above {args.threshold}%")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,277 @@
+"""CSC111 Winter 2025 Project 2: Benchmark Data Generator
+This module writes synthetic csv files in the format of the dblp-v10 dataset, at any scale (10k to 5M rows and more).
+It is responsible for making files whose statistics resemble the real ones, so that the benchmarks exercise the same
+code paths: titles drawn from a Zipfian vocabulary of computer science terms (with a long tail of rare terms that
+grows with the number of rows), authors and venues with skewed productivity, and references that follow a power law,
+cite older papers only, and prefer the papers that are already cited a lot.
+
+Usage (from the scholar-search directory):
+    python -m benchmarks.generate ../data/bench-100k.csv --rows 100000 --seed 0
+"""
+
+from __future__ import annotations
+
+import argparse
+import csv
+import time
+from collections.abc import Iterator
+
+import numpy as np
+
+HEADER = ['abstract', 'authors', 'n_citation', 'references', 'title', 'venue', 'year', 'id']
+
+# The most frequent title terms, roughly in decreasing order of frequency in dblp titles
+HEAD_VOCABULARY = """
+learning network networks based system systems data analysis model neural approach algorithm design control wireless
+performance using method optimization deep efficient distributed adaptive dynamic multi detection recognition image
+time fuzzy management information software power new framework evaluation estimation sensor mobile channel
+classification robust scheme application applications models web service services online graph structure energy
+linear algorithms
+estimation problem study analysis approach via computing security search multiple modeling simulation communication
+theory semantic parallel processing video feature selection clustering optimal real logic hybrid virtual cloud
+knowledge query queries language languages programming automatic computer visual human interactive social 2d 3d
+segmentation tracking reinforcement generative adversarial transformer attention convolutional recurrent memory
+routing protocol protocols scheduling resource allocation cooperative interference mimo ofdm coding decoding codes
+compression encryption privacy authentication attack attacks verification testing bugs program programs compiler
+database databases mining retrieval ranking recommendation recommender text document documents speech translation
+embedding embeddings representation representations kernel regression bayesian probabilistic inference stochastic
+markov random sparse low rank matrix tensor factorization approximation convex nonlinear constrained multi objective
+evolutionary genetic swarm particle heuristic search quantum circuit circuits hardware fpga architecture architectures
+cache storage file memory scalable fast high quality low cost large scale small efficient accurate secure reliable
+fault tolerant tolerance consensus blockchain peer edge fog internet things iot vehicular networks robot robots robotic
+navigation planning path motion localization mapping vision camera depth point cloud shape surface mesh rendering
+medical health clinical patient brain signal signals filter filtering frequency spectrum estimation noise sensing
+compressed sampling reconstruction super resolution enhancement face object objects scene action activity event
+user users interface interaction crowdsourcing game games mechanism auction market pricing economic supply chain
+process processes workflow business enterprise ontology rules reasoning agent agents multiagent negotiation trust
+""".split()
+HEAD_VOCABULARY = list(dict.fromkeys(HEAD_VOCABULARY))
+TITLE_STOPWORDS = ['a', 'an', 'the', 'of', 'for', 'in', 'on', 'with', 'and', 'to', 'using', 'via', 'from', 'by',
+                   'towards', 'under', 'over', 'through']
+_SYLLABLES = ['ka', 'lo', 'mi', 'ne', 'ru', 'sa', 'ti', 'vo', 'pe', 'dra', 'gen', 'lex', 'mor', 'phi', 'quin', 'str',
+              'tor', 'ul', 'ven', 'xy', 'zo', 'bi', 'cy', 'del', 'fa', 'gra', 'hy', 'ion', 'jo', 'kri', 'lum', 'nox']
+
+FIRST_NAMES = ['Wei', 'Jing', 'Li', 'Yang', 'Hui', 'Xin', 'Ming', 'Chen', 'Yan', 'Lei', 'John', 'David', 'Michael',
+               'James', 'Robert', 'Maria', 'Anna', 'Sarah', 'Laura', 'Elena', 'Andrea', 'Marco', 'Luca', 'Giovanni',
+               'Hans', 'Peter', 'Thomas', 'Klaus', 'Pierre', 'Jean', 'Marie', 'Sophie', 'Hiroshi', 'Takashi', 'Yuki',
+               'Kenji', 'Rahul', 'Amit', 'Priya', 'Sanjay', 'Ahmed', 'Mohamed', 'Omar', 'Fatima', 'Carlos', 'Jose',
+               'Ana', 'Juan', 'Ivan', 'Olga', 'Sergey', 'Dmitri', 'Kim', 'Min', 'Ji', 'Seung', 'Nguyen', 'Tuan',
+               'Emily', 'Daniel']
+LAST_NAMES = ['Wang', 'Li', 'Zhang', 'Liu', 'Chen', 'Yang', 'Huang', 'Zhao', 'Wu', 'Zhou', 'Xu', 'Sun', 'Ma', 'Zhu',
+              'Hu', 'Guo', 'He', 'Lin', 'Smith', 'Johnson', 'Williams', 'Brown', 'Jones', 'Miller', 'Davis', 'Wilson',
+              'Taylor', 'Anderson', 'Thomas', 'Moore', 'Martin', 'Lee', 'Kim', 'Park', 'Choi', 'Tanaka', 'Suzuki',
+              'Sato', 'Watanabe', 'Kumar', 'Singh', 'Sharma', 'Gupta', 'Patel', 'Mueller', 'Schmidt', 'Schneider',
+              'Fischer', 'Weber', 'Rossi', 'Russo', 'Bianchi', 'Romano', 'Garcia', 'Rodriguez', 'Martinez', 'Lopez',
+              'Gonzalez', 'Perez', 'Dubois', 'Bernard', 'Petit', 'Ivanov', 'Smirnov', 'Kuznetsov', 'Nguyen', 'Tran',
+              'Ali', 'Hassan', 'Ibrahim', 'Silva', 'Santos', 'Costa', 'Jensen', 'Nielsen', 'Hansen', 'Berg', 'Cohen']
+VENUE_PATTERNS = ['IEEE Transactions on {} {}', 'International Conference on {} {}', 'Journal of {} {}',
+                  'Workshop on {} {}', 'ACM Symposium on {} {}', '{} {} Letters']
+
+_CHUNK_ROWS = 20000
+_ID_MULTIPLIER = 0x9E3779B97F4A7C15F39CC0605CEDC835
+
+
+def paper_id(index: int, salt: int) -> str:
+    """Return the UUID-like id of the paper with the given row index; different indexes have different ids.
+
+    >>> paper_id(0, 0), paper_id(1, 0) != paper_id(2, 0)
+    ('00000000-0000-0000-0000-000000000000', True)
+    """
+    h = f'{(index * _ID_MULTIPLIER + salt) % 2 ** 128:032x}'
+    return f'{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}'
+
+
+def tail_word(rank: int) -> str:
+    """Return the rank-th rare term: a pronounceable made-up word of at least two syllables, different for every rank.
+
+    >>> tail_word(0), tail_word(1), tail_word(len(_SYLLABLES) ** 2)
+    ('loka', 'lolo', 'loloka')
+    """
+    rank += len(_SYLLABLES)
+    syllables = []
+    while rank:
+        rank, digit = divmod(rank, len(_SYLLABLES))
+        syllables.append(_SYLLABLES[digit])
+    return ''.join(reversed(syllables))
+
+
+def author_name(index: int) -> str:
+    """Return the name of the index-th author; different indexes have different names.
+
+    >>> author_name(0), author_name(len(FIRST_NAMES) * len(LAST_NAMES))
+    ('Wei Wang', 'Wei A. Wang')
+    """
+    index, first = divmod(index, len(FIRST_NAMES))
+    group, last = divmod(index, len(LAST_NAMES))
+    if group == 0:
+        return f'{FIRST_NAMES[first]} {LAST_NAMES[last]}'
+    group -= 1
+    middle = chr(ord('A') + group % 26) + ('' if group < 26 else str(group // 26))
+    return f'{FIRST_NAMES[first]} {middle}. {LAST_NAMES[last]}'
+
+
+def zipf_cdf(size: int, exponent: float, offset: float = 2.7) -> np.ndarray:
+    """Return the cumulative distribution of the Zipf-Mandelbrot law 1 / (rank + offset) ** exponent over size ranks."""
+    weights = 1 / (np.arange(size, dtype=np.float64) + offset) ** exponent
+    cdf = np.cumsum(weights)
+    return cdf / cdf[-1]
+
+
+def sample(cdf: np.ndarray, rng: np.random.Generator, count: int) -> np.ndarray:
+    """Return count ranks drawn from the distribution with the given cumulative distribution."""
+    return np.minimum(np.searchsorted(cdf, rng.random(count), side='right'), len(cdf) - 1)
+
+
+class CsvGenerator:
+    """A generator of the rows of a synthetic dataset with a fixed number of rows.
+
+    The rows are generated in chunks, so the memory used does not depend on the length of the titles and abstracts;
+    only a few numbers per paper (its fitness for being cited) are kept for the whole file.
+
+    Instance Attributes:
+        - rows: The number of rows of the dataset.
+        - abstract_words: The mean number of words of an abstract.
+        - vocabulary: The title and abstract terms, most frequent first.
+        - venues: The venues, most popular first.
+    """
+    rows: int
+    abstract_words: int
+    vocabulary: np.ndarray
+    venues: list[str]
+    # Private Instance Attributes:
+    #     - _rng: The random number generator, seeded so that a seed always gives the same file.
+    #     - _salt: The salt of the paper ids.
+    #     - _term_cdf: The distribution of the terms of the vocabulary.
+    #     - _author_count: The number of distinct authors.
+    #     - _author_cdf: The distribution of the authors (by number of papers).
+    #     - _venue_cdf: The distribution of the venues.
+    #     - _fitness: The fitness of each paper; a paper is cited with probability proportional to its fitness, which
+    #       follows a Pareto law, so the numbers of citations follow a power law.
+    #     - _fitness_cdf: The cumulative fitness of the papers.
+    _rng: np.random.Generator
+    _salt: int
+    _term_cdf: np.ndarray
+    _author_count: int
+    _author_cdf: np.ndarray
+    _venue_cdf: np.ndarray
+    _fitness: np.ndarray
+    _fitness_cdf: np.ndarray
+
+    def __init__(self, rows: int, seed: int = 0, abstract_words: int = 100) -> None:
+        self.rows = rows
+        self.abstract_words = abstract_words
+        self._rng = np.random.default_rng(seed)
+        self._salt = int(self._rng.integers(2 ** 63)) << 64 | int(self._rng.integers(2 ** 63))
+
+        # The vocabulary grows with the square root of the number of rows (Heaps' law)
+        tail = [tail_word(rank) for rank in range(int(30 * rows ** 0.5))]
+        self.vocabulary = np.array(HEAD_VOCABULARY + tail, dtype=object)
+        self._term_cdf = zipf_cdf(len(self.vocabulary), 1.05)
+
+        self._author_count = max(100, int(0.7 * rows))
+        self._author_cdf = zipf_cdf(self._author_count, 0.8)
+
+        venue_count = max(20, rows // 2000)
+        words = self.vocabulary[sample(self._term_cdf, self._rng, 2 * venue_count)]
+        self.venues = [VENUE_PATTERNS[i % len(VENUE_PATTERNS)].format(words[2 * i].title(), words[2 * i + 1].title())
+                       for i in range(venue_count)]
+        self._venue_cdf = zipf_cdf(venue_count, 1.1)
+
+        self._fitness = self._rng.pareto(1.5, rows) + 1
+        self._fitness_cdf = np.cumsum(self._fitness)
+
+    def chunks(self) -> Iterator[list[list]]:
+        """Yield the rows of the dataset (without the header), in chunks of lists of HEADER values."""
+        for start in range(0, self.rows, _CHUNK_ROWS):
+            yield self._chunk(start, min(start + _CHUNK_ROWS, self.rows))
+
+    def _chunk(self, start: int, end: int) -> list[list]:
+        """Return the rows of the papers with the given range of indexes."""
+        count = end - start
+        rng = self._rng
+        titles = self._texts(np.clip(rng.poisson(8, count), 2, 25), 0.2)
+        abstracts = self._texts(rng.poisson(self.abstract_words, count) * (rng.random(count) > 0.1), 0.35)
+
+        author_counts = np.clip(rng.poisson(2.2, count), 1, 15)
+        authors = sample(self._author_cdf, rng, int(author_counts.sum())).tolist()
+        author_offsets = np.concatenate(([0], np.cumsum(author_counts))).tolist()
+
+        venues = sample(self._venue_cdf, rng, count).tolist()
+        has_venue = (rng.random(count) > 0.12).tolist()
+        years = (1960 + 58 * ((np.arange(start, end) + 1) / self.rows) ** 0.3).astype(int).tolist()
+        n_citations = rng.poisson(6 * self._fitness[start:end]).tolist()
+        references, reference_offsets = self._references(start, end)
+
+        rows = []
+        for i in range(count):
+            names = [author_name(a) for a in dict.fromkeys(authors[author_offsets[i]:author_offsets[i + 1]])]
+            cited = [paper_id(j, self._salt) for j in references[reference_offsets[i]:reference_offsets[i + 1]]]
+            rows.append([abstracts[i], str(names), n_citations[i], str(cited), titles[i],
+                         self.venues[venues[i]] if has_venue[i] else '', years[i], paper_id(start + i, self._salt)])
+        return rows
+
+    def _texts(self, lengths: np.ndarray, stopword_rate: float) -> list[str]:
+        """Return texts with the given numbers of words, of which about stopword_rate are stopwords."""
+        total = int(lengths.sum())
+        words = self.vocabulary[sample(self._term_cdf, self._rng, total)]
+        stopwords = self._rng.random(total) < stopword_rate
+        words[stopwords] = np.array(TITLE_STOPWORDS, dtype=object)[self._rng.integers(len(TITLE_STOPWORDS),
+                                                                                      size=int(stopwords.sum()))]
+        offsets = np.concatenate(([0], np.cumsum(lengths))).tolist()
+        words = words.tolist()
+        return [' '.join(words[offsets[i]:offsets[i + 1]]).capitalize() for i in range(len(lengths))]
+
+    def _references(self, start: int, end: int) -> tuple[list[int], list[int]]:
+        """Return the sorted indexes of the papers cited by each paper with an index in range(start, end), as one flat
+        list and the offsets of the papers in it.
+
+        A paper cites older papers (with lower indexes) only: half of its references are chosen among all of them and
+        half among the most recent 5% of the papers, in both cases with probability proportional to their fitness.
+        """
+        rng = self._rng
+        sources = np.arange(start, end)
+        counts = np.where(rng.random(end - start) < 0.15, 0, rng.negative_binomial(2, 0.2, end - start))
+        counts[sources == 0] = 0
+        citing = np.repeat(sources, counts)
+
+        cdf = self._fitness_cdf
+        window = np.maximum(citing - max(1, self.rows // 20), 0)
+        low = np.where(rng.random(len(citing)) < 0.5, 0, np.where(window > 0, cdf[window - 1], 0))
+        high = cdf[citing - 1]
+        cited = np.searchsorted(cdf, low + rng.random(len(citing)) * (high - low), side='right')
+        cited = np.minimum(cited, citing - 1)
+
+        pairs = np.unique(citing.astype(np.int64) * self.rows + cited)
+        counts = np.bincount(pairs // self.rows - start, minlength=end - start)
+        return (pairs % self.rows).tolist(), np.concatenate(([0], np.cumsum(counts))).tolist()
+
+
+def write_csv(path: str, rows: int, seed: int = 0, abstract_words: int = 100) -> None:
+    """Write a synthetic dataset with the given number of rows to path, printing the progress."""
+    generator = CsvGenerator(rows, seed, abstract_words)
+    start_time = time.perf_counter()
+    written = 0
+    with open(path, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(HEADER)
+        for chunk in generator.chunks():
+            writer.writerows(chunk)
+            written += len(chunk)
+            if written % (10 * _CHUNK_ROWS) == 0 or written == rows:
+                print(f"[generate] {written} rows ({written / (time.perf_counter() - start_time):.0f} rows/sec)")
+
+
+def main() -> None:
+    """Write a synthetic dataset as given on the command line."""
+    parser = argparse.ArgumentParser(description='Write a synthetic csv file in the format of the dblp-v10 dataset.')
+    parser.add_argument('path', help='the path of the csv file to write')
+    parser.add_argument('--rows', type=int, default=100000, help='the number of papers (default: 100000)')
+    parser.add_argument('--seed', type=int, default=0, help='the random seed; a seed always gives the same file')
+    parser.add_argument('--abstract-words', type=int, default=100,
+                        help='the mean number of words of an abstract (default: 100)')
+    args = parser.parse_args()
+    write_csv(args.path, args.rows, args.seed, args.abstract_words)
+
+
+if __name__ == '__main__':
+    main()
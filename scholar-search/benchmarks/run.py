@@ -0,0 +1,295 @@
+"""CSC111 Winter 2025 Project 2: Benchmark Runner
+This module measures the search engine on a csv file in the format of the dblp-v10 dataset (see generate.py).
+It is responsible for timing the loading of the research graph (ingest throughput), the building of the BM25 index,
+and every stage of the queries of a fixed query log (BM25 top papers, citation re-ranking and query graph), as well as
+the /results and /api/graph handlers of the Flask app, and for recording the peak memory used. The results are written
+as JSON, with the commit they were measured on, so that two commits can be compared with compare.py.
+
+The engine reads its data from ../data relative to the working directory, so every run happens in a temporary
+workspace where ../data/research-papers.csv is the benchmarked file; the real dataset and cache are never touched.
+
+Usage (from the scholar-search directory):
+    python -m benchmarks.run ../data/bench-100k.csv --output bench.json
+    python -m benchmarks.run --rows 100000 --output bench.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import multiprocessing
+import os
+import pickle
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from collections.abc import Iterator, Sequence
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Any, Optional
+
+import numpy as np
+
+from benchmarks.generate import write_csv
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(os.path.dirname(PACKAGE_DIR), 'src')
+FRONTEND_DIR = os.path.join(os.path.dirname(PACKAGE_DIR), 'frontend')
+DEFAULT_QUERY_LOG = os.path.join(PACKAGE_DIR, 'queries.txt')
+
+
+def read_query_log(path: str = DEFAULT_QUERY_LOG) -> list[str]:
+    """Return the queries of the query log at path, skipping blank lines and comments."""
+    with open(path, 'r') as file:
+        return [line.strip() for line in file if line.strip() and not line.startswith('#')]
+
+
+def latency_summary(seconds: list[float]) -> dict[str, float]:
+    """Return the count, mean, p50, p95, p99 and maximum (in milliseconds) of the given durations (in seconds).
+
+    >>> latency_summary([0.001, 0.002, 0.003])['p50_ms']
+    2.0
+    """
+    ms = np.array(seconds, dtype=np.float64) * 1000
+    return {'count': len(ms), 'mean_ms': round(float(ms.mean()), 3),
+            'p50_ms': round(float(np.percentile(ms, 50)), 3), 'p95_ms': round(float(np.percentile(ms, 95)), 3),
+            'p99_ms': round(float(np.percentile(ms, 99)), 3), 'max_ms': round(float(ms.max()), 3)}
+
+
+def peak_rss_mb(who: int = resource.RUSAGE_SELF) -> float:
+    """Return the peak resident set size of this process (or of its largest child process) so far, in MiB."""
+    peak = resource.getrusage(who).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in KiB elsewhere
+    return round(peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10, 1)
+
+
+def git_commit() -> dict[str, Any]:
+    """Return the commit of the working tree and whether it has uncommitted changes, or Nones outside of git."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=PACKAGE_DIR, capture_output=True, text=True,
+                                check=True).stdout.strip()
+        status = subprocess.run(['git', 'status', '--porcelain', '--', '..'], cwd=PACKAGE_DIR, capture_output=True,
+                                text=True, check=True).stdout
+        return {'commit': commit, 'dirty': bool(status.strip())}
+    except (OSError, subprocess.CalledProcessError):
+        return {'commit': None, 'dirty': None}
+
+
+@contextmanager
+def workspace(csv_path: str) -> Iterator[str]:
+    """Create a temporary workspace where ../data/research-papers.csv is csv_path and ../frontend is the frontend of
+    the app, and yield the path of its (empty) src directory, which is the working directory of the benchmarks."""
+    previous = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix='scholar-bench-') as root:
+        os.makedirs(os.path.join(root, 'data'))
+        os.makedirs(os.path.join(root, 'src'))
+        os.symlink(os.path.abspath(csv_path), os.path.join(root, 'data', 'research-papers.csv'))
+        os.symlink(FRONTEND_DIR, os.path.join(root, 'frontend'))
+        try:
+            yield os.path.join(root, 'src')
+        finally:
+            os.chdir(previous)
+
+
+def bench_library(work_dir: str, queries: list[str], repeat: int = 3, workers: Optional[int] = None,
+                  graph_kind: str = 'compact', shard_counts: Sequence[int] = ()) -> dict[str, Any]:
+    """Return the measurements of loading the graph, building the BM25 index and answering queries (repeat times)
+    with the functions of the search module, run with work_dir as the working directory.
+
+    For every count in shard_counts, the BM25 top papers are also found with a ShardedBM25 of that many shards (and
+    processes), and checked against those of the unsharded model."""
+    os.chdir(work_dir)
+    if SRC_DIR not in sys.path:
+        sys.path.insert(0, SRC_DIR)
+    from graph import load_compact_research_graph, load_research_graph
+    from search import BM25, build_query_graph, get_corpus, get_most_cited_score
+    from sharding import ShardedBM25
+    from vocabulary import TokenizedCorpus
+
+    results = {}
+    csv_bytes = os.path.getsize('../data/research-papers.csv')
+    start = time.perf_counter()
+    if graph_kind == 'compact':
+        graph = load_compact_research_graph(workers=workers)
+    else:
+        graph = load_research_graph()
+    seconds = time.perf_counter() - start
+    rows = len(graph.get_all_item_vertex_mappings())
+    results['ingest'] = {'graph': graph_kind, 'rows': rows, 'seconds': round(seconds, 3),
+                         'rows_per_second': round(rows / seconds, 1),
+                         'megabytes_per_second': round(csv_bytes / 2 ** 20 / seconds, 2),
+                         'peak_rss_mb': peak_rss_mb()}
+    print(f"[bench] ingest: {rows} rows in {seconds:.2f} s")
+
+    start = time.perf_counter()
+    corpus = list(get_corpus(graph))
+    corpus_seconds = time.perf_counter() - start
+    tokenized_corpus = TokenizedCorpus.from_texts(title for _, title in corpus)
+    tokenize_seconds = time.perf_counter() - start - corpus_seconds
+    bm25 = BM25(tokenized_corpus)
+    seconds = time.perf_counter() - start
+    pickled = pickle.dumps(bm25, protocol=pickle.HIGHEST_PROTOCOL)
+    unpickle_start = time.perf_counter()
+    pickle.loads(pickled)
+    results['index'] = {'corpus_seconds': round(corpus_seconds, 3), 'tokenize_seconds': round(tokenize_seconds, 3),
+                        'bm25_seconds': round(seconds - corpus_seconds - tokenize_seconds, 3),
+                        'seconds': round(seconds, 3), 'terms': len(bm25.frequencies[0]),
+                        'tokenized_corpus_mb': round(tokenized_corpus.nbytes() / 2 ** 20, 2),
+                        'bm25_pickle_mb': round(len(pickled) / 2 ** 20, 2),
+                        'bm25_unpickle_seconds': round(time.perf_counter() - unpickle_start, 3),
+                        'peak_rss_mb': peak_rss_mb()}
+    del tokenized_corpus, pickled
+    print(f"[bench] index: {len(bm25.frequencies[0])} terms in {seconds:.2f} s")
+
+    stages = {'bm25_top_n': [], 'most_cited': [], 'query_graph': [], 'total': []}
+    graph_sizes = []
+    for _ in range(repeat):
+        for query in queries:
+            start = time.perf_counter()
+            result = bm25.get_top_n_paper_score(query, corpus)
+            ranked = time.perf_counter()
+            weighted_papers = get_most_cited_score(result, graph)
+            reranked = time.perf_counter()
+            query_graph = build_query_graph(graph, weighted_papers)
+            end = time.perf_counter()
+            stages['bm25_top_n'].append(ranked - start)
+            stages['most_cited'].append(reranked - ranked)
+            stages['query_graph'].append(end - reranked)
+            stages['total'].append(end - start)
+            graph_sizes.append(len(query_graph.get_all_item_vertex_mappings()))
+    results['queries'] = {stage: latency_summary(seconds) for stage, seconds in stages.items()}
+    results['queries']['mean_graph_papers'] = round(float(np.mean(graph_sizes)), 1)
+    results['queries']['peak_rss_mb'] = peak_rss_mb()
+    print(f"[bench] queries: p50 {results['queries']['total']['p50_ms']} ms, "
+          f"p99 {results['queries']['total']['p99_ms']} ms")
+
+    if shard_counts:
+        # Terms found in a single title have no postings in all the other shards
+        rare_terms = [term for term, frequency in bm25.frequencies[0].items() if frequency == 1][:len(queries)]
+        checked = queries + [f'{term} {query}' for term, query in zip(rare_terms, queries)]
+        expected = [bm25.get_top_n_paper_score(query, corpus) for query in checked]
+        results['sharding'] = {}
+    for shard_count in shard_counts:
+        start = time.perf_counter()
+        sharded = ShardedBM25.from_model(bm25, shard_count)
+        build_seconds = time.perf_counter() - start
+        identical = [sharded.get_top_n_paper_score(query, corpus) for query in checked] == expected
+        seconds = []
+        for _ in range(repeat):
+            for query in queries:
+                start = time.perf_counter()
+                sharded.get_top_n_paper_score(query, corpus)
+                seconds.append(time.perf_counter() - start)
+        sharded.close()
+        results['sharding'][str(shard_count)] = {'build_seconds': round(build_seconds, 3), 'identical': identical,
+                                                 'bm25_top_n': latency_summary(seconds)}
+        print(f"[bench] {shard_count} shards: p50 {results['sharding'][str(shard_count)]['bm25_top_n']['p50_ms']} ms"
+              f"{'' if identical else ', RESULTS DIFFER'}")
+    return results
+
+
+def bench_app(work_dir: str, queries: list[str], repeat: int = 3) -> dict[str, Any]:
+    """Return the measurements of starting the Flask app (until it is imported, and until its warm-up is done) and of
+    its /results and /api/graph handlers, run with work_dir as the working directory.
+
+    The first request of every query builds its query graph, and the others are answered from the caches of the app,
+    so they are reported separately. This is run in a fresh process, so its peak memory is that of the app only.
+    """
+    os.chdir(work_dir)
+    sys.path.insert(0, SRC_DIR)
+    start = time.perf_counter()
+    from __init__ import create_app
+    from routes import WARMUP
+    client = create_app().test_client()
+    import_seconds = time.perf_counter() - start
+    WARMUP.start()
+    assert WARMUP.wait(), f"warm-up failed: {WARMUP.status()['error']}"
+    startup_seconds = time.perf_counter() - start
+
+    stages = {'results_first': [], 'results_repeat': [], 'api_graph_first': [], 'api_graph_repeat': []}
+    for attempt in range(repeat):
+        suffix = 'first' if attempt == 0 else 'repeat'
+        for query in queries:
+            start = time.perf_counter()
+            response = client.get('/results', query_string={'query': query})
+            stages[f'results_{suffix}'].append(time.perf_counter() - start)
+            assert response.status_code == 200, f'/results answered {response.status_code} to {query!r}'
+
+            start = time.perf_counter()
+            response = client.get('/api/graph', query_string={'query': query},
+                                  headers={'Accept-Encoding': 'gzip'})
+            stages[f'api_graph_{suffix}'].append(time.perf_counter() - start)
+            assert response.status_code == 200, f'/api/graph answered {response.status_code} to {query!r}'
+
+    results = {'import_seconds': round(import_seconds, 3), 'startup_seconds': round(startup_seconds, 3)}
+    results.update({stage: latency_summary(seconds) for stage, seconds in stages.items() if seconds})
+    results['peak_rss_mb'] = peak_rss_mb()
+    return results
+
+
+def run(csv_path: str, queries: list[str], repeat: int = 3, workers: Optional[int] = None,
+        graph_kind: str = 'compact', app: bool = True, shard_counts: Sequence[int] = ()) -> dict[str, Any]:
+    """Return all the measurements of the benchmarks on the csv file at csv_path."""
+    results = {'meta': {**git_commit(), 'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+                        'python': platform.python_version(), 'platform': platform.platform(),
+                        'cpu_count': os.cpu_count(), 'csv': os.path.abspath(csv_path),
+                        'csv_bytes': os.path.getsize(csv_path), 'queries': len(queries), 'repeat': repeat}}
+    with workspace(csv_path) as work_dir:
+        results.update(bench_library(work_dir, queries, repeat, workers, graph_kind, shard_counts))
+        if app:
+            # A fresh interpreter, so that the app starts like a gunicorn worker and its memory is measured alone
+            with multiprocessing.get_context('spawn').Pool(1) as pool:
+                results['app'] = pool.apply(bench_app, (work_dir, queries, repeat))
+            print(f"[bench] app: started in {results['app']['startup_seconds']:.2f} s, /results p50 "
+                  f"{results['app']['results_first']['p50_ms']} ms")
+    results['peak_rss_mb'] = peak_rss_mb()
+    results['peak_rss_children_mb'] = peak_rss_mb(resource.RUSAGE_CHILDREN)
+    return results
+
+
+def main() -> None:
+    """Run the benchmarks as given on the command line and write their results."""
+    parser = argparse.ArgumentParser(description='Benchmark the search engine on a dblp-v10 format csv file.')
+    parser.add_argument('csv', nargs='?', help='the csv file to benchmark (default: generate one with --rows rows)')
+    parser.add_argument('--rows', type=int, default=100000, help='the number of rows to generate (default: 100000)')
+    parser.add_argument('--seed', type=int, default=0, help='the random seed of the generated csv file')
+    parser.add_argument('--queries', default=DEFAULT_QUERY_LOG, help='the query log (default: queries.txt)')
+    parser.add_argument('--repeat', type=int, default=3, help='the number of passes over the query log')
+    parser.add_argument('--workers', type=int, default=None, help='the number of ingest processes (default: CPUs)')
+    parser.add_argument('--graph', choices=['compact', 'dict'], default='compact',
+                        help='load a CompactGraph (as the app does) or a Graph')
+    parser.add_argument('--shards', default='',
+                        help='the comma-separated shard counts of sharded BM25 to measure (e.g. 1,2,4,8)')
+    parser.add_argument('--no-app', action='store_true', help='skip the benchmarks of the Flask app')
+    parser.add_argument('--output', help='the JSON file to write the results to (default: stdout)')
+    args = parser.parse_args()
+
+    queries = read_query_log(args.queries)
+    with tempfile.TemporaryDirectory(prefix='scholar-bench-csv-') as csv_dir:
+        csv_path = args.csv
+        generation_seconds = None
+        if csv_path is None:
+            csv_path = os.path.join(csv_dir, f'bench-{args.rows}.csv')
+            start = time.perf_counter()
+            write_csv(csv_path, args.rows, args.seed)
+            generation_seconds = round(time.perf_counter() - start, 3)
+        shard_counts = [int(count) for count in args.shards.split(',') if count]
+        results = run(csv_path, queries, args.repeat, args.workers, args.graph, not args.no_app, shard_counts)
+        if generation_seconds is not None:
+            results['meta'].update({'generated_rows': args.rows, 'seed': args.seed,
+                                    'generation_seconds': generation_seconds})
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(text + '\n')
+        print(f"[bench] results written to {args.output}")
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
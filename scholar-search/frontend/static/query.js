@@ -8,116 +8,143 @@ const svg = d3.create("svg")
     .attr("viewBox", [-width / 2, -height / 2, width, height])
     .attr("style", "max-width: 100%; height: auto; ");
 
-const simulation = d3.forceSimulation(nodes)
-    .force("link", d3.forceLink(links).id(d => d.id))
-    .force("charge", d3.forceManyBody().strength(d => {
-        const scalingFactor = 5 * Math.sqrt(width * height) / nodes.length; // Normalize by graph area and node count
-        return -d.weight * scalingFactor;
-    }))
-    .force("x", d3.forceX())
-    .force("y", d3.forceY());
-
-// Draw links
-const link = svg.append("g")
-    .attr("class", "links")
-    .selectAll("line")
-    .data(links)
-    .enter().append("line")
-    .attr("class", "link");
-
+let simulation;
 let lastNodeHovered;
 let lastNodeGroup;
 let lastPaper;
 
-const sizeScalingFactor = 2 * Math.max(width, height) / Math.min(width, height);
-
-// Draw nodes
-const node = svg.append("g")
-    .attr("class", "nodes")
-    .selectAll("circle")
-    .data(nodes)
-    .enter().append("circle")
-    .attr("class", "node")
-    .attr("r", d => d.weight * sizeScalingFactor)
-    .attr("fill", d => color(d.group))
-    .call(d3.drag()
-        .on("start", dragStarted)
-        .on("drag", dragged)
-        .on("end", dragEnded)
-    ).on("mouseenter", (event, d) => {
-        if (!isDragging) {
-            if (event.currentTarget !== lastNodeHovered) {
-                d3.select(lastNodeHovered).style("fill", color(lastNodeGroup))
-            }
+// The graph is fetched separately from the page, so it can be cached by the browser.
+// A busy server answers 503 with a Retry-After header, so try again a few times after waiting.
+// Any other failure (or a 503 once the attempts run out) has a text body, so it is shown instead of the graph.
+function fetchGraph(attempts) {
+    fetch(graphUrl).then(response => {
+        if (response.status === 503 && attempts > 1) {
+            const delay = 1000 * (parseInt(response.headers.get("Retry-After")) || 1);
+            setTimeout(() => fetchGraph(attempts - 1), delay);
+            return;
+        }
+        if (!response.ok) {
+            showGraphError(`The graph could not be loaded (${response.status} ${response.statusText}).`);
+            return;
+        }
+        response.json().then(graph => drawGraph(graph.nodes, graph.links));
+    }).catch(() => showGraphError("The graph could not be loaded (the server is unreachable)."));
+}
 
-            label.filter(l => l.id === d.id).style("display", "block");
-            document.getElementById("paper-title").innerText = d.title;
-            document.getElementById("paper-author").innerText = d.authors[0];
-            d3.select(event.currentTarget).style("fill", "rgb(98, 255, 0)");
+function showGraphError(message) {
+    document.getElementById("paper-title").innerText = message;
+}
 
-            document.getElementById("abstract-toggle").style.visibility = "visible";
+fetchGraph(5);
+
+function drawGraph(nodes, links) {
+    simulation = d3.forceSimulation(nodes)
+        .force("link", d3.forceLink(links).id(d => d.id))
+        .force("charge", d3.forceManyBody().strength(d => {
+            const scalingFactor = 5 * Math.sqrt(width * height) / nodes.length; // Normalize by graph area and node count
+            return -d.weight * scalingFactor;
+        }))
+        .force("x", d3.forceX())
+        .force("y", d3.forceY());
+
+    // Draw links
+    const link = svg.append("g")
+        .attr("class", "links")
+        .selectAll("line")
+        .data(links)
+        .enter().append("line")
+        .attr("class", "link");
+
+    const sizeScalingFactor = 2 * Math.max(width, height) / Math.min(width, height);
+
+    // Draw nodes
+    const node = svg.append("g")
+        .attr("class", "nodes")
+        .selectAll("circle")
+        .data(nodes)
+        .enter().append("circle")
+        .attr("class", "node")
+        .attr("r", d => d.weight * sizeScalingFactor)
+        .attr("fill", d => color(d.group))
+        .call(d3.drag()
+            .on("start", dragStarted)
+            .on("drag", dragged)
+            .on("end", dragEnded)
+        ).on("mouseenter", (event, d) => {
+            if (!isDragging) {
+                if (event.currentTarget !== lastNodeHovered) {
+                    d3.select(lastNodeHovered).style("fill", color(lastNodeGroup))
+                }
+
+                label.filter(l => l.id === d.id).style("display", "block");
+                document.getElementById("paper-title").innerText = d.title;
+                document.getElementById("paper-author").innerText = d.author;
+                d3.select(event.currentTarget).style("fill", "rgb(98, 255, 0)");
+
+                document.getElementById("abstract-toggle").style.visibility = "visible";
+
+                lastNodeHovered = event.currentTarget;
+                lastNodeGroup = d.group;
+                lastPaper = d;
+
+                if (document.getElementById("abstract-toggle").innerText === "Hide Abstract") {
+                    showAbstract(d);
+                }
 
-            if (document.getElementById("abstract-toggle").innerText === "Hide Abstract") {
-                document.getElementById("paper-abstract").innerText = truncateString(d.abstract);
             }
-
-            lastNodeHovered = event.currentTarget;
-            lastNodeGroup = d.group;
-            lastPaper = d;
-
-        }
-    })
-    .on("mouseleave", (event, d) => {
-        if (!isDragging) {
-            label.filter(l => l.id === d.id).style("display", "none");
-        }
-    })
-    .on('click', (event, d) => {
-        const title = encodeURIComponent(d.title);
-        const author = encodeURIComponent(d.authors[0]);
-        window.open(`/loading?title=${title}&author=${author}`, '_blank');
-    });
-
-// Add labels
-const label = svg.append("g")
-    .attr("class", "labels")
-    .selectAll("text")
-    .data(nodes)
-    .enter().append("text")
-    .attr("class", "label")
-    .text(d => d.title).style("display", "none");
-
-const centerX = 0; // Center of the graph
-const centerY = 0;
-const radius = Math.min(width, height) / 2.1; // Define the circle's radius
-
-simulation.on("tick", () => {
-    link
-        .attr("x1", d => d.source.x)
-        .attr("y1", d => d.source.y)
-        .attr("x2", d => d.target.x)
-        .attr("y2", d => d.target.y);
-
-    node
-        .attr("cx", d => {
-            const dx = d.x - centerX; // horizontal distance from centre
-            const dy = d.y - centerY; // vertical distance from centre
-
-            // i.e. Pythagorean Theorem; if dx^2 + dy^2 > r^2, we are outside the radius of the circle, so adjust
-            // Otherwise, position is valid, so keep current position
-            if (dx * dx + dy * dy > radius * radius) {
-                const angle = Math.atan2(dy, dx);
-                d.x = centerX + radius * Math.cos(angle); // Positions node on x-coordinate boundary corresponding to angle
-                d.y = centerY + radius * Math.sin(angle); // Positions node on y-coordinate boundary corresponding to angle
+        })
+        .on("mouseleave", (event, d) => {
+            if (!isDragging) {
+                label.filter(l => l.id === d.id).style("display", "none");
             }
-            return d.x;
         })
-        .attr("cy", d => d.y);
-
-    label
-        .attr("x", d => d.x + d.weight * 3.2)
-        .attr("y", d => d.y);
-});
+        .on('click', (event, d) => {
+            const title = encodeURIComponent(d.title);
+            const author = encodeURIComponent(d.author);
+            window.open(`/loading?title=${title}&author=${author}`, '_blank');
+        });
+
+    // Add labels
+    const label = svg.append("g")
+        .attr("class", "labels")
+        .selectAll("text")
+        .data(nodes)
+        .enter().append("text")
+        .attr("class", "label")
+        .text(d => d.title).style("display", "none");
+
+    const centerX = 0; // Center of the graph
+    const centerY = 0;
+    const radius = Math.min(width, height) / 2.1; // Define the circle's radius
+
+    simulation.on("tick", () => {
+        link
+            .attr("x1", d => d.source.x)
+            .attr("y1", d => d.source.y)
+            .attr("x2", d => d.target.x)
+            .attr("y2", d => d.target.y);
+
+        node
+            .attr("cx", d => {
+                const dx = d.x - centerX; // horizontal distance from centre
+                const dy = d.y - centerY; // vertical distance from centre
+
+                // i.e. Pythagorean Theorem; if dx^2 + dy^2 > r^2, we are outside the radius of the circle, so adjust
+                // Otherwise, position is valid, so keep current position
+                if (dx * dx + dy * dy > radius * radius) {
+                    const angle = Math.atan2(dy, dx);
+                    d.x = centerX + radius * Math.cos(angle); // Positions node on x-coordinate boundary corresponding to angle
+                    d.y = centerY + radius * Math.sin(angle); // Positions node on y-coordinate boundary corresponding to angle
+                }
+                return d.x;
+            })
+            .attr("cy", d => d.y);
+
+        label
+            .attr("x", d => d.x + d.weight * 3.2)
+            .attr("y", d => d.y);
+    });
+}
 
 // Dragging behavior
 function dragStarted(event, d) {
@@ -152,6 +179,21 @@ function updateSearchHistory(searchHistory) {
 
 }
 
+// Abstracts are not in the graph payload; each one is fetched the first time it is shown
+const paperDetails = new Map();
+
+function showAbstract(paper) {
+    if (!paperDetails.has(paper.id)) {
+        paperDetails.set(paper.id, fetch(`/paper/${encodeURIComponent(paper.id)}`).then(response => response.json()));
+    }
+    paperDetails.get(paper.id).then(details => {
+        // The user may have moved to another paper or hidden the abstract in the meantime
+        if (lastPaper === paper && abstractBtn.innerText === "Hide Abstract") {
+            document.getElementById("paper-abstract").innerText = truncateString(details.abstract);
+        }
+    });
+}
+
 function truncateString(s) {
     const maxLength = 200;
 
@@ -181,7 +223,7 @@ abstractBtn.addEventListener("click", function (event) {
     if (abstractBtn.innerText === toggleOnText) {
         abstractBtn.innerText = toggleOffText;
 
-        abstractText.innerText = truncateString(lastPaper.abstract);
+        showAbstract(lastPaper);
 
     } else {
         abstractBtn.innerText = toggleOnText;
@@ -3,9 +3,13 @@ from flask import Flask
 
 from dotenv import load_dotenv
 
-load_dotenv() # This has to go before importing the routes because kaggle runs its authentication on import (i.e. after importing main_routes)
+load_dotenv()  # This has to go before importing the routes, which read their settings from the environment on import
 
-from routes import main_routes
+from logging_config import configure_logging
+
+configure_logging()  # Also before importing the routes, which log on import
+
+from routes import WARMUP, main_routes
 
 
 app = Flask(__name__)
@@ -32,5 +36,6 @@ def create_app():
 if __name__ == '__main__':
 
     app = create_app()
+    WARMUP.start()  # Load the index now rather than on the first request
 
     app.run(host='127.0.0.1', port=8080)
@@ -0,0 +1,277 @@
+"""CSC111 Winter 2025 Project 2: Search Coordinator
+This module contains the SearchCoordinator class, which answers the searches of the app from a list of shard servers
+(see shard_server.py) instead of a local index.
+It is responsible for sending every request to the shards concurrently with a timeout per shard (scatter), merging
+their top papers into the top papers of the whole corpus (gather), looking up the papers of the query graph on the
+shards that hold them, and degrading gracefully when a shard is down or slow: its papers are left out of the results.
+The generation of the results is the set of shards answering and their index versions, the same in every process that
+sees the same shards, so a cached or client-side (ETag) result is only reused for the shards it was built from.
+"""
+
+from __future__ import annotations
+
+import dataclasses
+import logging
+import math
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Any, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from executor import SearchOverloaded
+from graph import Graph, Paper
+from incremental import IndexSnapshot
+from metrics import RESULT_PAPERS, SHARD_REQUESTS, SHARD_SECONDS, STAGE_SECONDS
+from search import build_query_graph, rank_by_citations
+from sharding import shard_of
+
+logger = logging.getLogger(__name__)
+
+# The number of requests sent to every shard at the same time by a worker process
+CONNECTIONS_PER_SHARD = 4
+
+# The generation of the results of a coordinator: the sorted (shard, index version) of every shard answering
+Generation = tuple[tuple[int, str], ...]
+
+
+class ShardsChanged(SearchOverloaded):
+    """Raised when the shards answering a search are not those of the generation it was started in (a shard went
+    missing, came back, or changed version meanwhile), so that its result is not cached under that generation."""
+
+
+class SearchCoordinator:
+    """Answers searches by scattering them to shard servers and gathering their answers.
+
+    Shard i of shard_urls must serve shard i of len(shard_urls) shards; the answers of a shard serving another one are
+    rejected.
+
+    Instance Attributes:
+        - shard_urls: The base URL of the server of every shard.
+        - timeout: The number of seconds to wait for the shards to answer a request; a shard that has not answered by
+          then is left out of the answer.
+        - retry_interval: The number of seconds between two checks of whether the missing shards are back.
+    """
+    shard_urls: list[str]
+    timeout: float
+    retry_interval: float
+    # Private Instance Attributes:
+    #     - _session: The HTTP session, which keeps a pool of connections to every shard alive between requests.
+    #     - _pool: The threads sending the requests to the shards, created on first use (after gunicorn forks).
+    #     - _lock: Guards _pool, _missing, _versions and _last_check.
+    #     - _missing: The shards that failed to answer the last request sent to them, or never answered.
+    #     - _versions: The version of the index of every shard that answered.
+    #     - _last_check: The time the missing shards were last checked.
+    _session: requests.Session
+    _pool: Optional[ThreadPoolExecutor]
+    _lock: threading.Lock
+    _missing: set[int]
+    _versions: dict[int, str]
+    _last_check: float
+
+    def __init__(self, shard_urls: list[str], timeout: float = 2, retry_interval: float = 5) -> None:
+        self.shard_urls = [url.rstrip('/') for url in shard_urls]
+        self.timeout = timeout
+        self.retry_interval = retry_interval
+        self._session = requests.Session()
+        # Never retry: a shard that fails is left out at once, and checked again later
+        adapter = HTTPAdapter(pool_connections=len(shard_urls), pool_maxsize=CONNECTIONS_PER_SHARD, max_retries=0)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+        self._pool = None
+        self._lock = threading.Lock()
+        # Every shard is checked by the first snapshot
+        self._missing = set(range(len(shard_urls)))
+        self._versions = {}
+        self._last_check = -math.inf
+
+    def snapshot(self) -> IndexSnapshot:
+        """Return a snapshot of the current generation of the results (see Generation); the coordinator holds no
+        graph, model or corpus of its own.
+
+        If shards are missing, they are checked first (at most once every retry_interval seconds), so that the
+        results are complete again soon after they are back.
+        """
+        with self._lock:
+            check = bool(self._missing) and time.monotonic() - self._last_check >= self.retry_interval
+            if check:
+                self._last_check = time.monotonic()
+        if check:
+            self._scatter({shard: ('GET', '/shard', {}) for shard in sorted(self._missing)})
+        with self._lock:
+            return IndexSnapshot(None, None, None, self._generation())
+
+    def missing_shards(self) -> list[int]:
+        """Return the shards that failed to answer the last request sent to them."""
+        with self._lock:
+            return sorted(self._missing)
+
+    def top_n(self, query: str, n: int = 200, filters: Optional[tuple[str, str, str]] = None,
+              generation: Optional[Generation] = None) -> list[list]:
+        """Return the [paper id, title, BM25 score, number of citing papers, first references] of the top n papers of
+        the available shards for query, among those passing the filters if given, in the order of
+        BM25.get_top_n_paper_score.
+
+        If generation is given, only its shards are asked, and ShardsChanged is raised unless they all answer with its
+        versions.
+        """
+        params = {'query': query, 'n': n}
+        if filters is not None:
+            params.update(zip(('citations_filter', 'author_filter', 'venue_filter'), filters))
+        shards = range(len(self.shard_urls)) if generation is None else [shard for shard, _ in generation]
+        answers = self._scatter({shard: ('GET', '/shard/topk', {'params': params}) for shard in shards})
+        _check_generation(generation, answers)
+
+        hits = [hit for answer in answers.values() for hit in answer['hits']]
+        # By decreasing score, then by csv position (the dense id of a single index)
+        hits.sort(key=lambda hit: (-hit[3], hit[0]))
+        return [[paper_id, title, score, in_degree, references]
+                for _, paper_id, title, score, in_degree, references in hits[:n]]
+
+    def papers(self, paper_ids: list[str], generation: Optional[Generation] = None) -> dict[str, Paper]:
+        """Return the papers with the given ids that are in the available shards, by paper id.
+
+        If generation is given, only the papers of its shards are looked up, and ShardsChanged is raised unless the
+        shards asked all answer with its versions.
+        """
+        by_shard = {}
+        for paper_id in dict.fromkeys(paper_ids):
+            by_shard.setdefault(shard_of(paper_id, len(self.shard_urls)), []).append(paper_id)
+        if generation is not None:
+            versions = dict(generation)
+            by_shard = {shard: ids for shard, ids in by_shard.items() if shard in versions}
+        answers = self._scatter({shard: ('POST', '/shard/papers', {'json': {'ids': ids}})
+                                 for shard, ids in by_shard.items()})
+        if generation is not None:
+            _check_generation(tuple((shard, versions[shard]) for shard in sorted(by_shard)), answers)
+        return {fields['paper_id']: paper_from_fields(fields)
+                for answer in answers.values() for fields in answer['papers']}
+
+    def paper(self, paper_id: str, generation: Optional[Generation] = None) -> Optional[Paper]:
+        """Return the paper with the given id, or None if it is not in its shard or its shard is not available (or,
+        if generation is given, not one of its shards)."""
+        return self.papers([paper_id], generation).get(paper_id)
+
+    def query_graph(self, query: str, filters: Optional[tuple[str, str, str]] = None, n: int = 200,
+                    generation: Optional[Generation] = None) -> Graph:
+        """Return the query graph of query, built like search.return_query from the papers of the available shards,
+        with its top papers chosen among those passing the filters if given.
+
+        The top papers are expanded to their references only: their citing papers are spread over all the shards.
+        If generation is given, the graph is built from its shards only, and ShardsChanged is raised unless they all
+        answer with its versions, so that the graph is exactly the one of that generation.
+        """
+        with STAGE_SECONDS.time(stage='bm25'):
+            hits = self.top_n(query, n, filters, generation)
+
+        with STAGE_SECONDS.time(stage='rerank'):
+            references = {hit[0]: hit.pop() for hit in hits}
+            weighted_papers = rank_by_citations(hits)
+
+        with STAGE_SECONDS.time(stage='graph_build'):
+            wanted = [paper[0] for paper in weighted_papers]
+            wanted.extend(reference for paper in weighted_papers for reference in references[paper[0]])
+            papers = Graph()
+            for paper in self.papers(wanted, generation).values():
+                papers.add_vertex(paper)
+            query_graph = build_query_graph(papers, [paper for paper in weighted_papers
+                                                     if paper[0] in papers.get_all_item_vertex_mappings()])
+
+        RESULT_PAPERS.observe(len(query_graph.get_all_item_vertex_mappings()))
+        return query_graph
+
+    def _scatter(self, calls: dict[int, tuple[str, str, dict[str, Any]]]) -> dict[int, dict]:
+        """Send the (method, path, requests keyword arguments) request of every shard of calls to it at the same time,
+        and return the JSON answers of the shards that answered in time, by shard."""
+        if not calls:
+            return {}
+        pool = self._get_pool()
+        futures = {shard: pool.submit(self._call, shard, *call) for shard, call in calls.items()}
+        done, _ = wait(futures.values(), timeout=self.timeout)
+
+        answers = {}
+        for shard, future in futures.items():
+            outcome = 'ok' if future in done and future.exception() is None else \
+                'error' if future in done else 'timeout'
+            SHARD_REQUESTS.inc(shard=str(shard), outcome=outcome)
+            if outcome == 'ok':
+                answers[shard] = future.result()
+            else:
+                logger.warning('shard request failed', extra={'shard': shard, 'url': self.shard_urls[shard],
+                                                              'outcome': outcome, 'error': _error_of(future)})
+        self._record(set(calls), answers)
+        return answers
+
+    def _call(self, shard: int, method: str, path: str, kwargs: dict[str, Any]) -> dict:
+        """Return the JSON answer of shard to the request, checking that it comes from the right shard."""
+        with SHARD_SECONDS.time(shard=str(shard)):
+            response = self._session.request(method, self.shard_urls[shard] + path, timeout=self.timeout, **kwargs)
+        response.raise_for_status()
+        answer = response.json()
+        if (answer.get('shard'), answer.get('shards')) != (shard, len(self.shard_urls)):
+            raise ValueError(f"{self.shard_urls[shard]} serves shard {answer.get('shard')} of "
+                             f"{answer.get('shards')}, not shard {shard} of {len(self.shard_urls)}")
+        return answer
+
+    def _record(self, asked: set[int], answers: dict[int, dict]) -> None:
+        """Record which of the asked shards answered, and their versions."""
+        with self._lock:
+            missing = (self._missing - asked) | (asked - set(answers))
+            for shard in sorted(missing ^ self._missing):
+                log = logger.warning if shard in missing else logger.info
+                log('shard missing' if shard in missing else 'shard up', extra={'shard': shard,
+                                                                                'url': self.shard_urls[shard]})
+            self._missing = missing
+            self._versions.update((shard, answer['version']) for shard, answer in answers.items())
+
+    def _generation(self) -> Generation:
+        """Return the current generation of the results: the (shard, version) of every shard answering, in order.
+
+        Preconditions:
+            - self._lock is held by the calling thread.
+        """
+        return tuple((shard, self._versions[shard]) for shard in sorted(self._versions) if shard not in self._missing)
+
+    def _get_pool(self) -> ThreadPoolExecutor:
+        """Return the threads sending the requests to the shards, creating them on first use."""
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=CONNECTIONS_PER_SHARD * len(self.shard_urls),
+                                                thread_name_prefix='shard')
+            return self._pool
+
+
+def _check_generation(generation: Optional[Generation], answers: dict[int, dict]) -> None:
+    """Raise ShardsChanged unless the shards of generation are those that answered, with its versions (or generation
+    is None).
+
+    >>> _check_generation(((0, 'a'),), {0: {'version': 'a'}})
+    >>> _check_generation(((0, 'a'), (1, 'b')), {0: {'version': 'a'}})
+    Traceback (most recent call last):
+    coordinator.ShardsChanged: the shards answering changed during the search
+    """
+    if generation is not None and generation != tuple((shard, answers[shard]['version']) for shard in sorted(answers)):
+        raise ShardsChanged('the shards answering changed during the search')
+
+
+def paper_from_fields(fields: dict) -> Paper:
+    """Return the paper with the given fields, as answered by a shard server (see shard_server.ShardIndex.papers)."""
+    return Paper(**{field.name: fields[field.name] for field in dataclasses.fields(Paper)})
+
+
+def _error_of(future: Future) -> str:
+    """Return a description of why the request of future failed."""
+    if not future.done():
+        return 'no answer in time'
+    return repr(future.exception())
+
+
+def parse_shard_urls(value: str) -> list[str]:
+    """Return the shard URLs of a comma-separated list, in order.
+
+    >>> parse_shard_urls('http://a:8100, http://b:8100,')
+    ['http://a:8100', 'http://b:8100']
+    """
+    return [url.strip() for url in value.split(',') if url.strip()]
@@ -0,0 +1,275 @@
+"""CSC111 Winter 2025 Project 2: DOI Resolution
+This module contains the DOIResolver class, which finds the DOI link of a paper from its title and first author.
+It is responsible for querying Crossref through a pooled HTTP session with strict timeouts, caching the answers
+(including the papers that have no DOI) in SQLite across restarts and gunicorn workers, making concurrent lookups of the
+same paper share one request, and prefetching the DOIs of the papers most likely to be clicked in the background.
+"""
+
+from __future__ import annotations
+
+import os
+import sqlite3
+import threading
+import time
+from collections.abc import Iterable
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from metrics import CACHE_REQUESTS
+from utils import is_partial_match
+
+DEFAULT_CROSSREF_URL = 'https://api.crossref.org'
+DEFAULT_DOI_CACHE_PATH = '../data/cache/doi.sqlite3'
+
+
+class DOICache:
+    """A persistent map from (title, author) keys to DOI links in a SQLite database.
+
+    A key mapped to None records that the paper has no DOI (a negative entry); negative entries expire after
+    negative_ttl seconds, so papers that are indexed by Crossref later are found eventually. Every thread (and process)
+    opens its own connection, and the database is in WAL mode so that readers never wait for a writer.
+
+    Instance Attributes:
+        - path: The path of the SQLite database file.
+        - negative_ttl: The number of seconds a negative entry is valid for.
+    """
+    path: str
+    negative_ttl: float
+    # Private Instance Attributes:
+    #     - _local: Holds the (process id, connection) of each thread.
+    _local: threading.local
+
+    def __init__(self, path: str = DEFAULT_DOI_CACHE_PATH, negative_ttl: float = 7 * 24 * 3600) -> None:
+        self.path = path
+        self.negative_ttl = negative_ttl
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        """Return the connection of this thread, opening it (and creating the table) on first use."""
+        pid, connection = getattr(self._local, 'connection', (None, None))
+        if pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=5)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS dois '
+                               '(key TEXT PRIMARY KEY, url TEXT, resolved_at REAL NOT NULL)')
+            connection.commit()
+            self._local.connection = (os.getpid(), connection)
+        return connection
+
+    def get(self, key: str) -> tuple[bool, Optional[str]]:
+        """Return (True, DOI link or None) if key has a valid entry, and (False, None) otherwise."""
+        row = self._connection().execute('SELECT url, resolved_at FROM dois WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return False, None
+        url, resolved_at = row
+        if url is None and time.time() - resolved_at > self.negative_ttl:
+            return False, None
+        return True, url
+
+    def put(self, key: str, url: Optional[str]) -> None:
+        """Record the DOI link of key, or that it has none if url is None."""
+        connection = self._connection()
+        connection.execute('INSERT OR REPLACE INTO dois (key, url, resolved_at) VALUES (?, ?, ?)',
+                           (key, url, time.time()))
+        connection.commit()
+
+
+class DOIResolver:
+    """Finds the DOI links of papers on Crossref (or a compatible server at base_url).
+
+    Instance Attributes:
+        - base_url: The base URL of the Crossref REST API.
+        - timeout: The (connect, read) timeouts of every request, in seconds.
+        - cache: The persistent cache of resolved DOI links.
+    """
+    base_url: str
+    timeout: tuple[float, float]
+    cache: DOICache
+    # Private Instance Attributes:
+    #     - _session: The HTTP session, which keeps a pool of connections to base_url alive between requests.
+    #     - _in_flight: Maps the key of every lookup in progress to the future of its DOI link.
+    #     - _in_flight_lock: Guards _in_flight, _prefetching and _prefetcher.
+    #     - _prefetch_workers: The number of background prefetch threads.
+    #     - _prefetch_backlog: The maximum number of prefetch lookups waiting or in progress.
+    #     - _prefetching: The keys of the prefetch lookups waiting or in progress.
+    #     - _prefetcher: The executor of prefetch lookups, created on first use (after gunicorn forks the workers).
+    _session: requests.Session
+    _in_flight: dict[str, Future]
+    _in_flight_lock: threading.Lock
+    _prefetch_workers: int
+    _prefetch_backlog: int
+    _prefetching: set[str]
+    _prefetcher: Optional[ThreadPoolExecutor]
+
+    def __init__(self, base_url: str = DEFAULT_CROSSREF_URL, cache: Optional[DOICache] = None,
+                 connect_timeout: float = 3.05, read_timeout: float = 10, pool_size: int = 8,
+                 prefetch_workers: int = 2, prefetch_backlog: int = 32) -> None:
+        self.base_url = base_url.rstrip('/')
+        self.timeout = (connect_timeout, read_timeout)
+        self.cache = cache if cache is not None else DOICache()
+        self._session = requests.Session()
+        # Retry a failed connection once, but never a slow read, so a request takes at most about connect + read seconds
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=Retry(total=1, connect=1, read=0))
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+        self._in_flight = {}
+        self._in_flight_lock = threading.Lock()
+        self._prefetch_workers = prefetch_workers
+        self._prefetch_backlog = prefetch_backlog
+        self._prefetching = set()
+        self._prefetcher = None
+
+    def resolve(self, title: str, author: str) -> Optional[str]:
+        """Return the DOI link of the paper with the given title and author, or None if it has none.
+
+        The answer comes from the cache if possible. Otherwise, a single request is made for all the threads of this
+        process looking up the same paper at the same time, and its answer is cached.
+
+        Raise requests.exceptions.RequestException if Crossref cannot be reached or does not answer in time; failures
+        are not cached.
+
+        Against a stub Crossref server, which answers papers whose title contains 'slow' after 0.5 seconds and has no
+        DOI for those whose title contains 'missing':
+
+        >>> import json, tempfile
+        >>> from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        >>> paths = []
+        >>> class StubCrossref(BaseHTTPRequestHandler):
+        ...     def do_GET(self) -> None:
+        ...         paths.append(self.path)
+        ...         time.sleep(0.5 if 'slow' in self.path else 0.1)
+        ...         items = [] if 'missing' in self.path else [{'title': ['Deep Learning'], 'URL': 'https://doi.org/1'}]
+        ...         body = json.dumps({'message': {'items': items}}).encode()
+        ...         self.send_response(200)
+        ...         self.send_header('Content-Length', str(len(body)))
+        ...         self.end_headers()
+        ...         self.wfile.write(body)
+        ...     def log_message(self, *args) -> None:
+        ...         pass
+        >>> server = ThreadingHTTPServer(('127.0.0.1', 0), StubCrossref)
+        >>> threading.Thread(target=server.serve_forever, daemon=True).start()
+        >>> cache = DOICache(os.path.join(tempfile.mkdtemp(), 'doi.sqlite3'))
+        >>> resolver = DOIResolver(f'http://127.0.0.1:{server.server_port}', cache, read_timeout=0.3)
+
+        Concurrent lookups of the same paper share one request, and the answer is cached:
+
+        >>> with ThreadPoolExecutor(max_workers=4) as pool:
+        ...     urls = list(pool.map(lambda _: resolver.resolve('Deep  Learning', 'Yann LeCun'), range(4)))
+        >>> urls, len(paths)
+        (['https://doi.org/1', 'https://doi.org/1', 'https://doi.org/1', 'https://doi.org/1'], 1)
+        >>> resolver.resolve('deep learning', 'yann lecun'), len(paths)
+        ('https://doi.org/1', 1)
+
+        A paper without a DOI is cached too (as a negative entry):
+
+        >>> resolver.resolve('A missing paper', 'Someone'), resolver.resolve('A missing paper', 'Someone'), len(paths)
+        (None, None, 2)
+
+        A lookup that takes longer than the read timeout fails, in every thread waiting for it, and is not cached:
+
+        >>> def lookup_slow_paper(_: int) -> str:
+        ...     try:
+        ...         return resolver.resolve('A slow paper', 'Someone')
+        ...     except requests.exceptions.RequestException:
+        ...         return 'failed'
+        >>> with ThreadPoolExecutor(max_workers=2) as pool:
+        ...     list(pool.map(lookup_slow_paper, range(2)))
+        ['failed', 'failed']
+        >>> cache.get(cache_key('A slow paper', 'Someone'))
+        (False, None)
+        >>> server.shutdown()
+        """
+        key = cache_key(title, author)
+        found, url = self.cache.get(key)
+        CACHE_REQUESTS.inc(cache='doi', result='hit' if found else 'miss')
+        if found:
+            return url
+
+        with self._in_flight_lock:
+            future = self._in_flight.get(key)
+            is_leader = future is None
+            if is_leader:
+                future = Future()
+                self._in_flight[key] = future
+
+        if not is_leader:
+            try:
+                return future.result(timeout=sum(self.timeout))
+            except FutureTimeoutError:
+                raise requests.exceptions.Timeout(f'Timed out waiting for the DOI lookup of {title!r}') from None
+
+        try:
+            url = self._lookup(title, author)
+            self.cache.put(key, url)
+            future.set_result(url)
+            return url
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._in_flight_lock:
+                del self._in_flight[key]
+
+    def _lookup(self, title: str, author: str) -> Optional[str]:
+        """Return the DOI link of the best Crossref match for title and author, if its title matches title."""
+        response = self._session.get(f'{self.base_url}/works',
+                                     params={'query.title': title, 'query.author': author, 'rows': 1},
+                                     timeout=self.timeout)
+        response.raise_for_status()
+        items = response.json().get('message', {}).get('items', [])
+        if items:
+            doi_title = (items[0].get('title') or [''])[0]
+            doi_url = items[0].get('URL', None)
+            if doi_url and is_partial_match(title, doi_title):
+                return doi_url
+        return None
+
+    def prefetch(self, papers: Iterable[tuple[str, str]]) -> None:
+        """Resolve the (title, author) papers in background threads, so that clicking them is answered from the
+        cache. Lookups that fail are skipped.
+
+        The papers already cached or being looked up are skipped. At most prefetch_backlog lookups wait or run at a
+        time, and the papers beyond that are dropped: the prefetch threads answer far fewer lookups than new result
+        graphs ask for under load, and a lookup that waits too long is only done after its paper could be clicked.
+        """
+        with self._in_flight_lock:
+            if self._prefetcher is None:
+                self._prefetcher = ThreadPoolExecutor(max_workers=self._prefetch_workers,
+                                                      thread_name_prefix='doi-prefetch')
+            prefetcher = self._prefetcher
+        for title, author in papers:
+            key = cache_key(title, author)
+            if self.cache.get(key)[0]:
+                continue
+            with self._in_flight_lock:
+                if len(self._prefetching) >= self._prefetch_backlog:
+                    return
+                if key in self._prefetching or key in self._in_flight:
+                    continue
+                self._prefetching.add(key)
+            prefetcher.submit(self._prefetch_one, key, title, author)
+
+    def _prefetch_one(self, key: str, title: str, author: str) -> None:
+        """Resolve one paper, whose cache key is key, for prefetch, ignoring failures."""
+        try:
+            self.resolve(title, author)
+        except requests.exceptions.RequestException:
+            pass
+        finally:
+            with self._in_flight_lock:
+                self._prefetching.discard(key)
+
+
+def cache_key(title: str, author: str) -> str:
+    """Return the cache key of a paper: its title and author, lowercased and with whitespace collapsed.
+
+    >>> cache_key(' Deep  Learning ', 'Yann LeCun')
+    'deep learning\\x1fyann lecun'
+    """
+    return ' '.join(title.lower().split()) + '\x1f' + ' '.join(author.lower().split())
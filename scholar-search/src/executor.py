@@ -0,0 +1,119 @@
+"""CSC111 Winter 2025 Project 2: Search Executor
+This module contains the SearchExecutor class, which runs the CPU-bound part of the searches of a worker process.
+It is responsible for making concurrent identical searches share one computation (single flight), running the
+computations on a bounded pool of threads, and rejecting new searches at once when too many are already waiting
+(load shedding), so that a burst of searches neither multiplies the work nor makes every other request wait behind it.
+"""
+
+from __future__ import annotations
+
+import threading
+from collections.abc import Hashable
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Any, Callable, Optional
+
+from metrics import SEARCH_QUEUE_DEPTH, SEARCHES
+
+try:
+    from gevent import monkey as gevent_monkey
+    from gevent.threadpool import ThreadPoolExecutor as GeventThreadPoolExecutor
+except ImportError:
+    gevent_monkey = None
+
+
+class SearchOverloaded(Exception):
+    """Raised when a search is rejected because too many searches are waiting, or is not done in time.
+
+    Instance Attributes:
+        - retry_after: The number of seconds the client should wait before trying again.
+    """
+    retry_after: int
+
+    def __init__(self, message: str, retry_after: int = 1) -> None:
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class SearchExecutor:
+    """Runs searches on a bounded thread pool, sharing the computation of identical concurrent searches.
+
+    Under gevent (when the threading module is monkey-patched), the pool is made of real threads from gevent's
+    threadpool, so that the computations do not block the event loop serving the other requests.
+
+    Instance Attributes:
+        - max_workers: The number of searches computed at the same time.
+        - max_queue: The number of searches that may wait for a thread; more are rejected with SearchOverloaded.
+        - timeout: The number of seconds a request waits for its search before giving up with SearchOverloaded.
+    """
+    max_workers: int
+    max_queue: int
+    timeout: float
+    # Private Instance Attributes:
+    #     - _pool: The thread pool, created on first use (after gunicorn forks the workers).
+    #     - _in_flight: Maps the key of every search being computed or waiting to the future of its result.
+    #     - _lock: Guards _pool and _in_flight.
+    _pool: Optional[ThreadPoolExecutor]
+    _in_flight: dict[Hashable, Future]
+    _lock: threading.Lock
+
+    def __init__(self, max_workers: int = 2, max_queue: int = 8, timeout: float = 30) -> None:
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._pool = None
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def run(self, key: Hashable, compute: Callable[[], Any], inline: bool = False) -> Any:
+        """Return compute(), computed on the pool, or the result of the search with the same key in progress.
+
+        If inline is True, compute() is called in the calling thread instead, e.g. so that a profiler of the calling
+        thread sees it.
+
+        Raise SearchOverloaded without computing anything if max_workers + max_queue searches are already in
+        progress, or if the result is not ready after timeout seconds (the computation goes on, and requests with the
+        same key arriving meanwhile still share it).
+        """
+        if inline:
+            return compute()
+
+        with self._lock:
+            future = self._in_flight.get(key)
+            is_leader = future is None
+            if is_leader:
+                if len(self._in_flight) >= self.max_workers + self.max_queue:
+                    SEARCHES.inc(outcome='shed')
+                    raise SearchOverloaded(f'{len(self._in_flight)} searches in progress')
+                future = self._get_pool().submit(compute)
+                self._in_flight[key] = future
+                SEARCH_QUEUE_DEPTH.set(len(self._in_flight))
+        SEARCHES.inc(outcome='computed' if is_leader else 'coalesced')
+        if is_leader:
+            # Outside of the lock, since the callback runs at once if the search is already done
+            future.add_done_callback(lambda _: self._done(key))
+
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            raise SearchOverloaded(f'search not done after {self.timeout} seconds', retry_after=5) from None
+
+    def _done(self, key: Hashable) -> None:
+        """Forget the search with the given key, which is done."""
+        with self._lock:
+            self._in_flight.pop(key, None)
+            SEARCH_QUEUE_DEPTH.set(len(self._in_flight))
+
+    def _get_pool(self) -> ThreadPoolExecutor:
+        """Return the thread pool, creating it on first use."""
+        if self._pool is None:
+            if gevent_monkey is not None and gevent_monkey.is_module_patched('threading'):
+                self._pool = GeventThreadPoolExecutor(max_workers=self.max_workers)
+            else:
+                self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='search')
+        return self._pool
+
+    def in_flight(self) -> int:
+        """Return the number of searches being computed or waiting for a thread."""
+        with self._lock:
+            return len(self._in_flight)
@@ -0,0 +1,116 @@
+"""CSC111 Winter 2025 Project 2: Filter Indexes
+This module contains the FilterIndex class, the inverted indexes of the author, venue and citations filters.
+It is responsible for turning the filters of a search into a bitmap of the papers that pass them, so that the BM25 top
+papers are chosen among the matching papers only, instead of the filters hiding papers after the top papers are cut.
+"""
+
+from __future__ import annotations
+
+import hashlib
+from array import array
+from typing import Optional
+
+import numpy as np
+
+from graph import CompactGraph
+from search import paper_filter
+
+
+class FilterIndex:
+    """Inverted indexes from authors and venues to the dense ids of their papers, and a sorted citation column.
+
+    Authors are keyed by a 64-bit hash of their name, so the index holds no Python strings; the papers of a hash are
+    checked against the name, so a (very unlikely) collision never lets another author's paper through.
+
+    Instance Attributes:
+        - doc_count: The number of papers indexed (the papers of the graph the index was built from).
+        - author_hashes: The sorted hashes of the authors of every paper, one entry per (author, paper) pair.
+        - author_docs: The dense id of the paper of each entry of author_hashes.
+        - venues: Maps each venue to its venue id.
+        - venue_ids: The venue id of each paper.
+        - citation_order: The dense ids of the papers by increasing number of citations.
+        - sorted_citations: The number of citations of the papers in citation_order.
+
+    >>> from graph import Paper
+    >>> p1 = Paper('', ['John Doe'], 10, [], 'A Study on Algorithms', 'Journal of Algorithms', '1234')
+    >>> p2 = Paper('', ['Jane Doe', 'John Doe'], 50, [], 'A Study on Graphs', 'Nature', '5678')
+    >>> index = FilterIndex(CompactGraph([p1, p2]))
+    >>> np.flatnonzero(index.mask(CompactGraph([p1, p2]), '25', 'John Doe', '0')).tolist()
+    [1]
+    >>> index.mask(CompactGraph([p1, p2]), '', '0', '0') is None
+    True
+    """
+    doc_count: int
+    author_hashes: np.ndarray
+    author_docs: np.ndarray
+    venues: dict[str, int]
+    venue_ids: np.ndarray
+    citation_order: np.ndarray
+    sorted_citations: np.ndarray
+
+    def __init__(self, graph: CompactGraph) -> None:
+        self.doc_count = len(graph)
+        hashes, docs = array('Q'), array('i')
+        self.venues = {}
+        venue_ids = array('i')
+        citations = array('q')
+
+        for i in range(self.doc_count):
+            paper = graph.paper(i)
+            for author in dict.fromkeys(paper.authors):
+                hashes.append(_author_hash(author))
+                docs.append(i)
+            venue_ids.append(self.venues.setdefault(paper.venue, len(self.venues)))
+            citations.append(paper.n_citation)
+
+        hashes = np.frombuffer(hashes, dtype=np.uint64)
+        order = np.argsort(hashes, kind='stable')
+        self.author_hashes = hashes[order]
+        self.author_docs = np.frombuffer(docs, dtype=np.int32)[order]
+        self.venue_ids = np.frombuffer(venue_ids, dtype=np.int32).copy()
+        citations = np.frombuffer(citations, dtype=np.int64)
+        self.citation_order = np.argsort(citations, kind='stable').astype(np.int32)
+        self.sorted_citations = citations[self.citation_order]
+
+    def papers_of_author(self, graph: CompactGraph, author: str) -> np.ndarray:
+        """Return the dense ids of the indexed papers of graph with the given author, in increasing order."""
+        key = np.uint64(_author_hash(author))
+        start = np.searchsorted(self.author_hashes, key, side='left')
+        end = np.searchsorted(self.author_hashes, key, side='right')
+        docs = np.sort(self.author_docs[start:end])
+        return np.array([i for i in docs.tolist() if author in graph.paper(i).authors], dtype=np.int64)
+
+    def mask(self, graph: CompactGraph, citations: str, author: str, venue: str) -> Optional[np.ndarray]:
+        """Return the bitmap of the papers of graph passing the given filters (as in search.paper_filter), or None if
+        no filter is applied.
+
+        graph must be the graph the index was built from, or one derived from it by with_papers; the papers it added or
+        updated (and any papers beyond those indexed) are checked one by one.
+        """
+        min_citations = int(citations or 0)
+        if min_citations <= 0 and author == "0" and venue == "0":
+            return None
+
+        bitmap = np.zeros(len(graph), dtype=bool)
+        base = np.ones(self.doc_count, dtype=bool)
+        if min_citations > 0:
+            passing = np.zeros(self.doc_count, dtype=bool)
+            passing[self.citation_order[np.searchsorted(self.sorted_citations, min_citations, side='left'):]] = True
+            base &= passing
+        if author != "0":
+            passing = np.zeros(self.doc_count, dtype=bool)
+            passing[self.papers_of_author(graph, author)] = True
+            base &= passing
+        if venue != "0":
+            base &= self.venue_ids == self.venues.get(venue, -1)
+        bitmap[:self.doc_count] = base
+
+        keep = paper_filter(citations, author, venue)
+        for i in set(graph.changed_indices()).union(range(self.doc_count, len(graph))):
+            bitmap[i] = keep(graph.paper(i))
+        return bitmap
+
+
+def _author_hash(author: str) -> int:
+    """Return the 64-bit hash of an author name, which (unlike hash) is the same in every process."""
+    return int.from_bytes(hashlib.blake2b(author.encode('utf-8'), digest_size=8).digest(), 'little')
@@ -1,22 +1,33 @@
 """CSC111 Winter 2025 Project 2: Load Research Graph — (Graph Class and Paper Class)
-This module contains the Graph, Vertex, and Paper classes.
-It is responsible for loading the research graph from the csv file and returning a Graph object.
+This module contains the Graph, Vertex, and Paper classes, and the array-backed CompactGraph.
+It is responsible for loading the research graph from the csv file and returning a Graph (or CompactGraph) object.
 """
 
 from __future__ import annotations
 
+import io
+import logging
 import os
+import time
+from array import array
+from collections.abc import Iterable, Iterator, Mapping, Sequence
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass
-from typing import Any
-from kaggle.api.kaggle_api_extended import KaggleApi
+from typing import Any, Optional
 import csv
 
+import numpy as np
+
 KAGGLE_DATASET_INFO = {
     'user': 'nechbamohammed',
     'dataset': 'research-papers-dataset',
     'csv_file': 'dblp-v10.csv'
 }
 
+_INGEST_BLOCK_SIZE = 16 * 1024 * 1024
+
+logger = logging.getLogger(__name__)
+
 
 class _Vertex:
     """A vertex in a graph.
@@ -26,19 +37,16 @@ class _Vertex:
         - neighbours: The vertices that are adjacent to this vertex.
         - level: The nesting level of this vertex in the graph (1 if it was found using direct search,
                 2 if it is a neighbour of direct search).
-        - visible: Whether the vertex is visible on the graph
     """
     item: Any
     neighbours: set[_Vertex]
     level: int
-    visible: bool
 
     def __init__(self, item: Any, neighbours: set[_Vertex]) -> None:
         """Initialize a new vertex with the given item and neighbours."""
         self.item = item
         self.neighbours = neighbours
         self.level = 2
-        self.visible = True
 
 
 class Graph:
@@ -130,6 +138,435 @@ class Paper:
     paper_id: str
 
 
+class _CompactVertex:
+    """A lightweight view of one paper in a CompactGraph, with the same item and neighbours as a _Vertex.
+
+    Instance Attributes:
+        - index: The dense integer id of the paper in the graph.
+    """
+    index: int
+
+    def __init__(self, graph: CompactGraph, index: int) -> None:
+        """Initialize a view of the vertex with the given index in graph."""
+        self._graph = graph
+        self.index = index
+
+    @property
+    def item(self) -> Paper:
+        """The paper stored at this vertex."""
+        return self._graph.paper(self.index)
+
+    @property
+    def neighbours(self) -> list[_CompactVertex]:
+        """The vertices of the papers this paper references."""
+        return [_CompactVertex(self._graph, i) for i in self._graph.references_of(self.index)]
+
+
+class _CompactVertexMapping(Mapping):
+    """A read-only mapping from paper id to _CompactVertex, mirroring Graph.get_all_item_vertex_mappings."""
+
+    def __init__(self, graph: CompactGraph) -> None:
+        self._graph = graph
+
+    def __getitem__(self, paper_id: str) -> _CompactVertex:
+        return _CompactVertex(self._graph, self._graph.index_of(paper_id))
+
+    def __contains__(self, paper_id: object) -> bool:
+        return paper_id in self._graph.ids
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._graph.ids)
+
+    def __len__(self) -> int:
+        return len(self._graph.ids)
+
+
+class _OverlayIds(Mapping):
+    """A read-only mapping from paper id to dense id over the ids of a CompactGraph and the ids added to it.
+
+    Instance Attributes:
+        - base: The ids of the papers the graph was built (or opened) with.
+        - added: The ids of the papers added by CompactGraph.with_papers since then.
+    """
+    base: Mapping[str, int]
+    added: dict[str, int]
+
+    def __init__(self, base: Mapping[str, int], added: dict[str, int]) -> None:
+        self.base = base
+        self.added = added
+
+    def __getitem__(self, paper_id: str) -> int:
+        if paper_id in self.added:
+            return self.added[paper_id]
+        return self.base[paper_id]
+
+    def __contains__(self, paper_id: object) -> bool:
+        return paper_id in self.added or paper_id in self.base
+
+    def __iter__(self) -> Iterator[str]:
+        yield from self.base
+        yield from self.added
+
+    def __len__(self) -> int:
+        return len(self.base) + len(self.added)
+
+
+class _PatchedPapers(Sequence):
+    """A read-only sequence of papers over the papers a CompactGraph was built (or opened) with, and the papers added
+    or updated since, which merged keeps as they are instead of materializing every paper.
+
+    Instance Attributes:
+        - base: The papers the graph was built (or opened) with.
+        - patches: Maps the dense ids of the papers added or updated since then to the papers.
+        - count: The number of papers.
+    """
+    base: Sequence[Paper]
+    patches: dict[int, Paper]
+    count: int
+
+    def __init__(self, base: Sequence[Paper], patches: dict[int, Paper], count: int) -> None:
+        self.base = base
+        self.patches = patches
+        self.count = count
+
+    def __getitem__(self, index: int) -> Paper:
+        if index in self.patches:
+            return self.patches[index]
+        return self.base[index]
+
+    def __len__(self) -> int:
+        return self.count
+
+
+class CompactGraph:
+    """A research graph whose edges are stored as compressed sparse row (CSR) arrays.
+
+    Paper ids are interned to dense integers (their position in the csv file), and the references of paper i are
+    ref_targets[ref_offsets[i]:ref_offsets[i + 1]]. The reverse (cited-by) adjacency is stored the same way, so the
+    whole graph costs a few integers per edge instead of a _Vertex object and a set per paper.
+
+    A CompactGraph is never changed in place. with_papers returns a new graph that shares the CSR arrays and keeps the
+    new or updated papers, and the adjacency lists they change, in small overlay dictionaries; merged folds the
+    overlays back into new CSR arrays.
+
+    Instance Attributes:
+        - ids: Maps each paper id to its dense integer id.
+        - ref_offsets: The start of each paper's references in ref_targets (length: number of papers + 1).
+        - ref_targets: The dense ids of the papers each paper references.
+        - cited_offsets: The start of each paper's citing papers in cited_targets (length: number of papers + 1).
+        - cited_targets: The dense ids of the papers citing each paper.
+        - in_degrees: The number of papers citing each paper in the CSR arrays (see in_degrees_of for all papers).
+
+    Representation Invariants:
+        - all(self.ids[self.paper(i).paper_id] == i for i in range(len(self.ids)))
+        - len(self.ref_targets) == len(self.cited_targets)
+        - self.in_degrees.tolist() == np.diff(self.cited_offsets).tolist()
+    """
+    ids: Mapping[str, int]
+    ref_offsets: np.ndarray
+    ref_targets: np.ndarray
+    cited_offsets: np.ndarray
+    cited_targets: np.ndarray
+    in_degrees: np.ndarray
+    # Private Instance Attributes:
+    #     - _papers: The papers in the CSR arrays, indexed by their dense integer id.
+    #     - _new_ids: Maps the paper ids added by with_papers to their dense integer ids (after those of _papers).
+    #     - _overlay_papers: Maps dense ids to the papers added or updated by with_papers.
+    #     - _overlay_refs: Maps dense ids to their references where they differ from the CSR arrays.
+    #     - _overlay_cited: Maps dense ids to their (sorted) citing papers where they differ from the CSR arrays.
+    #     - _unresolved_hashes: The sorted hashes (of this process) of the references that were not in the graph when
+    #       with_papers was first called, or None if it was not called yet. Shared by the graphs derived from this one,
+    #       and not pickled.
+    #     - _unresolved_citing: The dense id of the paper listing each reference of _unresolved_hashes.
+    #     - _unresolved_added: Maps the references of the papers added or updated by with_papers that were not in the
+    #       graph then to the dense ids of the papers listing them.
+    _papers: Sequence[Paper]
+    _new_ids: dict[str, int]
+    _overlay_papers: dict[int, Paper]
+    _overlay_refs: dict[int, np.ndarray]
+    _overlay_cited: dict[int, np.ndarray]
+    _unresolved_hashes: Optional[np.ndarray]
+    _unresolved_citing: Optional[np.ndarray]
+    _unresolved_added: dict[str, tuple[int, ...]]
+
+    def __init__(self, papers: Iterable[Paper]) -> None:
+        """Initialize a graph of the given papers with an edge from each paper to each of its references.
+
+        As with Graph.add_vertex, a repeated paper id replaces the earlier paper but keeps its position.
+
+        >>> p1 = Paper('', ['John Doe'], 10, ['5678', '9999'], 'A Study on Algorithms', 'Journal of Algorithms', '1234')
+        >>> p2 = Paper('', ['Jane Doe'], 5, ['1234'], 'A Study on Graphs', 'Journal of Algorithms', '5678')
+        >>> g = CompactGraph([p1, p2])
+        >>> g.references_of(g.index_of('1234')).tolist()
+        [1]
+        >>> g.cited_by(g.index_of('1234')).tolist()
+        [1]
+        >>> len(g.get_all_item_vertex_mappings()['1234'].neighbours)
+        1
+        """
+        papers_by_id = {}
+        for paper in papers:
+            papers_by_id[paper.paper_id] = paper
+        self._papers = list(papers_by_id.values())
+        self.ids = {paper_id: i for i, paper_id in enumerate(papers_by_id)}
+
+        ref_targets = array('i')
+        ref_counts = np.zeros(len(self._papers), dtype=np.int64)
+        for i, paper in enumerate(self._papers):
+            # dict.fromkeys drops repeated references (like the neighbour sets of Graph) but keeps their order
+            targets = dict.fromkeys(self.ids[x] for x in paper.references if x in self.ids)
+            ref_targets.extend(targets)
+            ref_counts[i] = len(targets)
+
+        self.ref_targets = np.frombuffer(ref_targets, dtype=np.int32)
+        self.ref_offsets = np.concatenate(([0], np.cumsum(ref_counts)))
+
+        sources = np.repeat(np.arange(len(self._papers), dtype=np.int32), ref_counts)
+        order = np.argsort(self.ref_targets, kind='stable')
+        self.cited_targets = sources[order]
+        self.in_degrees = np.bincount(self.ref_targets, minlength=len(self._papers)).astype(np.int32)
+        self.cited_offsets = np.concatenate(([0], np.cumsum(self.in_degrees, dtype=np.int64)))
+        self._new_ids, self._overlay_papers, self._overlay_refs, self._overlay_cited = {}, {}, {}, {}
+        self._unresolved_hashes, self._unresolved_citing, self._unresolved_added = None, None, {}
+
+    @classmethod
+    def from_graph(cls, graph: Graph) -> CompactGraph:
+        """Return a CompactGraph with the same papers and edges as graph."""
+        return cls(vertex.item for vertex in graph.get_all_item_vertex_mappings().values())
+
+    @classmethod
+    def from_arrays(cls, papers: Sequence[Paper], ids: Mapping[str, int], ref_offsets: np.ndarray,
+                    ref_targets: np.ndarray, cited_offsets: np.ndarray, cited_targets: np.ndarray) -> CompactGraph:
+        """Return a CompactGraph over already built papers, ids and CSR arrays (e.g. memory-mapped from an index).
+
+        Preconditions:
+            - The arguments satisfy the representation invariants of CompactGraph.
+        """
+        compact = cls.__new__(cls)
+        compact._papers = papers
+        compact.ids = ids
+        compact.ref_offsets, compact.ref_targets = ref_offsets, ref_targets
+        compact.cited_offsets, compact.cited_targets = cited_offsets, cited_targets
+        compact.in_degrees = np.diff(cited_offsets).astype(np.int32)
+        compact._new_ids, compact._overlay_papers, compact._overlay_refs, compact._overlay_cited = {}, {}, {}, {}
+        compact._unresolved_hashes, compact._unresolved_citing, compact._unresolved_added = None, None, {}
+        return compact
+
+    def __len__(self) -> int:
+        """Return the number of papers in this graph."""
+        return len(self._papers) + len(self._new_ids)
+
+    def with_papers(self, papers: Iterable[Paper]) -> CompactGraph:
+        """Return a new graph with the given new or updated papers, and this graph unchanged.
+
+        A paper whose id is already in the graph replaces the old paper (keeping its dense id); other papers are
+        appended. Edges are added in both directions: from each given paper to its references, and to each new
+        paper from the papers that already listed it in their references. The result has the same papers and edges
+        as building a CompactGraph from scratch with the updated papers in place and the new ones at the end.
+
+        The papers listing a new paper are found in an index of the references that are not in the graph, built by
+        the first call (from every paper) and then extended with the references of the given papers, so later calls
+        only look at the given papers and the papers citing them.
+
+        >>> p1 = Paper('', ['John Doe'], 10, ['5678'], 'A Study on Algorithms', 'Journal of Algorithms', '1234')
+        >>> g = CompactGraph([p1])
+        >>> p2 = Paper('', ['Jane Doe'], 5, ['1234'], 'A Study on Graphs', 'Journal of Algorithms', '5678')
+        >>> g2 = g.with_papers([p2])
+        >>> g2.references_of(0).tolist(), g2.references_of(1).tolist(), g2.cited_by(0).tolist()
+        ([1], [0], [1])
+        >>> len(g), len(g2)
+        (1, 2)
+        """
+        if self._unresolved_hashes is None:
+            self._index_unresolved()
+        # Not copy.copy, which would drop the index of unresolved references (see __getstate__)
+        graph = CompactGraph.__new__(CompactGraph)
+        graph.__dict__.update(self.__dict__)
+        graph._new_ids = dict(self._new_ids)
+        graph._overlay_papers = dict(self._overlay_papers)
+        graph._overlay_refs = dict(self._overlay_refs)
+        graph._overlay_cited = dict(self._overlay_cited)
+        graph._unresolved_added = dict(self._unresolved_added)
+        if isinstance(self.ids, _OverlayIds):
+            graph.ids = _OverlayIds(self.ids.base, dict(self.ids.added))
+        else:
+            graph.ids = _OverlayIds(self.ids, {})
+
+        given = {}
+        added_ids = []
+        for paper in papers:
+            if paper.paper_id in graph.ids:
+                index = graph.ids[paper.paper_id]
+            else:
+                index = len(graph)
+                graph._new_ids[paper.paper_id] = index
+                graph.ids.added[paper.paper_id] = index
+                graph._overlay_refs[index] = np.array([], dtype=np.int32)
+                graph._overlay_cited[index] = np.array([], dtype=np.int32)
+                added_ids.append(paper.paper_id)
+            graph._overlay_papers[index] = paper
+            given[index] = None
+
+        # Papers that referenced a paper before it was added now gain an edge to it
+        changed = dict(given)
+        for paper_id in added_ids:
+            for index in graph._unresolved_citers(paper_id):
+                # The index may be out of date for papers updated since
+                if index not in changed and paper_id in graph.paper(index).references:
+                    changed[index] = None
+
+        for index in changed:
+            references = graph.paper(index).references
+            graph._set_references(index, list(dict.fromkeys(graph.ids[x] for x in references if x in graph.ids)))
+        for index in given:
+            for reference in dict.fromkeys(graph.paper(index).references):
+                if reference not in graph.ids:
+                    graph._unresolved_added[reference] = graph._unresolved_added.get(reference, ()) + (index,)
+        return graph
+
+    def _index_unresolved(self) -> None:
+        """Index the references of every paper of this graph that are not in it, for with_papers."""
+        hashes, citing = array('q'), array('i')
+        for index in range(len(self)):
+            references = self.paper(index).references
+            if len(references) == len(self.references_of(index)):
+                # Every reference is resolved (the common case), since the edges keep the distinct resolved ones
+                continue
+            for reference in dict.fromkeys(references):
+                if reference not in self.ids:
+                    hashes.append(hash(reference))
+                    citing.append(index)
+        hashes, citing = np.frombuffer(hashes, dtype=np.int64), np.frombuffer(citing, dtype=np.int32)
+        order = np.argsort(hashes, kind='stable')
+        self._unresolved_hashes, self._unresolved_citing = hashes[order], citing[order]
+
+    def _unresolved_citers(self, paper_id: str) -> list[int]:
+        """Return the dense ids of the papers that listed paper_id in their references while it was not in the graph
+        (and, in case of a hash collision, a few other papers)."""
+        key = hash(paper_id)
+        start = np.searchsorted(self._unresolved_hashes, key, side='left')
+        end = np.searchsorted(self._unresolved_hashes, key, side='right')
+        return self._unresolved_citing[start:end].tolist() + list(self._unresolved_added.get(paper_id, ()))
+
+    def _set_references(self, index: int, targets: list[int]) -> None:
+        """Replace the references of the paper with the given dense id, updating the cited-by lists to match."""
+        old_targets = set(self.references_of(index).tolist())
+        for target in old_targets.difference(targets):
+            cited = self.cited_by(target)
+            self._overlay_cited[target] = cited[cited != index]
+        for target in set(targets).difference(old_targets):
+            cited = self.cited_by(target)
+            self._overlay_cited[target] = np.insert(cited, np.searchsorted(cited, index), index).astype(np.int32)
+        self._overlay_refs[index] = np.array(targets, dtype=np.int32)
+
+    def merged(self) -> CompactGraph:
+        """Return a graph with the same papers and edges as this one, with its overlays folded into new CSR arrays.
+
+        The papers themselves are not copied: the new or updated ones are kept on top of the original ones.
+        """
+        if not self._overlay_papers:
+            return self
+        if isinstance(self._papers, _PatchedPapers):
+            papers = _PatchedPapers(self._papers.base, {**self._papers.patches, **self._overlay_papers}, len(self))
+        else:
+            papers = _PatchedPapers(self._papers, dict(self._overlay_papers), len(self))
+        ref_offsets, ref_targets = _merge_csr(self.ref_offsets, self.ref_targets, self._overlay_refs, len(self))
+        cited_offsets, cited_targets = _merge_csr(self.cited_offsets, self.cited_targets, self._overlay_cited,
+                                                  len(self))
+        graph = CompactGraph.from_arrays(papers, self.ids, ref_offsets, ref_targets, cited_offsets, cited_targets)
+        graph._unresolved_hashes, graph._unresolved_citing = self._unresolved_hashes, self._unresolved_citing
+        graph._unresolved_added = self._unresolved_added
+        return graph
+
+    def index_of(self, paper_id: str) -> int:
+        """Return the dense integer id of the paper with the given paper id.
+
+        Raise a KeyError if the paper is not in this graph.
+        """
+        return self.ids[paper_id]
+
+    def paper(self, index: int) -> Paper:
+        """Return the paper with the given dense integer id."""
+        if index in self._overlay_papers:
+            return self._overlay_papers[index]
+        return self._papers[index]
+
+    def references_of(self, index: int) -> np.ndarray:
+        """Return the dense ids of the papers referenced by the paper with the given dense id."""
+        if index in self._overlay_refs:
+            return self._overlay_refs[index]
+        return self.ref_targets[self.ref_offsets[index]:self.ref_offsets[index + 1]]
+
+    def cited_by(self, index: int) -> np.ndarray:
+        """Return the dense ids of the papers citing the paper with the given dense id, in increasing order."""
+        if index in self._overlay_cited:
+            return self._overlay_cited[index]
+        return self.cited_targets[self.cited_offsets[index]:self.cited_offsets[index + 1]]
+
+    def changed_indices(self) -> list[int]:
+        """Return the dense ids of the papers added or updated by with_papers since the CSR arrays were built."""
+        return list(self._overlay_papers)
+
+    def in_degrees_of(self, indices: np.ndarray) -> np.ndarray:
+        """Return the number of papers citing each of the papers with the given dense ids.
+
+        >>> p1 = Paper('', ['John Doe'], 10, [], 'A Study on Algorithms', 'Journal of Algorithms', '1234')
+        >>> p2 = Paper('', ['Jane Doe'], 5, ['1234'], 'A Study on Graphs', 'Journal of Algorithms', '5678')
+        >>> CompactGraph([p1, p2]).in_degrees_of(np.array([0, 1])).tolist()
+        [1, 0]
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        if not self._overlay_cited:
+            return self.in_degrees[indices]
+        return np.array([len(self.cited_by(i)) for i in indices.tolist()], dtype=np.int32)
+
+    def get_all_item_vertex_mappings(self) -> Mapping[str, _CompactVertex]:
+        """Return a read-only mapping from paper ids to their vertex in this graph.
+
+        The vertices have the item and neighbours of a _Vertex, so code written against Graph keeps working.
+        """
+        return _CompactVertexMapping(self)
+
+    def __getstate__(self) -> dict:
+        """Return the state of this graph for pickling, without the index of unresolved references, whose string
+        hashes differ between processes."""
+        state = self.__dict__.copy()
+        state['_unresolved_hashes'], state['_unresolved_citing'] = None, None
+        state['_unresolved_added'] = {}
+        return state
+
+
+def _merge_csr(offsets: np.ndarray, targets: np.ndarray, overrides: dict[int, np.ndarray],
+               n: int) -> tuple[np.ndarray, np.ndarray]:
+    """Return the (offsets, targets) CSR arrays of n rows, taking the rows in overrides from there and the other rows
+    from the given CSR arrays.
+
+    >>> overrides = {1: np.array([8]), 2: np.array([9])}
+    >>> offsets, targets = _merge_csr(np.array([0, 1, 3]), np.array([5, 6, 7]), overrides, 3)
+    >>> offsets.tolist(), targets.tolist()
+    ([0, 1, 2, 3], [5, 8, 9])
+    """
+    base_n = len(offsets) - 1
+    counts = np.zeros(n, dtype=np.int64)
+    counts[:base_n] = np.diff(offsets)
+    for row, row_targets in overrides.items():
+        counts[row] = len(row_targets)
+    new_offsets = np.concatenate(([0], np.cumsum(counts)))
+    new_targets = np.empty(new_offsets[-1], dtype=np.int32)
+
+    # Move the entries of the rows that are not overridden to their new positions
+    keep_rows = np.ones(base_n, dtype=bool)
+    keep_rows[[row for row in overrides if row < base_n]] = False
+    rows = np.repeat(np.arange(base_n), np.diff(offsets))
+    keep = keep_rows[rows]
+    positions = np.arange(len(targets))[keep]
+    new_targets[new_offsets[rows[keep]] + positions - offsets[rows[keep]]] = targets[keep]
+
+    for row, row_targets in overrides.items():
+        new_targets[new_offsets[row]:new_offsets[row + 1]] = row_targets
+    return new_offsets, new_targets
+
+
 def process_row(row: list) -> Paper:
     """
     Process a row from the csv file and return a Paper object.
@@ -158,6 +595,9 @@ def process_row(row: list) -> Paper:
 
 def download_kaggle_csv() -> None:
     """Download the .csv file associated with the kaggle dataset with name .... """
+    # Imported here, since kaggle authenticates on import (and fails without credentials) even if nothing is downloaded
+    from kaggle.api.kaggle_api_extended import KaggleApi
+
     user, dataset, csv_file = KAGGLE_DATASET_INFO['user'], KAGGLE_DATASET_INFO['dataset'], \
         KAGGLE_DATASET_INFO['csv_file']
 
@@ -174,7 +614,93 @@ def download_kaggle_csv() -> None:
         raise IOError
 
 
-def load_research_graph(csv_path: str = '../data/research-papers.csv') -> Graph:
+def find_record_boundaries(csv_path: str, n_chunks: int) -> list[int]:
+    """
+    Return the byte offsets that split the records of the csv file (after its header) into about n_chunks ranges.
+    The first offset is the start of the first record and the last one is the end of the file.
+
+    An offset is only placed after a newline that is outside a quoted field, i.e. that follows an even number of
+    double quotes since the start of the file (escaped quotes "" keep the parity unchanged), so quoted abstracts that
+    span several lines are never split.
+    """
+    file_size = os.path.getsize(csv_path)
+    with open(csv_path, 'rb') as file:
+        header = file.readline()
+        pos, quote_parity = len(header), header.count(b'"') % 2
+        boundaries = [pos]
+        for k in range(1, n_chunks):
+            target = len(header) + (file_size - len(header)) * k // n_chunks
+
+            # Count the quotes up to the target
+            while pos < target:
+                block = file.read(min(_INGEST_BLOCK_SIZE, target - pos))
+                quote_parity = (quote_parity + block.count(b'"')) % 2
+                pos += len(block)
+
+            # Move to the end of the first line after the target that ends outside a quoted field
+            line = file.readline()
+            while line:
+                quote_parity = (quote_parity + line.count(b'"')) % 2
+                pos += len(line)
+                if quote_parity == 0:
+                    break
+                line = file.readline()
+
+            if boundaries[-1] < pos < file_size:
+                boundaries.append(pos)
+
+    boundaries.append(file_size)
+    return boundaries
+
+
+def read_papers(csv_path: str = '../data/research-papers.csv', workers: Optional[int] = None) -> Iterator[Paper]:
+    """
+    Return an iterator over the papers in the csv file, in file order. Download the csv file first if needed.
+
+    With more than one worker (by default, one per CPU), the file is split into byte ranges on record boundaries
+    that are parsed in a process pool and yielded in order, with the rows/sec progress logged after each range.
+    The papers are the same as those of the serial reader.
+
+    Preconditions:
+        - csv_path is a valid path to the csv file.
+    """
+    if not os.path.exists('../data/research-papers.csv'):
+        download_kaggle_csv()
+
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or os.path.getsize(csv_path) < _INGEST_BLOCK_SIZE:
+        with open(csv_path, 'r') as file:
+            reader = csv.reader(file)
+            next(reader)
+            for row in reader:
+                yield process_row(row)
+        return
+
+    boundaries = find_record_boundaries(csv_path, workers * 4)
+    ranges = [(csv_path, start, end) for start, end in zip(boundaries, boundaries[1:])]
+    start_time = time.perf_counter()
+    rows = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for chunk in executor.map(_parse_byte_range, ranges):
+            rows += len(chunk)
+            yield from chunk
+            logger.info('ingest progress', extra={'rows': rows,
+                                                  'rows_per_second': round(rows / (time.perf_counter() - start_time))})
+
+
+def _parse_byte_range(byte_range: tuple[str, int, int]) -> list[Paper]:
+    """Return the papers of the records in the given (csv path, start, end) byte range of the csv file.
+
+    The bytes are decoded like open(csv_path, 'r') would, so the rows match those of the serial reader.
+    """
+    csv_path, start, end = byte_range
+    with open(csv_path, 'rb') as file:
+        file.seek(start)
+        text = io.TextIOWrapper(io.BytesIO(file.read(end - start)))
+        return [process_row(row) for row in csv.reader(text)]
+
+
+def load_research_graph(csv_path: str = '../data/research-papers.csv', workers: Optional[int] = None) -> Graph:
     """
     Load the research graph from the csv file and return a Graph object.
 
@@ -186,16 +712,10 @@ def load_research_graph(csv_path: str = '../data/research-papers.csv') -> Graph:
         {p.item.title for p in g.get_all_item_vertex_mappings().values()}
     True
     """
-    if not os.path.exists('../data/research-papers.csv'):
-        download_kaggle_csv()
-
     graph = Graph()
 
-    with open(csv_path, 'r') as file:
-        reader = csv.reader(file)
-        next(reader)
-        for row in reader:
-            graph.add_vertex(process_row(row))
+    for paper in read_papers(csv_path, workers):
+        graph.add_vertex(paper)
 
     # Adding edges
     for paper in graph.get_all_item_vertex_mappings().values():
@@ -207,6 +727,18 @@ def load_research_graph(csv_path: str = '../data/research-papers.csv') -> Graph:
     return graph
 
 
+def load_compact_research_graph(csv_path: str = '../data/research-papers.csv',
+                                workers: Optional[int] = None) -> CompactGraph:
+    """
+    Load the research graph from the csv file and return a CompactGraph object with the same papers and edges as
+    load_research_graph.
+
+    Preconditions:
+        - csv_path is a valid path to the csv file.
+    """
+    return CompactGraph(read_papers(csv_path, workers))
+
+
 if __name__ == "__main__":
     pass
     # Optional: Uncomment code for testing purposes
@@ -3,6 +3,12 @@ from dotenv import load_dotenv
 
 workers = 4
 
+# gthread (the default) serves every worker's requests on a few threads, so that requests waiting on I/O (such as
+# /fetch_doi) are not stuck behind searches; gevent (pip install gevent) serves them on greenlets instead
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 100))
+
 bind = '127.0.0.1:8080'
 
 preload_app = True
@@ -11,3 +17,22 @@ dotenv_path = os.path.join(os.getcwd(), '.env')
 
 if os.path.exists(dotenv_path):
     load_dotenv(dotenv_path=dotenv_path)
+
+
+def on_starting(server) -> None:
+    """Load the resources once, in the master, before the workers are forked (see routes.preload_resources).
+
+    This runs before gunicorn listens or handles signals, so the server refuses connections until it is done and can
+    still be interrupted meanwhile."""
+    if server.cfg.preload_app:
+        from routes import preload_resources
+
+        preload_resources()
+
+
+def post_worker_init(worker) -> None:
+    """Start loading the resources of every worker that did not get them from the master as soon as it has loaded the
+    app, in the background, rather than on its first request; /readyz answers 200 once they are loaded."""
+    from routes import WARMUP
+
+    WARMUP.start()
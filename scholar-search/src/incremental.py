@@ -0,0 +1,370 @@
+"""CSC111 Winter 2025 Project 2: Incremental Index Updates
+This module contains the segmented BM25 model and the incremental index that serves searches while new papers are
+added.
+It is responsible for adding the papers of a (small) delta csv file to the research graph and to a delta BM25 segment
+without rebuilding anything from the full csv file, and for folding the delta segments back into the main index in the
+background. Searches are served from an immutable snapshot that is replaced atomically, so they never wait for either.
+"""
+
+from __future__ import annotations
+
+import logging
+import math
+import os
+import threading
+import time
+from collections.abc import Iterable, Sequence
+from typing import Callable, Hashable, NamedTuple, Optional
+
+import numpy as np
+
+from graph import CompactGraph, Paper, read_papers
+from search import BM25, _top_n_indices
+from utils import tokenize
+
+logger = logging.getLogger(__name__)
+
+
+class SegmentedBM25:
+    """A BM25 model over a main model and delta segments, scored as if it were one model over all their documents.
+
+    Document ids are the dense ids of the research graph: document i of the main model is paper i, and each delta
+    segment records the paper of each of its documents. When a paper is updated, its older document is kept but no
+    longer live. DF/IDF and the average document length are computed over the live documents at query time, so
+    scores are exactly those of a BM25 model rebuilt from scratch.
+
+    Instance Attributes:
+        - k1: Term frequency saturation parameter.
+        - b: Document length normalization parameter.
+        - main: The main model.
+        - segments: The (model, dense paper id of each document) of every delta segment, oldest first.
+        - doc_count: The number of live documents (i.e. of papers).
+        - average_doc_length: The average length of the live documents.
+    """
+    k1: float
+    b: float
+    main: BM25
+    segments: list[tuple[BM25, np.ndarray]]
+    doc_count: int
+    average_doc_length: float
+    # Private Instance Attributes:
+    #     - _live: Whether each document is live, for the main model then each segment.
+    #     - _locations: Maps the dense id of every paper indexed by a segment to its (segment, document) position.
+    #     - _dead_frequencies: Maps each term to the number of documents that contain it but are no longer live.
+    #     - _total_length: The total length of the live documents.
+    _live: list[np.ndarray]
+    _locations: dict[int, tuple[int, int]]
+    _dead_frequencies: dict[str, int]
+    _total_length: int
+
+    def __init__(self, main: BM25) -> None:
+        self.k1, self.b = main.k1, main.b
+        self.main = main
+        self.segments = []
+        self.doc_count = main.doc_count
+        self._live = [np.ones(main.doc_count, dtype=bool)]
+        self._locations = {}
+        self._dead_frequencies = {}
+        self._total_length = int(np.sum(main.doc_lengths))
+        self.average_doc_length = self._total_length / self.doc_count if self._total_length > 0 else 1
+
+    def with_segment(self, tokenized_docs: list[list[str]], paper_ids: list[int],
+                     replaced_docs: dict[int, list[str]]) -> SegmentedBM25:
+        """Return a new model with a delta segment of tokenized_docs, and this model unchanged.
+
+        Preconditions:
+            - paper_ids[i] is the dense id of the paper of tokenized_docs[i], and the ids are distinct.
+            - replaced_docs maps the dense id of every updated paper to the tokens of its currently indexed document.
+        """
+        model = SegmentedBM25.__new__(SegmentedBM25)
+        model.k1, model.b, model.main = self.k1, self.b, self.main
+        model.segments = self.segments + [(BM25(tokenized_docs, self.k1, self.b),
+                                           np.array(paper_ids, dtype=np.int64))]
+        model._live = [live.copy() for live in self._live] + [np.ones(len(tokenized_docs), dtype=bool)]
+        model._locations = dict(self._locations)
+        model._dead_frequencies = dict(self._dead_frequencies)
+        model._total_length = self._total_length
+        model.doc_count = self.doc_count
+
+        for paper_id, doc_tokens in replaced_docs.items():
+            segment, doc = self._locations.get(paper_id, (0, paper_id))
+            model._live[segment][doc] = False
+            model._total_length -= len(doc_tokens)
+            model.doc_count -= 1
+            for token in set(doc_tokens):
+                model._dead_frequencies[token] = model._dead_frequencies.get(token, 0) + 1
+
+        for doc, paper_id in enumerate(paper_ids):
+            model._locations[paper_id] = (len(model.segments), doc)
+        model._total_length += sum(len(doc_tokens) for doc_tokens in tokenized_docs)
+        model.doc_count += len(tokenized_docs)
+        model.average_doc_length = model._total_length / model.doc_count if model._total_length > 0 else 1
+        return model
+
+    def merged(self) -> BM25:
+        """Return a BM25 model over the live documents of the main model and the segments, indexed by dense paper id.
+
+        Nothing is tokenized again: the term frequencies of every segment are recovered from its weights (see
+        BM25.postings), so the weights, and the scores, are exactly those of a model rebuilt from the titles.
+        """
+        vocabulary = {}
+        doc_lengths = np.zeros(self.doc_count, dtype=np.int64)
+        rows, cols, tfs = [], [], []
+        for (model, paper_ids), live in zip([(self.main, None)] + self.segments, self._live):
+            targets = np.arange(model.doc_count, dtype=np.int64) if paper_ids is None else paper_ids
+            doc_lengths[targets[live]] = model.doc_lengths[live]
+            term_ids = np.empty(len(model.vocabulary), dtype=np.int64)
+            for token, col in model.vocabulary.items():
+                term_ids[col] = vocabulary.setdefault(token, len(vocabulary))
+            doc_ids, model_cols, model_tfs = model.postings()
+            keep = live[doc_ids]
+            rows.append(targets[doc_ids[keep]])
+            cols.append(term_ids[model_cols[keep]])
+            tfs.append(model_tfs[keep])
+        rows, cols, tfs = np.concatenate(rows), np.concatenate(cols), np.concatenate(tfs)
+
+        # Drop the terms of documents that are no longer live only
+        used = np.bincount(cols, minlength=len(vocabulary)) > 0
+        if not used.all():
+            new_ids = np.cumsum(used) - 1
+            vocabulary = {token: int(new_ids[term_id]) for token, term_id in vocabulary.items() if used[term_id]}
+            cols = new_ids[cols]
+        order = np.lexsort((cols, rows))
+        return BM25.from_term_frequencies(vocabulary, rows[order], cols[order], tfs[order], doc_lengths,
+                                          self.k1, self.b)
+
+    def document_frequency(self, token: str) -> int:
+        """Return the number of live documents containing token."""
+        models = [self.main] + [segment for segment, _ in self.segments]
+        return sum(model.frequencies[0].get(token, 0) for model in models) - self._dead_frequencies.get(token, 0)
+
+    def get_scores(self, query: str) -> np.ndarray:
+        """Calculate BM25 scores for all papers, indexed by dense paper id.
+
+        The weights are computed from the term frequencies of every segment with the IDF and average document length
+        of all live documents, in the same order of operations as BM25, so the scores match a rebuilt model exactly.
+        """
+        scores = np.zeros(self.doc_count, dtype=np.float64)
+        models = [(self.main, None)] + self.segments
+
+        for token in tokenize(query):
+            freq = self.document_frequency(token)
+            if freq == 0:
+                continue
+            idf = math.log((self.doc_count - freq + 0.5) / (freq + 0.5) + 1)
+            for (model, paper_ids), live in zip(models, self._live):
+                doc_ids, tfs = model.term_frequencies(token)
+                keep = live[doc_ids]
+                doc_ids, tfs = doc_ids[keep], tfs[keep]
+                norms = self.k1 * (1 - self.b + self.b * (model.doc_lengths[doc_ids] / self.average_doc_length))
+                targets = doc_ids if paper_ids is None else paper_ids[doc_ids]
+                scores[targets] += idf * (tfs * (self.k1 + 1)) / (tfs + norms)
+
+        return scores
+
+    def get_top_n_paper_score(self, query: str, corpus_list: Sequence, n: int = 200, exhaustive: bool = True,
+                              mask: Optional[np.ndarray] = None) -> list:
+        """
+        Return a list of the top N papers with scores, like BM25.get_top_n_paper_score.
+
+        Delta segments are short-lived, so every paper is scored; exhaustive is accepted for compatibility.
+        """
+        if len(corpus_list) != self.doc_count:
+            raise ValueError("Mismatch between corpus_list and scores length.")
+        scores = self.get_scores(query)
+        return [[corpus_list[i][0], corpus_list[i][1], float(scores[i]), 0] for i in _top_n_indices(scores, n, mask)]
+
+
+class GraphCorpus(Sequence):
+    """A read-only sequence of (paper id, title) pairs over the papers of a graph, like the list built by
+    search.get_corpus, without materializing it."""
+    # Private Instance Attributes:
+    #     - _graph: The graph whose papers make up the corpus.
+    _graph: CompactGraph
+
+    def __init__(self, graph: CompactGraph) -> None:
+        self._graph = graph
+
+    def __getitem__(self, i: int) -> tuple[str, str]:
+        paper = self._graph.paper(i)
+        return paper.paper_id, paper.title
+
+    def __len__(self) -> int:
+        return len(self._graph)
+
+
+class IndexSnapshot(NamedTuple):
+    """A consistent (graph, BM25 model, corpus) to serve a search from, and the generation it belongs to: a number
+    increased by every update of an IncrementalIndex, or the shards answering a SearchCoordinator."""
+    graph: CompactGraph
+    bm25: BM25 | SegmentedBM25
+    corpus: Sequence
+    generation: Hashable
+
+
+class IncrementalIndex:
+    """The searchable research graph and BM25 model, updated with delta csv files while searches are served.
+
+    Every update builds a new IndexSnapshot and replaces the current one in a single assignment, so a search keeps
+    using the snapshot it started with. Updates are serialized by a lock that searches never take.
+
+    Instance Attributes:
+        - delta_count: The number of delta segments not yet merged into the main index.
+    """
+    delta_count: int
+    # Private Instance Attributes:
+    #     - _snapshot: The snapshot that searches are served from.
+    #     - _write_lock: Serializes apply_papers and merge.
+    #     - _on_change: Called after the snapshot is replaced, e.g. to clear query caches.
+    #     - _wrap_model: Applied to the BM25 model built by every merge, e.g. to shard it like the initial model.
+    #     - _applied: The paths of the delta csv files already applied by watch.
+    #     - _apply_lock: Serializes apply_new_deltas, so that each delta csv file is applied once and in order.
+    #     - _watcher: The thread started by watch, if any.
+    #     - _watcher_lock: Guards _watcher, so that a single watcher is started.
+    _snapshot: IndexSnapshot
+    _write_lock: threading.Lock
+    _on_change: Optional[Callable[[], None]]
+    _wrap_model: Optional[Callable[[BM25], BM25]]
+    _applied: set[str]
+    _apply_lock: threading.Lock
+    _watcher: Optional[threading.Thread]
+    _watcher_lock: threading.Lock
+
+    def __init__(self, graph: CompactGraph, bm25: BM25, corpus: Sequence,
+                 on_change: Optional[Callable[[], None]] = None,
+                 wrap_model: Optional[Callable[[BM25], BM25]] = None) -> None:
+        self._snapshot = IndexSnapshot(graph, bm25, corpus, 0)
+        self._write_lock = threading.Lock()
+        self._on_change = on_change
+        self._wrap_model = wrap_model
+        self._applied = set()
+        self._apply_lock = threading.Lock()
+        self._watcher = None
+        self._watcher_lock = threading.Lock()
+        self.delta_count = 0
+
+    def snapshot(self) -> IndexSnapshot:
+        """Return the current snapshot."""
+        return self._snapshot
+
+    def apply_delta(self, csv_path: str) -> int:
+        """Add the new or updated papers of the delta csv file (in the format of the main csv file) to the index, and
+        return how many papers it had.
+
+        The papers are added to the graph with edges in both directions and indexed in a new delta BM25 segment.
+        """
+        count = self.apply_papers(read_papers(csv_path, workers=1))
+        if count:
+            logger.info('delta applied', extra={'papers': count, 'path': csv_path,
+                                                'generation': self._snapshot.generation})
+        return count
+
+    def apply_papers(self, new_papers: Iterable[Paper]) -> int:
+        """Add the given new or updated papers to the index (the last of papers with the same id wins), like
+        apply_delta, and return how many papers were added."""
+        papers = {paper.paper_id: paper for paper in new_papers}
+        if not papers:
+            return 0
+
+        with self._write_lock:
+            graph, bm25, _, generation = self._snapshot
+            segmented = bm25 if isinstance(bm25, SegmentedBM25) else SegmentedBM25(bm25)
+
+            new_graph = graph.with_papers(papers.values())
+            paper_ids = [new_graph.index_of(paper_id) for paper_id in papers]
+            replaced = {i: tokenize(graph.paper(i).title) for i in paper_ids if i < len(graph)}
+            new_bm25 = segmented.with_segment([tokenize(paper.title) for paper in papers.values()], paper_ids, replaced)
+
+            self._snapshot = IndexSnapshot(new_graph, new_bm25, GraphCorpus(new_graph), generation + 1)
+            self.delta_count += 1
+
+        if self._on_change is not None:
+            self._on_change()
+        return len(papers)
+
+    def merge(self) -> None:
+        """Fold the delta segments into a new main index: new CSR graph arrays and a BM25 model over all papers.
+
+        Both are built from the arrays of the current index (see CompactGraph.merged and SegmentedBM25.merged), without
+        decoding or tokenizing the papers that did not change. The new model is passed through the wrap_model given to
+        the constructor, if any, so that it is sharded (for instance) like the initial one.
+
+        >>> from sharding import ShardedBM25
+        >>> titles = ['graph search', 'sorting', 'graph theory', 'search trees']
+        >>> papers = [Paper('', ['a'], 0, [], title, 'v', str(i)) for i, title in enumerate(titles)]
+        >>> graph = CompactGraph(papers)
+        >>> shard = lambda model: ShardedBM25.from_model(model, 2, processes=0)
+        >>> index = IncrementalIndex(graph, shard(BM25([tokenize(title) for title in titles])), GraphCorpus(graph),
+        ...                          wrap_model=shard)
+        >>> index.apply_papers([Paper('', ['b'], 0, ['0'], 'graph sorting', 'v', '4')])
+        1
+        >>> index.merge()
+        >>> snapshot = index.snapshot()
+        >>> type(snapshot.bm25).__name__, len(snapshot.bm25.offsets) - 1
+        ('ShardedBM25', 2)
+        >>> [paper[0] for paper in snapshot.bm25.get_top_n_paper_score('graph', snapshot.corpus, 3)]
+        ['0', '2', '4']
+        """
+        with self._write_lock:
+            graph, bm25, _, generation = self._snapshot
+            if not isinstance(bm25, SegmentedBM25):
+                return
+            merged_graph = graph.merged()
+            merged_bm25 = bm25.merged()
+            if self._wrap_model is not None:
+                # The previous model (and its processes, for a ShardedBM25) is freed once no search uses it
+                merged_bm25 = self._wrap_model(merged_bm25)
+            self._snapshot = IndexSnapshot(merged_graph, merged_bm25, GraphCorpus(merged_graph), generation + 1)
+            self.delta_count = 0
+
+        logger.info('delta segments merged', extra={'papers': len(merged_graph), 'generation': generation + 1,
+                                                    'model': type(merged_bm25).__name__})
+        if self._on_change is not None:
+            self._on_change()
+
+    def merge_in_background(self) -> threading.Thread:
+        """Start merging the delta segments in a daemon thread and return it; searches are served meanwhile."""
+        thread = threading.Thread(target=self.merge, name='index-merge', daemon=True)
+        thread.start()
+        return thread
+
+    def watch(self, delta_dir: str, interval: float = 60, merge_after: int = 4) -> None:
+        """Start a daemon thread (once per process) that applies every new .csv file in delta_dir, in name order,
+        and merges the delta segments once there are at least merge_after of them.
+
+        Each gunicorn worker runs its own watcher, so call this after the workers are forked. The files already in
+        delta_dir are applied by the watcher too, so this returns at once and may be called from every request.
+        """
+        if self._watcher is not None and self._watcher.is_alive():
+            return
+
+        def poll() -> None:
+            while True:
+                try:
+                    self.apply_new_deltas(delta_dir)
+                    if self.delta_count >= merge_after:
+                        self.merge()
+                except Exception:
+                    # E.g. a delta csv file that is malformed or still being written; it is tried again next time
+                    logger.exception('delta update failed', extra={'delta_dir': delta_dir})
+                time.sleep(interval)
+
+        with self._watcher_lock:
+            if self._watcher is None or not self._watcher.is_alive():
+                self._watcher = threading.Thread(target=poll, name='index-delta-watcher', daemon=True)
+                self._watcher.start()
+
+    def apply_new_deltas(self, delta_dir: str) -> None:
+        """Apply the .csv files in delta_dir that have not been applied yet, in name order.
+
+        A file is only recorded as applied once apply_delta succeeds: if it fails, the error is raised and the file
+        (and every file after it) is applied by the next call.
+        """
+        if not os.path.isdir(delta_dir):
+            return
+        with self._apply_lock:
+            for name in sorted(os.listdir(delta_dir)):
+                path = os.path.join(delta_dir, name)
+                if name.endswith('.csv') and path not in self._applied:
+                    self.apply_delta(path)
+                    self._applied.add(path)
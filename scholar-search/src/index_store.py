@@ -0,0 +1,318 @@
+"""CSC111 Winter 2025 Project 2: Memory-Mapped Index Store
+This module contains the binary on-disk format of the search index and the read-only views used to serve it.
+It is responsible for writing the research graph, paper metadata, and BM25 model once (in an explicit build step) as
+flat numpy arrays, and for opening them with numpy.memmap, so that every gunicorn worker shares the same physical pages
+instead of unpickling its own copy of millions of Python objects.
+
+Build the index from the csv file with:
+
+    python index_store.py build
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+import shutil
+import sys
+from bisect import bisect_left
+from collections.abc import Iterator, Mapping, Sequence
+
+import numpy as np
+from scipy import sparse
+
+from graph import CompactGraph, Paper, load_compact_research_graph
+from search import BM25, get_corpus
+from vocabulary import TokenizedCorpus
+
+logger = logging.getLogger(__name__)
+
+INDEX_FORMAT_VERSION = 1
+DEFAULT_INDEX_DIR = '../data/index'
+LIST_SEPARATOR = '\x1f'  # Joins the authors and references of a paper into one string
+
+
+class MappedStrings(Sequence):
+    """A read-only sequence of strings stored as one UTF-8 blob and an offsets array.
+
+    The i-th string is blob[offsets[i]:offsets[i + 1]].
+
+    >>> strings = MappedStrings(*encode_strings(['graph', '', 'théorie']))
+    >>> list(strings)
+    ['graph', '', 'théorie']
+    """
+    # Private Instance Attributes:
+    #     - _offsets: The start of each string in _blob (length: number of strings + 1).
+    #     - _blob: The UTF-8 bytes of all strings, concatenated.
+    _offsets: np.ndarray
+    _blob: np.ndarray
+
+    def __init__(self, offsets: np.ndarray, blob: np.ndarray) -> None:
+        self._offsets = offsets
+        self._blob = blob
+
+    def __getitem__(self, i: int) -> str:
+        return self.get_bytes(i).decode('utf-8')
+
+    def get_bytes(self, i: int) -> bytes:
+        """Return the UTF-8 encoding of the i-th string."""
+        if not -len(self) <= i < len(self):
+            raise IndexError(i)
+        i %= len(self)
+        return self._blob[self._offsets[i]:self._offsets[i + 1]].tobytes()
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def nbytes(self) -> int:
+        """Return the number of bytes of the offsets and blob arrays."""
+        return self._offsets.nbytes + self._blob.nbytes
+
+
+class SortedStringIndex(Mapping):
+    """A read-only mapping from each string of a MappedStrings table to its position, found by binary search.
+
+    order lists the positions of the table in sorted string order, so no Python dict of the strings is needed.
+    Strings are compared as UTF-8 bytes, which sort in the same order as the strings themselves.
+
+    >>> table = MappedStrings(*encode_strings(['b', 'c', 'a']))
+    >>> index = SortedStringIndex(table, np.array([2, 0, 1]))
+    >>> index['c'], 'd' in index
+    (1, False)
+    """
+    # Private Instance Attributes:
+    #     - _table: The strings being indexed.
+    #     - _order: The positions in _table, sorted by their string.
+    _table: MappedStrings
+    _order: np.ndarray
+
+    def __init__(self, table: MappedStrings, order: np.ndarray) -> None:
+        self._table = table
+        self._order = order
+
+    def __getitem__(self, key: str) -> int:
+        encoded = key.encode('utf-8')
+        k = bisect_left(range(len(self._order)), encoded, key=lambda j: self._table.get_bytes(self._order[j]))
+        if k < len(self._order) and self._table.get_bytes(self._order[k]) == encoded:
+            return int(self._order[k])
+        raise KeyError(key)
+
+    def __contains__(self, key: object) -> bool:
+        if not isinstance(key, str):
+            return False
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._table)
+
+    def __len__(self) -> int:
+        return len(self._table)
+
+
+class ArrayMapping(Mapping):
+    """A read-only mapping from the keys of index to the corresponding entries of values."""
+    # Private Instance Attributes:
+    #     - _index: Maps each key to its position in _values.
+    #     - _values: The values, by position.
+    _index: Mapping[str, int]
+    _values: np.ndarray
+
+    def __init__(self, index: Mapping[str, int], values: np.ndarray) -> None:
+        self._index = index
+        self._values = values
+
+    def __getitem__(self, key: str) -> float:
+        return self._values[self._index[key]].item()
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._index
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._index)
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+
+class MappedPapers(Sequence):
+    """A read-only sequence of the papers in an index, each decoded into a Paper when it is accessed."""
+    # Private Instance Attributes:
+    #     - _fields: The MappedStrings tables of the paper fields.
+    #     - _n_citations: The number of citations of each paper.
+    _fields: dict[str, MappedStrings]
+    _n_citations: np.ndarray
+
+    def __init__(self, fields: dict[str, MappedStrings], n_citations: np.ndarray) -> None:
+        self._fields = fields
+        self._n_citations = n_citations
+
+    def __getitem__(self, i: int) -> Paper:
+        return Paper(self._fields['abstracts'][i],
+                     self._fields['authors'][i].split(LIST_SEPARATOR),
+                     int(self._n_citations[i]),
+                     self._fields['references'][i].split(LIST_SEPARATOR),
+                     self._fields['titles'][i],
+                     self._fields['venues'][i],
+                     self._fields['paper_ids'][i])
+
+    def __len__(self) -> int:
+        return len(self._n_citations)
+
+
+class MappedCorpus(Sequence):
+    """A read-only sequence of (paper id, title) pairs, standing in for the list built by search.get_corpus."""
+    # Private Instance Attributes:
+    #     - _paper_ids: The id of each paper.
+    #     - _titles: The title of each paper.
+    _paper_ids: MappedStrings
+    _titles: MappedStrings
+
+    def __init__(self, paper_ids: MappedStrings, titles: MappedStrings) -> None:
+        self._paper_ids = paper_ids
+        self._titles = titles
+
+    def __getitem__(self, i: int) -> tuple[str, str]:
+        return self._paper_ids[i], self._titles[i]
+
+    def __len__(self) -> int:
+        return len(self._paper_ids)
+
+
+def encode_strings(strings: Sequence[str]) -> tuple[np.ndarray, np.ndarray]:
+    """Return the (offsets, blob) arrays of a MappedStrings table holding strings."""
+    encoded = [s.encode('utf-8') for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    blob = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+    return offsets, blob
+
+
+def index_exists(index_dir: str = DEFAULT_INDEX_DIR) -> bool:
+    """Return whether a built index exists in index_dir."""
+    return os.path.exists(os.path.join(index_dir, 'manifest.json'))
+
+
+def write_index(index_dir: str, graph: CompactGraph, bm25: BM25) -> None:
+    """Write graph and bm25 to index_dir in the binary index format.
+
+    The index is written to a temporary directory that then replaces index_dir, so a crashed build never leaves a
+    partial index behind. Workers that still map the old files keep their (unlinked) pages until they reopen.
+
+    Preconditions:
+        - bm25 was built from get_corpus(graph), so document i of bm25 is paper i of graph.
+    """
+    papers = [graph.paper(i) for i in range(len(graph.ids))]
+    arrays = {
+        'ref_offsets': graph.ref_offsets,
+        'ref_targets': graph.ref_targets,
+        'cited_offsets': graph.cited_offsets,
+        'cited_targets': graph.cited_targets,
+        'n_citations': np.array([p.n_citation for p in papers], dtype=np.int64),
+        'doc_lengths': bm25.doc_lengths,
+    }
+
+    paper_ids = [p.paper_id for p in papers]
+    arrays['paper_id_order'] = np.array(sorted(range(len(paper_ids)), key=paper_ids.__getitem__), dtype=np.int64)
+    fields = {
+        'paper_ids': paper_ids,
+        'titles': [p.title for p in papers],
+        'abstracts': [p.abstract for p in papers],
+        'authors': [LIST_SEPARATOR.join(p.authors) for p in papers],
+        'references': [LIST_SEPARATOR.join(p.references) for p in papers],
+        'venues': [p.venue for p in papers],
+    }
+
+    # Store the vocabulary sorted, so that the column of a term is its position in the terms table
+    terms = sorted(bm25.vocabulary)
+    columns = np.array([bm25.vocabulary[t] for t in terms], dtype=np.int64)
+    fields['terms'] = terms
+    weights = bm25.weights[:, columns].tocsc()
+    weights.sort_indices()
+    arrays['weights_indptr'] = weights.indptr
+    arrays['weights_indices'] = weights.indices
+    arrays['weights_data'] = weights.data
+    arrays['term_upper_bounds'] = bm25.term_upper_bounds[columns]
+    arrays['document_frequencies'] = np.array([bm25.frequencies[0][t] for t in terms], dtype=np.int64)
+    arrays['idf'] = np.array([bm25.frequencies[1][t] for t in terms], dtype=np.float64)
+
+    for name, strings in fields.items():
+        arrays[f'{name}_offsets'], arrays[f'{name}_blob'] = encode_strings(strings)
+
+    tmp_dir = f'{index_dir}.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    for name, values in arrays.items():
+        np.save(os.path.join(tmp_dir, f'{name}.npy'), values)
+
+    manifest = {
+        'format_version': INDEX_FORMAT_VERSION,
+        'paper_count': len(papers),
+        'term_count': len(terms),
+        'k1': bm25.k1,
+        'b': bm25.b,
+        'average_doc_length': bm25.average_doc_length,
+        'arrays': sorted(arrays),
+    }
+    with open(os.path.join(tmp_dir, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    shutil.rmtree(index_dir, ignore_errors=True)
+    os.replace(tmp_dir, index_dir)
+
+
+def open_index(index_dir: str = DEFAULT_INDEX_DIR) -> tuple[CompactGraph, MappedCorpus, BM25]:
+    """Return the (graph, corpus, BM25 model) stored in index_dir, backed by read-only memory maps.
+
+    Raise a ValueError if the index was written in a different format version.
+    """
+    with open(os.path.join(index_dir, 'manifest.json')) as f:
+        manifest = json.load(f)
+    if manifest['format_version'] != INDEX_FORMAT_VERSION:
+        raise ValueError(f"Index format {manifest['format_version']} is not {INDEX_FORMAT_VERSION}; rebuild it.")
+
+    # Plain ndarray views of the maps index faster than np.memmap objects, and still share the mapped pages
+    arrays = {name: np.load(os.path.join(index_dir, f'{name}.npy'), mmap_mode='r').view(np.ndarray)
+              for name in manifest['arrays']}
+    fields = {name: MappedStrings(arrays[f'{name}_offsets'], arrays[f'{name}_blob'])
+              for name in ('paper_ids', 'titles', 'abstracts', 'authors', 'references', 'venues', 'terms')}
+
+    graph = CompactGraph.from_arrays(MappedPapers(fields, arrays['n_citations']),
+                                     SortedStringIndex(fields['paper_ids'], arrays['paper_id_order']),
+                                     arrays['ref_offsets'], arrays['ref_targets'],
+                                     arrays['cited_offsets'], arrays['cited_targets'])
+
+    vocabulary = SortedStringIndex(fields['terms'], np.arange(manifest['term_count']))
+    weights = sparse.csc_matrix((arrays['weights_data'], arrays['weights_indices'], arrays['weights_indptr']),
+                                shape=(manifest['paper_count'], manifest['term_count']), copy=False)
+    bm25 = BM25.from_arrays(vocabulary, weights, arrays['term_upper_bounds'], arrays['doc_lengths'],
+                            (ArrayMapping(vocabulary, arrays['document_frequencies']),
+                             ArrayMapping(vocabulary, arrays['idf'])),
+                            manifest['k1'], manifest['b'], manifest['average_doc_length'])
+
+    return graph, MappedCorpus(fields['paper_ids'], fields['titles']), bm25
+
+
+def build_index(index_dir: str = DEFAULT_INDEX_DIR, csv_path: str = '../data/research-papers.csv') -> None:
+    """Build the graph and BM25 model from the csv file and write them to index_dir."""
+    logger.info('loading papers', extra={'path': csv_path})
+    graph = load_compact_research_graph(csv_path)
+    logger.info('building bm25', extra={'papers': len(graph.ids)})
+    bm25 = BM25(TokenizedCorpus.from_texts(title for _, title in get_corpus(graph)))
+    logger.info('writing index', extra={'directory': index_dir})
+    write_index(index_dir, graph, bm25)
+    logger.info('index written', extra={'papers': len(graph.ids), 'directory': index_dir})
+
+
+if __name__ == "__main__":
+    from logging_config import configure_logging
+
+    configure_logging()
+    if sys.argv[1:2] == ['build']:
+        build_index(*sys.argv[2:4])
+    else:
+        print("Usage: python index_store.py build [index_dir] [csv_path]")
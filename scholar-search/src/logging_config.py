@@ -0,0 +1,58 @@
+"""CSC111 Winter 2025 Project 2: Logging Configuration
+This module contains the KeyValueFormatter class and the configure_logging function.
+It is responsible for writing the logs of the app as levelled, structured lines of key=value pairs (logfmt), with the
+fields passed in the extra argument of a logging call as keys of their own, so that logs can be filtered and parsed.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import sys
+import time
+from typing import Optional
+
+# The attributes of every LogRecord; the other attributes of a record are the fields given in extra
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class KeyValueFormatter(logging.Formatter):
+    """Formats log records as key=value pairs: time, level, logger, process id and message, then the extra fields.
+
+    >>> record = logging.LogRecord('search', logging.INFO, '', 0, 'query done', (), None)
+    >>> record.papers, record.query = 12, 'graph neural'
+    >>> KeyValueFormatter().format(record).split(' ', 1)[1].replace(f'pid={os.getpid()}', 'pid=1')
+    'level=info logger=search pid=1 msg="query done" papers=12 query="graph neural"'
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        """Return record as one line of key=value pairs."""
+        created = time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created))
+        fields = [('ts', f'{created}.{int(record.msecs):03d}Z'), ('level', record.levelname.lower()),
+                  ('logger', record.name), ('pid', record.process), ('msg', record.getMessage())]
+        fields.extend((key, value) for key, value in vars(record).items() if key not in _RECORD_ATTRIBUTES)
+        if record.exc_info:
+            fields.append(('exc', self.formatException(record.exc_info)))
+        return ' '.join(f'{key}={_format_value(value)}' for key, value in fields)
+
+
+def _format_value(value: object) -> str:
+    """Return value as a logfmt value, quoted if it contains spaces, quotes or equal signs.
+
+    >>> _format_value('a b'), _format_value(0.5), _format_value('say "hi"')
+    ('"a b"', '0.5', '"say \\\\"hi\\\\""')
+    """
+    text = f'{value:.4g}' if isinstance(value, float) else str(value)
+    if text and not any(c in text for c in ' "=\n\\'):
+        return text
+    return '"' + text.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+
+
+def configure_logging(level: Optional[str] = None) -> None:
+    """Send the logs at level (or the LOG_LEVEL environment variable, by default INFO) and above to stderr, formatted
+    by KeyValueFormatter."""
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(KeyValueFormatter())
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel((level or os.environ.get('LOG_LEVEL', 'INFO')).upper())
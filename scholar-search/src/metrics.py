@@ -0,0 +1,334 @@
+"""CSC111 Winter 2025 Project 2: Metrics
+This module contains the counters, histograms and gauges of the app, and the registry that exposes them to Prometheus.
+It is responsible for timing the stages of a search, counting cache hits and misses, recording the sizes of results and
+the memory of the workers, and aggregating the measurements of all the gunicorn workers: every worker periodically
+writes its own measurements to a file named after its process id in a shared directory, and /metrics sums the files.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+import resource
+import tempfile
+import threading
+import time
+from collections.abc import Iterator, Sequence
+from contextlib import contextmanager
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_METRICS_DIR = '../data/metrics'
+# Seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (10, 50, 100, 200, 400, 800, 1600, 3200)
+BYTES_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+class _Metric:
+    """A metric of the registry: a named family of values, one per combination of label values.
+
+    Instance Attributes:
+        - name: The name of the metric, as exposed to Prometheus.
+        - documentation: The help text of the metric.
+        - labelnames: The names of the labels of the metric.
+    """
+    kind: str = ''
+    name: str
+    documentation: str
+    labelnames: tuple[str, ...]
+    # Private Instance Attributes:
+    #     - _registry: The registry the metric belongs to, which holds its values.
+    _registry: MetricsRegistry
+
+    def __init__(self, registry: MetricsRegistry, name: str, documentation: str, labelnames: Sequence[str]) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._registry = registry
+
+    def _key(self, labels: dict[str, str]) -> tuple[str, ...]:
+        """Return the label values of labels, in the order of labelnames."""
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def new_value(self) -> list[float]:
+        """Return the value of a combination of label values that was never updated."""
+        return [0.0]
+
+
+class Counter(_Metric):
+    """A value that only goes up, e.g. a number of requests."""
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        """Add amount to the value with the given labels."""
+        with self._registry.updating(self, self._key(labels)) as value:
+            value[0] += amount
+
+
+class Gauge(_Metric):
+    """A value that goes up and down, e.g. a memory size. Every process exposes its own value, with a pid label."""
+    kind = 'gauge'
+
+    def set(self, amount: float, **labels: str) -> None:
+        """Set the value with the given labels to amount."""
+        with self._registry.updating(self, self._key(labels)) as value:
+            value[0] = amount
+
+
+class Histogram(_Metric):
+    """A distribution of observed values, e.g. of latencies, counted in cumulative buckets.
+
+    Instance Attributes:
+        - buckets: The upper bounds of the buckets, in increasing order (the +Inf bucket is implicit).
+    """
+    kind = 'histogram'
+    buckets: tuple[float, ...]
+
+    def __init__(self, registry: MetricsRegistry, name: str, documentation: str, labelnames: Sequence[str],
+                 buckets: Sequence[float] = LATENCY_BUCKETS) -> None:
+        super().__init__(registry, name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def new_value(self) -> list[float]:
+        """Return the counts of the buckets (and of +Inf), the sum and the count of no observation."""
+        return [0.0] * (len(self.buckets) + 3)
+
+    def observe(self, amount: float, **labels: str) -> None:
+        """Record an observation of amount with the given labels."""
+        with self._registry.updating(self, self._key(labels)) as value:
+            for i, bound in enumerate(self.buckets):
+                if amount <= bound:
+                    value[i] += 1
+            value[-3] += 1
+            value[-2] += amount
+            value[-1] += 1
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        """Observe the number of seconds spent in the with block, with the given labels."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+
+class MetricsRegistry:
+    """The metrics of the app, and their values in this process.
+
+    The values of a process are written to directory/<pid>.json at most every flush_interval seconds by a daemon
+    thread, and render() sums the files of all processes (the gauges of processes that exited are left out). A process
+    forked from another starts from zero, since the values of its parent are in its parent's file.
+
+    Instance Attributes:
+        - directory: The directory shared by the processes of the app for their values.
+        - flush_interval: The number of seconds between two writes of the values of this process.
+    """
+    directory: str
+    flush_interval: float
+    # Private Instance Attributes:
+    #     - _metrics: Maps the name of every metric to the metric.
+    #     - _values: Maps the name of every metric to its values in this process, by label values.
+    #     - _lock: Guards _values.
+    #     - _pid: The process the values were recorded in.
+    #     - _dirty: Whether the values changed since they were last written.
+    #     - _flusher_pid: The process that runs the flush thread, if any.
+    _metrics: dict[str, _Metric]
+    _values: dict[str, dict[tuple[str, ...], list[float]]]
+    _lock: threading.Lock
+    _pid: int
+    _dirty: bool
+    _flusher_pid: Optional[int]
+
+    def __init__(self, directory: str = DEFAULT_METRICS_DIR, flush_interval: float = 5) -> None:
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._metrics = {}
+        self._values = {}
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._dirty = False
+        self._flusher_pid = None
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        """Return a new counter of this registry."""
+        return self._add(Counter(self, name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        """Return a new gauge of this registry."""
+        return self._add(Gauge(self, name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        """Return a new histogram of this registry."""
+        return self._add(Histogram(self, name, documentation, labelnames, buckets))
+
+    def _add(self, metric: _Metric) -> _Metric:
+        """Register metric and return it."""
+        self._metrics[metric.name] = metric
+        self._values[metric.name] = {}
+        return metric
+
+    @contextmanager
+    def updating(self, metric: _Metric, key: tuple[str, ...]) -> Iterator[list[float]]:
+        """Yield the value of metric with the label values key, to be updated in the with block."""
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._values = {name: {} for name in self._metrics}
+            values = self._values[metric.name]
+            if key not in values:
+                values[key] = metric.new_value()
+            yield values[key]
+            self._dirty = True
+
+    def flush(self) -> None:
+        """Write the values of this process to its file in directory, if they changed since the last write."""
+        RESIDENT_MEMORY.set(resident_memory_bytes())
+        with self._lock:
+            if not self._dirty or self._pid != os.getpid():
+                return
+            snapshot = {name: [[list(key), value] for key, value in values.items()]
+                        for name, values in self._values.items()}
+            self._dirty = False
+
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(snapshot, f)
+        os.replace(tmp_path, os.path.join(self.directory, f'{self._pid}.json'))
+
+    def start_flusher(self) -> None:
+        """Start the thread writing the values of this process every flush_interval seconds (a no-op once it is
+        running in this process)."""
+        if self._flusher_pid == os.getpid():
+            return
+        self._flusher_pid = os.getpid()
+        threading.Thread(target=self._flush_forever, name='metrics-flush', daemon=True).start()
+
+    def _flush_forever(self) -> None:
+        """Write the values of this process every flush_interval seconds."""
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except OSError:
+                logger.exception('metrics flush failed', extra={'directory': self.directory})
+
+    def remove_exited(self) -> None:
+        """Delete the files of the processes that are no longer running, e.g. of a previous run of the app."""
+        for pid, path in self._files():
+            if not _is_running(pid):
+                os.remove(path)
+
+    def _files(self) -> list[tuple[int, str]]:
+        """Return the (process id, path) of the file of every process in directory."""
+        if not os.path.isdir(self.directory):
+            return []
+        return [(int(name[:-5]), os.path.join(self.directory, name))
+                for name in os.listdir(self.directory) if name.endswith('.json') and name[:-5].isdigit()]
+
+    def render(self) -> str:
+        """Return the values of all the processes in the Prometheus text exposition format."""
+        self.flush()
+        totals = {name: {} for name in self._metrics}
+        for pid, path in self._files():
+            try:
+                with open(path) as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for name, entries in snapshot.items():
+                metric = self._metrics.get(name)
+                if metric is None or (metric.kind == 'gauge' and not _is_running(pid)):
+                    continue
+                for key, value in entries:
+                    key = tuple(key) + ((str(pid),) if metric.kind == 'gauge' else ())
+                    total = totals[name].setdefault(key, [0.0] * len(value))
+                    for i, amount in enumerate(value):
+                        total[i] += amount
+
+        lines = []
+        for name, metric in self._metrics.items():
+            lines.append(f'# HELP {name} {metric.documentation}')
+            lines.append(f'# TYPE {name} {metric.kind}')
+            labelnames = metric.labelnames + (('pid',) if metric.kind == 'gauge' else ())
+            for key, value in sorted(totals[name].items()):
+                labels = list(zip(labelnames, key))
+                if isinstance(metric, Histogram):
+                    for bound, count in zip(metric.buckets + (float('inf'),), value):
+                        lines.append(f'{name}_bucket{_labels(labels + [("le", _number(bound))])} {_number(count)}')
+                    lines.append(f'{name}_sum{_labels(labels)} {_number(value[-2])}')
+                    lines.append(f'{name}_count{_labels(labels)} {_number(value[-1])}')
+                else:
+                    lines.append(f'{name}{_labels(labels)} {_number(value[0])}')
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(labels: list[tuple[str, str]]) -> str:
+    """Return labels in the Prometheus format, e.g. '{stage="bm25"}', or '' if there are none.
+
+    >>> _labels([('query', 'say "hi"\\n')])
+    '{query="say \\\\"hi\\\\"\\\\n"}'
+    """
+    if not labels:
+        return ''
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+
+def _number(value: float) -> str:
+    """Return value in the Prometheus format.
+
+    >>> _number(3.0), _number(0.25), _number(float('inf'))
+    ('3', '0.25', '+Inf')
+    """
+    if value == float('inf'):
+        return '+Inf'
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _is_running(pid: int) -> bool:
+    """Return whether the process with the given id is running."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def resident_memory_bytes() -> int:
+    """Return the resident memory of this process, or its peak resident memory where it is not available."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+REGISTRY = MetricsRegistry(os.environ.get('METRICS_DIR', DEFAULT_METRICS_DIR),
+                           float(os.environ.get('METRICS_FLUSH_INTERVAL', 5)))
+
+REQUEST_SECONDS = REGISTRY.histogram('scholar_request_seconds', 'Latency of the HTTP requests, by route.', ['route'])
+REQUESTS = REGISTRY.counter('scholar_requests_total', 'Number of HTTP requests, by route and status code.',
+                            ['route', 'status'])
+STAGE_SECONDS = REGISTRY.histogram('scholar_stage_seconds', 'Latency of the stages of a search, by stage.', ['stage'])
+CACHE_REQUESTS = REGISTRY.counter('scholar_cache_requests_total', 'Number of cache lookups, by cache and result.',
+                                  ['cache', 'result'])
+RESULT_PAPERS = REGISTRY.histogram('scholar_result_papers', 'Number of papers of the query graphs built.',
+                                   buckets=SIZE_BUCKETS)
+RESPONSE_BYTES = REGISTRY.histogram('scholar_response_bytes', 'Size of the HTTP response bodies, by route.',
+                                    ['route'], buckets=BYTES_BUCKETS)
+SEARCHES = REGISTRY.counter('scholar_searches_total', 'Number of searches run by the search executor, by outcome '
+                            '(computed, coalesced with an identical search in progress, or shed).', ['outcome'])
+SEARCH_QUEUE_DEPTH = REGISTRY.gauge('scholar_search_queue_depth', 'Number of searches being computed or waiting.')
+SHARD_REQUESTS = REGISTRY.counter('scholar_shard_requests_total', 'Number of requests to the shard servers, by shard '
+                                  'and outcome (ok, error or timeout).', ['shard', 'outcome'])
+SHARD_SECONDS = REGISTRY.histogram('scholar_shard_seconds', 'Latency of the requests to the shard servers, by shard.',
+                                   ['shard'])
+RESIDENT_MEMORY = REGISTRY.gauge('scholar_resident_memory_bytes', 'Resident memory of each process of the app.')
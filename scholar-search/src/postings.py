@@ -0,0 +1,127 @@
+"""CSC111 Winter 2025 Project 2: Compressed Postings Lists
+This module contains the CompressedPostings class, a block-compressed store of postings lists.
+It is responsible for delta-encoding the document ids of each postings list and bit-packing them, together with the
+term frequencies, in blocks of BLOCK_SIZE postings, so that large fields such as abstracts can be indexed in RAM, and
+for decoding the postings block by block at query time.
+"""
+
+from __future__ import annotations
+
+from collections.abc import Iterator
+
+import numpy as np
+
+BLOCK_SIZE = 128
+
+
+class CompressedPostings:
+    """Postings lists of (document id, term frequency) pairs, compressed in blocks of BLOCK_SIZE postings.
+
+    In each block, the document ids are stored as gaps from the previous id (the first one from the block's base id)
+    and the gaps and the term frequencies are each bit-packed with the fewest bits that hold the block's largest value.
+
+    Instance Attributes:
+        - block_ptr: The blocks of term t are block_ptr[t]:block_ptr[t + 1] (length: number of terms + 1).
+        - block_offsets: The start of each block in data.
+        - block_counts: The number of postings in each block.
+        - block_bases: The document id of the first posting of each block.
+        - block_bits: The (gap bits, term frequency bits) of each block.
+        - data: The packed bits of all blocks.
+
+    >>> postings = CompressedPostings.from_lists([([3, 7, 300], [1, 2, 1]), ([5], [4])])
+    >>> doc_ids, tfs = postings.decode(0)
+    >>> doc_ids.tolist(), tfs.tolist()
+    ([3, 7, 300], [1, 2, 1])
+    >>> postings.document_frequency(1)
+    1
+    """
+    block_ptr: np.ndarray
+    block_offsets: np.ndarray
+    block_counts: np.ndarray
+    block_bases: np.ndarray
+    block_bits: np.ndarray
+    data: np.ndarray
+
+    @classmethod
+    def from_lists(cls, lists: list[tuple]) -> CompressedPostings:
+        """Return the compressed form of lists, where lists[t] is the (sorted document ids, term frequencies) of
+        term t."""
+        block_ptr = [0]
+        offsets, counts, bases, bits, chunks = [], [], [], [], []
+        size = 0
+        for doc_ids, tfs in lists:
+            doc_ids = np.asarray(doc_ids, dtype=np.int64)
+            tfs = np.asarray(tfs, dtype=np.int64)
+            for start in range(0, len(doc_ids), BLOCK_SIZE):
+                block_ids, block_tfs = doc_ids[start:start + BLOCK_SIZE], tfs[start:start + BLOCK_SIZE]
+                gaps = np.diff(block_ids, prepend=block_ids[0])
+                gap_bits, gap_chunk = _pack(gaps)
+                tf_bits, tf_chunk = _pack(block_tfs)
+                offsets.append(size)
+                counts.append(len(block_ids))
+                bases.append(block_ids[0])
+                bits.append((gap_bits, tf_bits))
+                chunks.extend((gap_chunk, tf_chunk))
+                size += len(gap_chunk) + len(tf_chunk)
+            block_ptr.append(len(offsets))
+
+        postings = cls()
+        postings.block_ptr = np.array(block_ptr, dtype=np.int64)
+        postings.block_offsets = np.array(offsets, dtype=np.int64)
+        postings.block_counts = np.array(counts, dtype=np.int32)
+        postings.block_bases = np.array(bases, dtype=np.int64)
+        postings.block_bits = np.array(bits, dtype=np.uint8).reshape(-1, 2)
+        postings.data = np.concatenate(chunks) if chunks else np.array([], dtype=np.uint8)
+        return postings
+
+    def document_frequency(self, term: int) -> int:
+        """Return the number of postings of term."""
+        return int(self.block_counts[self.block_ptr[term]:self.block_ptr[term + 1]].sum())
+
+    def iter_blocks(self, term: int) -> Iterator[tuple[np.ndarray, np.ndarray]]:
+        """Yield the (document ids, term frequencies) of each block of term, decoding one block at a time."""
+        for block in range(self.block_ptr[term], self.block_ptr[term + 1]):
+            count = int(self.block_counts[block])
+            gap_bits, tf_bits = (int(x) for x in self.block_bits[block])
+            start = int(self.block_offsets[block])
+            gap_size = (count * gap_bits + 7) // 8
+            gaps = _unpack(self.data[start:start + gap_size], count, gap_bits)
+            tfs = _unpack(self.data[start + gap_size:start + gap_size + (count * tf_bits + 7) // 8], count, tf_bits)
+            yield self.block_bases[block] + np.cumsum(gaps), tfs
+
+    def decode(self, term: int) -> tuple[np.ndarray, np.ndarray]:
+        """Return the (document ids, term frequencies) of term."""
+        blocks = list(self.iter_blocks(term))
+        if not blocks:
+            return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+        return np.concatenate([ids for ids, _ in blocks]), np.concatenate([tfs for _, tfs in blocks])
+
+    def nbytes(self) -> int:
+        """Return the number of bytes used by the compressed postings and their block directory."""
+        return sum(a.nbytes for a in (self.block_ptr, self.block_offsets, self.block_counts, self.block_bases,
+                                      self.block_bits, self.data))
+
+    def posting_count(self) -> int:
+        """Return the total number of postings."""
+        return int(self.block_counts.sum())
+
+
+def _pack(values: np.ndarray) -> tuple[int, np.ndarray]:
+    """Return the bit width of the largest of values and values packed with that many bits each.
+
+    >>> _pack(np.array([1, 2, 3]))
+    (2, array([57], dtype=uint8))
+    """
+    width = max(int(values.max()).bit_length(), 1)
+    bits = (values[:, None] >> np.arange(width)) & 1
+    return width, np.packbits(bits.astype(np.uint8).ravel(), bitorder='little')
+
+
+def _unpack(packed: np.ndarray, count: int, width: int) -> np.ndarray:
+    """Return the count values packed with width bits each in packed.
+
+    >>> _unpack(np.array([57], dtype=np.uint8), 3, 2).tolist()
+    [1, 2, 3]
+    """
+    bits = np.unpackbits(packed, count=count * width, bitorder='little').reshape(count, width)
+    return bits.astype(np.int64) @ (np.int64(1) << np.arange(width, dtype=np.int64))
@@ -0,0 +1,154 @@
+"""CSC111 Winter 2025 Project 2: Request Profiling
+This module contains the opt-in profiler of single requests.
+It is responsible for profiling the requests that ask for it, when profiling is enabled with the PROFILING environment
+variable: the CPU time of the request is recorded with cProfile and its allocations with tracemalloc, and both are
+written to PROFILE_DIR under the id of the request. When profiling is not enabled, no hook is installed at all, so
+requests run exactly as they would without this module.
+"""
+
+from __future__ import annotations
+
+import cProfile
+import io
+import logging
+import os
+import pstats
+import re
+import threading
+import time
+import tracemalloc
+import uuid
+from typing import Optional
+
+from flask import Blueprint, Response, g, has_request_context, request
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PROFILE_DIR = '../data/profiles'
+PROFILE_HEADER = 'X-Profile'
+PROFILE_ARG = 'profile'
+# The number of functions (by cumulative time) and of allocation sites reported in the text report
+REPORT_LINES = 40
+
+# Only one request is profiled at a time, since tracemalloc traces the allocations of every thread of the process
+_profile_lock = threading.Lock()
+
+
+def profiling_enabled() -> bool:
+    """Return whether profiling is enabled by the PROFILING environment variable."""
+    return os.environ.get('PROFILING', '0') == '1'
+
+
+def install(blueprint: Blueprint) -> None:
+    """Profile the requests of the app of blueprint that ask for it, if profiling is enabled (and do nothing
+    otherwise)."""
+    if profiling_enabled():
+        blueprint.before_app_request(start_profile)
+        blueprint.after_app_request(finish_profile)
+        blueprint.teardown_app_request(abandon_profile)
+        logger.warning('request profiling enabled', extra={'directory': profile_dir()})
+
+
+def is_profiling() -> bool:
+    """Return whether the current request is being profiled."""
+    return has_request_context() and 'profile' in g
+
+
+def profile_dir() -> str:
+    """Return the directory the profiles are written to."""
+    return os.environ.get('PROFILE_DIR', DEFAULT_PROFILE_DIR)
+
+
+def is_requested() -> bool:
+    """Return whether the current request asks to be profiled, with the X-Profile header or the profile query argument.
+
+    If the PROFILE_TOKEN environment variable is set, the header or argument must be equal to it; otherwise any value
+    but '' and '0' asks for a profile.
+    """
+    value = request.headers.get(PROFILE_HEADER) or request.args.get(PROFILE_ARG)
+    token = os.environ.get('PROFILE_TOKEN')
+    if token:
+        return value == token
+    return value not in (None, '', '0')
+
+
+def request_id() -> str:
+    """Return the id of the current request: its X-Request-ID header if it is a safe file name, or a new id."""
+    given = request.headers.get('X-Request-ID', '')
+    if re.fullmatch(r'[A-Za-z0-9._-]{1,64}', given) and given.strip('.'):
+        return given
+    return uuid.uuid4().hex
+
+
+def start_profile() -> None:
+    """Start profiling the current request if it asks for it and no other request is being profiled."""
+    if request.endpoint == 'static' or not is_requested():
+        return
+    if not _profile_lock.acquire(blocking=False):
+        logger.warning('profile skipped, another request is being profiled', extra={'path': request.path})
+        return
+
+    tracemalloc.start()
+    profiler = cProfile.Profile()
+    g.profile = (profiler, request_id(), time.perf_counter())
+    profiler.enable()
+
+
+def finish_profile(response: Response) -> Response:
+    """Stop profiling the current request if it is being profiled, write its profile, and tag the response with the
+    id of the profile."""
+    profile = g.pop('profile', None)
+    if profile is None:
+        return response
+
+    profiler, profile_id, start = profile
+    try:
+        profiler.disable()
+        seconds = time.perf_counter() - start
+        snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+        _profile_lock.release()
+
+    paths = write_profile(profile_id, profiler, snapshot, seconds, peak, response.status_code)
+    logger.info('request profiled', extra={'path': request.full_path, 'profile_id': profile_id,
+                                           'seconds': seconds, 'report': paths[1]})
+    response.headers['X-Profile-Id'] = profile_id
+    return response
+
+
+def abandon_profile(_: Optional[BaseException] = None) -> None:
+    """Stop profiling the current request if it is still being profiled, i.e. if it failed before it had a response."""
+    profile = g.pop('profile', None)
+    if profile is not None:
+        profile[0].disable()
+        tracemalloc.stop()
+        _profile_lock.release()
+
+
+def write_profile(profile_id: str, profiler: cProfile.Profile, snapshot: tracemalloc.Snapshot, seconds: float,
+                  peak: int, status: Optional[int] = None) -> tuple[str, str]:
+    """Write the pstats dump of profiler and a text report of it and of snapshot to the profile directory, and return
+    their paths (<profile_id>.pstats and <profile_id>.txt).
+
+    The dump can be explored with `python -m pstats <path>` or snakeviz.
+    """
+    directory = profile_dir()
+    os.makedirs(directory, exist_ok=True)
+    stats_path = os.path.join(directory, f'{profile_id}.pstats')
+    report_path = os.path.join(directory, f'{profile_id}.txt')
+    profiler.dump_stats(stats_path)
+
+    cpu = io.StringIO()
+    pstats.Stats(profiler, stream=cpu).strip_dirs().sort_stats('cumulative').print_stats(REPORT_LINES)
+    allocations = snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)]).statistics('lineno')
+
+    with open(report_path, 'w') as f:
+        f.write(f'{request.method} {request.full_path} -> {status}\n')
+        f.write(f'profile {profile_id}: {seconds * 1000:.1f} ms, peak traced memory {peak / 2 ** 20:.1f} MiB\n\n')
+        f.write(f'Top {REPORT_LINES} functions by cumulative time\n{cpu.getvalue()}\n')
+        f.write(f'Top {REPORT_LINES} allocation sites still allocated at the end of the request\n')
+        for statistic in allocations[:REPORT_LINES]:
+            f.write(f'{statistic}\n')
+    return stats_path, report_path
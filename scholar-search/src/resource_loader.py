@@ -1,57 +1,253 @@
+import hashlib
+import json
+import logging
 import os
 import pickle
+import tempfile
 import threading
-from typing import Callable
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
 
+from graph import Graph
+from metrics import CACHE_REQUESTS
 
-class ResourceCache:
-    def __init__(self, cache_dir="../data/cache"):
+CACHE_VERSION = 6  # Bump whenever the pickled format of a resource changes
+
+logger = logging.getLogger(__name__)
+
+
+class QueryCache:
+    """A thread-safe LRU cache of query results with an optional time-to-live.
+
+    Instance Attributes:
+        - name: The name of the cache in the cache metrics, or None if its lookups are not counted there.
+        - max_entries: The maximum number of results kept; the least recently used result is evicted first.
+        - ttl: The number of seconds a result stays valid, or None if results never expire.
+        - hits: The number of lookups that found a valid result.
+        - misses: The number of lookups that found no result or an expired one.
+    """
+    name: Optional[str]
+    max_entries: int
+    ttl: Optional[float]
+    hits: int
+    misses: int
+
+    def __init__(self, max_entries: int = 256, ttl: Optional[float] = None, name: Optional[str] = None) -> None:
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
         self._lock = threading.Lock()
+        self._entries = OrderedDict()  # Maps key to (time stored, result)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Return the result cached under key, or None if there is no valid result."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl is not None and time.monotonic() - entry[0] > self.ttl:
+                del self._entries[key]
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+            else:
+                self._entries.move_to_end(key)
+                self.hits += 1
+
+        if self.name is not None:
+            CACHE_REQUESTS.inc(cache=self.name, result='miss' if entry is None else 'hit')
+        return None if entry is None else entry[1]
+
+    def put(self, key: Hashable, result: Any) -> None:
+        """Cache result under key, evicting the least recently used results if the cache is full."""
+        with self._lock:
+            self._entries[key] = (time.monotonic(), result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        """Remove every cached result (the hit and miss counts are kept)."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict[str, int]:
+        """Return the size of the cache and its hit and miss counts."""
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+
+class ResourceCache:
+    """A lazy, versioned cache of the resources built from the research papers csv file.
+
+    Resources are pickled to cache_dir and only unpickled when first requested. Every cached resource has its own
+    manifest file next to it, recording the CACHE_VERSION and the fingerprint (size, mtime and SHA-256) of the csv file
+    it was built from, so a resource is rebuilt automatically when either changes; files without a matching manifest
+    are ignored. Since no two resources share a manifest file, the processes sharing cache_dir never overwrite the
+    entries of each other. Each resource has its own lock, so building one resource does not block lookups of the
+    others.
+    """
+
+    def __init__(self, cache_dir="../data/cache", source_path="../data/research-papers.csv"):
+        self._lock = threading.Lock()  # Guards _resource_locks
+        # Guards _source_fingerprint, so the csv file is hashed once without blocking the lookups of other resources
+        self._fingerprint_lock = threading.Lock()
+        self._resource_locks = {}
         self._cache = {}
-        self._query_cache = {}
+        ttl = os.environ.get('QUERY_CACHE_TTL')
+        self._query_cache = QueryCache(max_entries=int(os.environ.get('QUERY_CACHE_SIZE', 256)),
+                                       ttl=float(ttl) if ttl else None, name='query_graph')
         self._cache_dir = cache_dir
+        self._source_path = source_path
+        self._source_fingerprint = None
 
-        if os.path.exists(self._cache_dir):
-            files_iter = [f for f in os.listdir(self._cache_dir) if os.path.isfile(os.path.join(self._cache_dir, f))
-                          and f != '.DS_Store']
-            for file in files_iter:
-                filename = file[:-4]
-                filepath = os.path.join(self._cache_dir, file)
-                with open(filepath, "rb", buffering=10 * 1024 * 1024) as f:
-                    resource = pickle.load(f)
-                self._cache[filename] = resource
-        else:
-            os.makedirs(self._cache_dir)
-
-        print("finish")
+        os.makedirs(self._cache_dir, exist_ok=True)
 
     def get_one_resource(self, name: str, loader_fn: Callable):
         """Returns a cached resource or loads and caches it using loader_fn."""
         with self._lock:
+            resource_lock = self._resource_locks.setdefault(name, threading.Lock())
+
+        with resource_lock:
             if name in self._cache:
-                print(f'FOUND {name} IN CACHE!')
                 return self._cache[name]
 
             path = os.path.join(self._cache_dir, f"{name}.pkl")
 
-            if os.path.exists(path):
-                print(f"[cache] Loading {name} from {path}")
+            if os.path.exists(path) and self._is_fresh(name):
+                start = time.perf_counter()
                 with open(path, "rb", buffering=10 * 1024 * 1024) as f:
                     resource = pickle.load(f)
+                logger.info('resource loaded', extra={'resource': name, 'path': path,
+                                                      'seconds': time.perf_counter() - start})
             else:
-                print(f"[cache] Building {name}...")
+                logger.info('building resource', extra={'resource': name})
+                start = time.perf_counter()
                 resource = loader_fn()
-                with open(path, "wb") as f:
-                    pickle.dump(resource, f, protocol=pickle.HIGHEST_PROTOCOL)
-                print(f"[cache] Cached {name} to {path}")
+                _atomic_pickle(resource, path)
+                self._record(name)
+                logger.info('resource cached', extra={'resource': name, 'path': path,
+                                                      'seconds': time.perf_counter() - start})
 
             self._cache[name] = resource
             return resource
 
+    def _is_fresh(self, name: str) -> bool:
+        """Return whether the cached file of name was built by this CACHE_VERSION from the current csv file.
+
+        If the csv file is missing, the cached file is trusted, since it cannot be rebuilt without downloading.
+        The manifest is read from disk, so a resource just rebuilt by another process is seen as fresh.
+        """
+        manifest_path = self._manifest_path(name)
+        try:
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if manifest.get("version") != CACHE_VERSION:
+            return False
+        current = self._current_fingerprint(manifest["source"])
+        if current is None:
+            return True
+        if (current["size"], current["sha256"]) != (manifest["source"]["size"], manifest["source"]["sha256"]):
+            return False
+        if current != manifest["source"]:
+            # Same contents with a new mtime; remember it so the file is not hashed again
+            manifest["source"] = current
+            _atomic_write_json(manifest, manifest_path)
+        return True
+
+    def _record(self, name: str) -> None:
+        """Record in the manifest of name that it was just built from the current csv file."""
+        manifest = {"version": CACHE_VERSION, "source": self._current_fingerprint(), "built": time.time()}
+        _atomic_write_json(manifest, self._manifest_path(name))
+
+    def _manifest_path(self, name: str) -> str:
+        """Return the path of the manifest file of the resource name."""
+        return os.path.join(self._cache_dir, f"{name}.manifest.json")
+
+    def _current_fingerprint(self, known: Optional[dict] = None) -> Optional[dict]:
+        """Return the {size, mtime, sha256} fingerprint of the csv file, or None if it does not exist.
+
+        The file is only hashed when its size or mtime differ from those of the known fingerprint (and of the last
+        fingerprint computed), so an unchanged csv file is not re-read on every start.
+        """
+        if not os.path.exists(self._source_path):
+            return None
+        stat = os.stat(self._source_path)
+        if known is not None and (known["size"], known["mtime"]) == (stat.st_size, stat.st_mtime):
+            return known
+
+        with self._fingerprint_lock:
+            fingerprint = self._source_fingerprint
+            if fingerprint is None or (fingerprint["size"], fingerprint["mtime"]) != (stat.st_size, stat.st_mtime):
+                fingerprint = {"size": stat.st_size, "mtime": stat.st_mtime,
+                               "sha256": _file_sha256(self._source_path)}
+                self._source_fingerprint = fingerprint
+            return fingerprint
+
+    def get_query_graph(self, query_tokens: list[str], build_fn: Callable[[], Graph], generation: Hashable = 0,
+                        filters: Hashable = None) -> Graph:
+        """Returns the query graph cached for query_tokens, or builds and caches it using build_fn.
+
+        generation identifies the version of the index the graph is built from, so a graph built from an older index
+        is never returned. filters identifies the filters the top papers were restricted to, if any. The graph is shared
+        between requests, so callers must not mutate it (filter_query returns a view instead).
+        """
+        key = (generation, tuple(query_tokens), filters)
+        query_graph = self._query_cache.get(key)
+        if query_graph is None:
+            query_graph = build_fn()
+            self._query_cache.put(key, query_graph)
+        return query_graph
+
+
+def _file_sha256(path: str) -> str:
+    """Return the hex SHA-256 digest of the file at path."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(10 * 1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _atomic_pickle(resource: Any, path: str) -> None:
+    """Pickle resource to path through a temporary file, so a crash never leaves a truncated file at path."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(resource, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def _atomic_write_json(data: dict, path: str) -> None:
+    """Write data as JSON to path through a temporary file, so a crash never leaves a truncated file at path."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
 
 CACHE = ResourceCache()
 
 
 def get_resource(resource: str, resource_func: Callable):
-    print(f'Looking for {resource}: {CACHE._cache.keys()}')
     return CACHE.get_one_resource(resource, resource_func)
+
+
+def get_query_graph(query_tokens: list[str], build_fn: Callable[[], Graph], generation: Hashable = 0,
+                    filters: Hashable = None) -> Graph:
+    return CACHE.get_query_graph(query_tokens, build_fn, generation, filters)
+
+
+def clear_query_cache() -> None:
+    CACHE._query_cache.clear()
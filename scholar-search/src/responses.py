@@ -0,0 +1,99 @@
+"""CSC111 Winter 2025 Project 2: Cacheable JSON Responses
+This module contains the functions that build the JSON responses of the API endpoints.
+It is responsible for encoding payloads with orjson when it is installed (and json otherwise), compressing them with
+brotli or gzip as the client accepts, and tagging them with strong ETags, so that unchanged payloads are answered with
+304 Not Modified before they are built and browser and proxy caches can reuse them.
+"""
+
+from __future__ import annotations
+
+import gzip
+import hashlib
+import json
+import os
+from typing import Any, Callable
+
+from flask import Response, request
+
+from metrics import STAGE_SECONDS
+from resource_loader import QueryCache
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Encoded and compressed bodies by ETag, so a payload requested again (e.g. by another user) is not rebuilt
+BODY_CACHE = QueryCache(max_entries=int(os.environ.get('RESPONSE_CACHE_SIZE', 256)), name='response')
+
+
+def dumps(payload: Any) -> bytes:
+    """Return payload encoded as compact UTF-8 JSON.
+
+    >>> dumps({'id': 'a', 'weight': 3})
+    b'{"id":"a","weight":3}'
+    """
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+def make_etag(*parts: Any) -> str:
+    """Return a strong ETag that is the same for equal parts and different otherwise (with overwhelming probability).
+
+    >>> make_etag('query', 0) == make_etag('query', 0) != make_etag('query', 1)
+    True
+    """
+    return hashlib.sha256(repr(parts).encode('utf-8')).hexdigest()[:32]
+
+
+def choose_encoding() -> str:
+    """Return the content encoding of the response to the current request: 'br' or 'gzip' if the client accepts it,
+    and 'identity' otherwise. brotli is preferred when it is installed."""
+    offered = ['br', 'gzip', 'identity'] if brotli is not None else ['gzip', 'identity']
+    return request.accept_encodings.best_match(offered, default='identity')
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    """Return body compressed with encoding ('br', 'gzip' or 'identity')."""
+    if encoding == 'br':
+        return brotli.compress(body, quality=5)
+    if encoding == 'gzip':
+        return gzip.compress(body, compresslevel=6)
+    return body
+
+
+def cached_json_response(etag_parts: tuple, build_payload: Callable[[], Any], cache_control: str = 'no-cache') -> \
+        Response:
+    """Return the JSON response of build_payload() to the current request, tagged with an ETag of etag_parts.
+
+    etag_parts must identify the payload, i.e. equal parts must always give an equal payload. If the client already
+    has the payload (If-None-Match), answer 304 without building it. Each content encoding is a different
+    representation, so it has its own ETag. cache_control is sent as is; the default lets caches store the payload
+    but makes them revalidate it on every use.
+    """
+    encoding = choose_encoding()
+    etag = make_etag(*etag_parts, encoding)
+
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        body = BODY_CACHE.get(etag)
+        if body is None:
+            payload = build_payload()
+            with STAGE_SECONDS.time(stage='serialize'):
+                body = compress(dumps(payload), encoding)
+            BODY_CACHE.put(etag, body)
+        response = Response(body, mimetype='application/json')
+        if encoding != 'identity':
+            response.headers['Content-Encoding'] = encoding
+
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = cache_control
+    response.vary.add('Accept-Encoding')
+    return response
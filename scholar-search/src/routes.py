@@ -1,15 +1,35 @@
-from typing import Union
+import json
+import logging
+import os
+import time
+from typing import Callable, Optional, Union
 
 import requests
 from search import get_all_authors, get_all_venues
-from utils import is_partial_match, calculate_weight, save_search_history, load_search_history
-from resource_loader import get_resource
-
-from flask import Blueprint, Response, render_template, request, redirect, url_for
-from graph import load_research_graph
-from search import BM25, filter_query, get_corpus, return_query, tokenize
+from utils import calculate_weight, save_search_history, load_search_history
+from resource_loader import clear_query_cache, get_query_graph, get_resource
+from index_store import DEFAULT_INDEX_DIR, index_exists, open_index
+from incremental import GraphCorpus, IncrementalIndex, IndexSnapshot
+from filter_index import FilterIndex
+from suggest import Suggestions
+from responses import cached_json_response
+from doi_resolver import DEFAULT_CROSSREF_URL, DEFAULT_DOI_CACHE_PATH, DOICache, DOIResolver
+from metrics import REGISTRY, REQUEST_SECONDS, REQUESTS, RESPONSE_BYTES, STAGE_SECONDS
+from executor import SearchExecutor, SearchOverloaded
+from coordinator import SearchCoordinator, parse_shard_urls
+from vocabulary import TokenizedCorpus
+from warmup import Warmup
+import profiling
+
+from flask import Blueprint, Response, g, render_template, request, redirect, url_for
+from graph import Graph, load_compact_research_graph
+from search import BM25, BM25F, filter_query, return_query, tokenize
+from sharding import ShardedBM25
 
 main_routes = Blueprint('main_routes', __name__)
+logger = logging.getLogger(__name__)
+# Set PROFILING=1 to profile the requests with an X-Profile header or a profile query argument (see profiling.py)
+profiling.install(main_routes)
 
 
 @main_routes.route('/')
@@ -46,11 +66,244 @@ def search() -> Response:
                             author_filter=author_filter, venue_filter=venue_filter))
 
 
-print('[ RESOURCES ] Retrieving...')
-mega_graph = get_resource('mega_graph', load_research_graph)
-corpus = get_resource('corpus', lambda: list(get_corpus(mega_graph)))
-tokenized_corpus = get_resource('tokenized_corpus', lambda: [tokenize(s[1]) for s in corpus])
-bm25 = get_resource('bm25', lambda: BM25(tokenized_corpus))
+def base_index_version() -> str:
+    """Return an identifier of the index the server starts from, which is the same in every worker and changes
+    whenever the index is rebuilt."""
+    path = os.path.join(DEFAULT_INDEX_DIR, 'manifest.json') if index_exists() else '../data/research-papers.csv'
+    if not os.path.exists(path):
+        return 'cached'
+    stat = os.stat(path)
+    return f'{stat.st_size}-{stat.st_mtime_ns}'
+
+
+# Set SHARD_URLS to the comma-separated URLs of shard servers (see shard_server.py), shard 0 first, to answer searches
+# from them instead of loading the index in this process
+SHARD_URLS = parse_shard_urls(os.environ.get('SHARD_URLS', ''))
+COORDINATOR = None
+if SHARD_URLS:
+    COORDINATOR = SearchCoordinator(SHARD_URLS, timeout=float(os.environ.get('SHARD_TIMEOUT', 2)),
+                                    retry_interval=float(os.environ.get('SHARD_RETRY_INTERVAL', 5)))
+# Set ABSTRACT_WEIGHT (e.g. 0.3) to rank papers with BM25F over their titles and abstracts instead of titles only
+ABSTRACT_WEIGHT = os.environ.get('ABSTRACT_WEIGHT')
+# Set BM25_SHARDS (e.g. 4) to score the titles in that many shards, on BM25_SHARD_PROCESSES processes per worker
+BM25_SHARDS = int(os.environ.get('BM25_SHARDS', 0))
+DELTA_DIR = os.environ.get('DELTA_DIR', '../data/deltas')
+
+# Set by load_resources, once the warm-up of the worker process is done (INDEX last, see require_warm_worker)
+INDEX: Optional[Union[IncrementalIndex, SearchCoordinator]] = None
+INDEX_VERSION: Optional[str] = None
+SUGGESTIONS: Optional[Suggestions] = None
+FILTERS: Optional[FilterIndex] = None
+
+
+def load_resources(step: Callable[[str], None]) -> None:
+    """Load the index of the app (or connect to the shard servers), calling step with the name of every step before
+    starting it."""
+    global INDEX, INDEX_VERSION, SUGGESTIONS, FILTERS
+    if COORDINATOR is not None:
+        # The shard versions are part of the generation of the coordinator, which is checked at once
+        step('shards')
+        COORDINATOR.snapshot()
+        INDEX_VERSION = 'shards'
+        # Completions need the terms, authors and venues of the whole corpus, which no process of a sharded app has
+        SUGGESTIONS = Suggestions({}, [])
+        INDEX = COORDINATOR
+        logger.info('coordinating shards', extra={'shards': len(SHARD_URLS), 'timeout': COORDINATOR.timeout})
+        return
+
+    start_time = time.perf_counter()
+    version = base_index_version()
+    if index_exists():
+        # Built by `python index_store.py build`; memory-mapped, so it is shared by all gunicorn workers
+        step('index')
+        mega_graph, corpus, bm25 = open_index()
+    else:
+        step('graph')
+        mega_graph = get_resource('mega_graph', load_compact_research_graph)
+        corpus = GraphCorpus(mega_graph)
+        step('bm25')
+        bm25 = get_resource('bm25', lambda: BM25(TokenizedCorpus.from_texts(title for _, title in corpus)))
+
+    step('suggestions')
+    suggestions = get_resource('suggestions', lambda: Suggestions.from_graph(mega_graph, bm25.frequencies[0]))
+    logger.info('suggestions ready', extra={'terms': len(suggestions.terms), 'authors': len(suggestions.authors),
+                                            'venues': len(suggestions.venues), 'mib': suggestions.nbytes() / 2 ** 20})
+
+    if ABSTRACT_WEIGHT:
+        step('bm25f')
+        bm25 = get_resource(f'bm25f_{float(ABSTRACT_WEIGHT)}',
+                            lambda: BM25F.from_graph(mega_graph, abstract_weight=float(ABSTRACT_WEIGHT)))
+        stats = bm25.index_stats()
+        logger.info('bm25f ready', extra={'terms': stats['terms'], 'postings': stats['postings'],
+                                          'mib': stats['compressed_bytes'] / 2 ** 20,
+                                          'bytes_per_posting': stats['bytes_per_posting'],
+                                          'uncompressed_mib': stats['uncompressed_bytes'] / 2 ** 20})
+
+    wrap_model = None
+    if BM25_SHARDS > 1 and not ABSTRACT_WEIGHT:
+        step('bm25_shards')
+
+        def shard_model(model: BM25) -> ShardedBM25:
+            """Return model sharded (again after every merge of the delta segments)."""
+            return ShardedBM25.from_model(model, BM25_SHARDS, int(os.environ.get('BM25_SHARD_PROCESSES', BM25_SHARDS)))
+
+        bm25, wrap_model = shard_model(bm25), shard_model
+        logger.info('bm25 sharded', extra={'shards': BM25_SHARDS, 'processes': bm25.processes})
+
+    step('filters')
+    FILTERS = get_resource('filter_index', lambda: FilterIndex(mega_graph))
+    INDEX_VERSION, SUGGESTIONS = version, suggestions
+    # New or updated papers dropped into DELTA_DIR as csv files are added without a rebuild
+    INDEX = IncrementalIndex(mega_graph, bm25, corpus, on_change=on_index_change, wrap_model=wrap_model)
+    logger.info('resources loaded', extra={'papers': len(mega_graph), 'seconds': time.perf_counter() - start_time})
+
+
+def on_index_change() -> None:
+    """Clear the cached query graphs, and rebuild the filter index once the delta segments are merged (until then,
+    the filter index checks the papers of the delta segments one by one)."""
+    global FILTERS
+    clear_query_cache()
+    if INDEX.delta_count == 0:
+        FILTERS = FilterIndex(INDEX.snapshot().graph)
+
+
+# The resources are loaded by the gunicorn master before it forks the workers, unless they are memory-mapped (see
+# preload_resources), and otherwise in the background once a worker process starts (see gunicorn_config.py) or on its
+# first request; set BACKGROUND_WARMUP=0 to always load them here instead, on import
+WARMUP = Warmup(load_resources)
+if os.environ.get('BACKGROUND_WARMUP', '1') == '0':
+    WARMUP.run()
+
+# Drop the metrics files of the processes of previous runs (and record the memory of this one), once per app start
+REGISTRY.remove_exited()
+REGISTRY.flush()
+
+
+def preload_resources() -> None:
+    """Load the resources in this process, the gunicorn master (with preload_app), before it forks the workers, so
+    that they share the resources copy-on-write instead of each building or unpickling its own copy.
+
+    Nothing is loaded when a memory-mapped index exists, since the workers share it anyway and open it in moments, or
+    when coordinating shards. If loading fails, every worker tries again in the background and reports the error on
+    its readiness endpoint.
+    """
+    if COORDINATOR is not None or index_exists():
+        return
+    try:
+        WARMUP.run()
+    except RuntimeError:
+        logger.warning('warm-up failed before forking, the workers load the resources themselves')
+
+
+# The endpoints answered before the warm-up of their worker is done; the others are answered 503 until then
+WARMUP_ENDPOINTS = {'main_routes.healthz', 'main_routes.readyz', 'main_routes.metrics', 'main_routes.home',
+                    'main_routes.loading', 'main_routes.fetch_doi', 'static'}
+
+
+@main_routes.before_app_request
+def require_warm_worker() -> Optional[tuple[str, int, dict[str, str]]]:
+    """Start the warm-up of this worker process (a no-op once it is started), and answer 503 Service Unavailable to
+    the requests that need the index until it is done."""
+    WARMUP.start()
+    if (WARMUP.ready() and INDEX is not None) or request.endpoint in WARMUP_ENDPOINTS:
+        return None
+    return 'The search index is still loading, please try again shortly.', 503, {'Retry-After': '5'}
+
+
+@main_routes.before_app_request
+def watch_deltas() -> None:
+    """Start the delta watcher of this worker process (a no-op once it is running).
+
+    Delta segments only index titles, so there is no watcher when ranking with BM25F (or when coordinating shards).
+    """
+    if WARMUP.ready() and INDEX is not None and not ABSTRACT_WEIGHT and COORDINATOR is None:
+        INDEX.watch(DELTA_DIR, interval=float(os.environ.get('DELTA_POLL_INTERVAL', 60)))
+
+
+@main_routes.before_app_request
+def start_request_timer() -> None:
+    """Record the time the current request started at, for the request metrics."""
+    g.request_start = time.perf_counter()
+
+
+@main_routes.after_app_request
+def record_request_metrics(response: Response) -> Response:
+    """Record the latency, status and size of the response to the current request in the metrics, by route (the
+    URL rule, so that the number of series does not grow with the URLs requested)."""
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    if 'request_start' in g:
+        REQUEST_SECONDS.observe(time.perf_counter() - g.request_start, route=route)
+    REQUESTS.inc(route=route, status=str(response.status_code))
+    if response.content_length is not None:
+        RESPONSE_BYTES.observe(response.content_length, route=route)
+    REGISTRY.start_flusher()
+    return response
+
+
+RESOLVER = DOIResolver(base_url=os.environ.get('CROSSREF_URL', DEFAULT_CROSSREF_URL),
+                       cache=DOICache(os.environ.get('DOI_CACHE_PATH', DEFAULT_DOI_CACHE_PATH)),
+                       connect_timeout=float(os.environ.get('DOI_CONNECT_TIMEOUT', 3.05)),
+                       read_timeout=float(os.environ.get('DOI_READ_TIMEOUT', 10)))
+# Set CITING_PER_SEED (e.g. 3) to also expand every top paper to its most cited citing papers
+CITING_PER_SEED = int(os.environ.get('CITING_PER_SEED', 0))
+# Set DOI_PREFETCH=1 to resolve the DOIs of the blue (level 1) papers of every new result graph in the background
+DOI_PREFETCH = os.environ.get('DOI_PREFETCH', '0') == '1'
+
+
+# The query graphs of every worker process are built on SEARCH_WORKERS threads, identical searches in progress are
+# shared, and a search arriving while SEARCH_QUEUE others are waiting is answered 503 at once
+SEARCH_EXECUTOR = SearchExecutor(max_workers=int(os.environ.get('SEARCH_WORKERS', 2)),
+                                 max_queue=int(os.environ.get('SEARCH_QUEUE', 8)),
+                                 timeout=float(os.environ.get('SEARCH_TIMEOUT', 30)))
+
+
+@main_routes.app_errorhandler(SearchOverloaded)
+def search_overloaded(error: SearchOverloaded) -> tuple[str, int, dict[str, str]]:
+    """Return a 503 Service Unavailable response, asking the client to try again after a while."""
+    logger.warning('search shed', extra={'path': request.full_path, 'reason': str(error)})
+    return 'The server is busy, please try again shortly.', 503, {'Retry-After': str(error.retry_after)}
+
+
+def active_filters(citations: str, author: str, venue: str) -> Optional[tuple[str, str, str]]:
+    """Return the (citations, author, venue) filters in a canonical form, or None if no filter is applied."""
+    min_citations = int(citations or 0)
+    if min_citations <= 0 and author == "0" and venue == "0":
+        return None
+    return str(min_citations), author, venue
+
+
+def build_ranked_graph(snapshot: IndexSnapshot, query: str, filters: Optional[tuple[str, str, str]] = None) -> Graph:
+    """Return the query graph of query over snapshot, with its top papers chosen among those passing filters, and
+    start prefetching the DOIs of its level 1 papers if DOI_PREFETCH is set."""
+    if COORDINATOR is not None:
+        ranked_graph = COORDINATOR.query_graph(query, filters, generation=snapshot.generation)
+    else:
+        mask = None
+        if filters is not None:
+            with STAGE_SECONDS.time(stage='filter'):
+                mask = FILTERS.mask(snapshot.graph, *filters)
+        ranked_graph = return_query(snapshot.graph, query, snapshot.bm25, snapshot.corpus, CITING_PER_SEED, mask)
+    if DOI_PREFETCH:
+        RESOLVER.prefetch((vertex.item.title, vertex.item.authors[0])
+                          for vertex in ranked_graph.get_all_item_vertex_mappings().values() if vertex.level == 1)
+    return ranked_graph
+
+
+def get_ranked_graph(snapshot: IndexSnapshot, query: str, filters: Optional[tuple[str, str, str]] = None) -> Graph:
+    """Return the query graph of query over snapshot with the given filters, from the query cache or built by the
+    search executor (together with the identical searches in progress).
+
+    Raise SearchOverloaded if the search executor is too busy to build it.
+    """
+    with STAGE_SECONDS.time(stage='tokenize'):
+        tokens = tokenize(query)
+    key = (snapshot.generation, tuple(tokens), filters)
+
+    def build() -> Graph:
+        return SEARCH_EXECUTOR.run(key, lambda: build_ranked_graph(snapshot, query, filters),
+                                   inline=profiling.is_profiling())
+
+    return get_query_graph(tokens, build, snapshot.generation, filters)
 
 
 @main_routes.route('/results')
@@ -58,7 +311,8 @@ def results() -> str:
     """
     Return a string redirecting the user to the results page based on the searched query and filters.
     This is the main search results page where the user can see the search results and apply filters based on their
-    input. The search results are visualized as a graph with nodes representing papers and edges representing citations.
+    input. The search results are visualized as a graph with nodes representing papers and edges representing citations;
+    the page fetches the graph itself from /api/graph.
     """
 
     query = request.args.get('query', '')
@@ -67,32 +321,122 @@ def results() -> str:
     venue_filter = request.args.get('venue_filter', '0')
     search_history = load_search_history()
 
-    print("before building")
-    query_graph = filter_query(return_query(mega_graph, query, bm25, corpus), citations_filter, author_filter,
-                               venue_filter)
-    print("after building")
+    ranked_graph = get_ranked_graph(INDEX.snapshot(), query)
+
+    authors = get_all_authors(ranked_graph)
+    venues = get_all_venues(ranked_graph)
+    graph_url = url_for('main_routes.graph_api', query=query, citations_filter=citations_filter,
+                        author_filter=author_filter, venue_filter=venue_filter)
+
+    with STAGE_SECONDS.time(stage='render'):
+        return render_template('query.html', graphUrl=graph_url, query=query,
+                               authors=authors, venues=venues, searchHistory=search_history)
+
+
+@main_routes.route('/api/graph')
+def graph_api() -> Response:
+    """
+    Return the JSON {"nodes": [...], "links": [...]} of the graph of the searched query and filters.
+    Nodes only have what is drawn (id, title, weight, group and first author); see /paper for the rest.
+    The response has a strong ETag of the query, the filters and the version of the index, so a client that already
+    has the graph gets 304 Not Modified.
+    """
+    query = request.args.get('query', '')
+    citations_filter = request.args.get('citations_filter', '')
+    author_filter = request.args.get('author_filter', '0')
+    venue_filter = request.args.get('venue_filter', '0')
+    snapshot = INDEX.snapshot()
+
+    def build_payload() -> dict:
+        # The filters restrict the top papers themselves; filter_query then hides the references that do not pass
+        filters = active_filters(citations_filter, author_filter, venue_filter)
+        ranked_graph = get_ranked_graph(snapshot, query, filters)
+        with STAGE_SECONDS.time(stage='filter'):
+            query_dict = filter_query(ranked_graph, citations_filter, author_filter, venue_filter)
+
+        nodes_data = [{"id": query_dict[key].item.paper_id,
+                       "title": query_dict[key].item.title,
+                       "weight": calculate_weight(len(query_dict[key].neighbours)),
+                       "group": query_dict[key].level,
+                       "author": query_dict[key].item.authors[0]}
+                      for key in query_dict]
+
+        links_data = []
+        for paper in query_dict:
+            for x in query_dict[paper].item.references:
+                if x in query_dict:
+                    links_data.append({"source": query_dict[x].item.paper_id,
+                                       "target": query_dict[paper].item.paper_id})
+
+        return {"nodes": nodes_data, "links": links_data}
+
+    return cached_json_response(('graph', query, citations_filter, author_filter, venue_filter,
+                                 INDEX_VERSION, snapshot.generation, ABSTRACT_WEIGHT, CITING_PER_SEED), build_payload)
 
-    authors = get_all_authors(query_graph)
-    venues = get_all_venues(query_graph)
-    query_dict = query_graph.get_all_item_vertex_mappings()
 
-    nodes_data = [{"id": query_dict[key].item.paper_id,
-                   "title": query_dict[key].item.title,
-                   "weight": calculate_weight(len(query_dict[key].neighbours)),
-                   "group": query_dict[key].level,
-                   "authors": query_dict[key].item.authors,
-                   "abstract": query_dict[key].item.abstract}
-                  for key in query_dict if query_dict[key].visible]
+@main_routes.route('/paper/<paper_id>')
+def paper_details(paper_id: str) -> Union[Response | tuple[str, int]]:
+    """
+    Return the JSON {"id", "authors", "abstract"} of the paper with the given id, for the tooltip of the graph.
+    Papers only change when a delta csv file updates them, so the response may be cached for an hour.
+    """
+    snapshot = INDEX.snapshot()
+    if COORDINATOR is not None:
+        paper = COORDINATOR.paper(paper_id, snapshot.generation)
+        if paper is None:
+            return 'Paper not found', 404
+    else:
+        try:
+            paper = snapshot.graph.paper(snapshot.graph.index_of(paper_id))
+        except KeyError:
+            return 'Paper not found', 404
+
+    return cached_json_response(('paper', paper_id, INDEX_VERSION, snapshot.generation),
+                                lambda: {"id": paper.paper_id, "authors": paper.authors, "abstract": paper.abstract},
+                                cache_control='public, max-age=3600')
+
+
+@main_routes.route('/suggest')
+def suggest() -> Response:
+    """
+    Return the JSON {"terms": [...], "authors": [...], "venues": [...]} of the completions of the prefix typed in the
+    search box, most frequent (terms) or most cited (authors and venues) first.
+    """
+    prefix = request.args.get('prefix', '')
+    limit = request.args.get('limit', 10, type=int)
+    return cached_json_response(('suggest', prefix, limit, INDEX_VERSION), lambda: SUGGESTIONS.suggest(prefix, limit),
+                                cache_control='public, max-age=3600')
 
-    links_data = []
-    for paper in query_dict:
-        for x in query_dict[paper].item.references:
-            if x in query_dict and query_dict[x].visible and query_dict[paper].visible:
-                links_data.append({"source": query_dict[x].item.paper_id,
-                                   "target": query_dict[paper].item.paper_id})
 
-    return render_template('query.html', nodesData=nodes_data, linksData=links_data, query=query,
-                           authors=authors, venues=venues, searchHistory=search_history)
+@main_routes.route('/metrics')
+def metrics() -> Response:
+    """
+    Return the metrics of all the workers of the app (request and search stage latencies, cache hits and misses,
+    result and response sizes, and resident memory) in the Prometheus text format.
+    """
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+
+@main_routes.route('/healthz')
+def healthz() -> Response:
+    """
+    Return the JSON {"status": "ok"} as soon as the worker serves requests, whether or not its index is loaded.
+    """
+    return Response('{"status":"ok"}', mimetype='application/json', headers={'Cache-Control': 'no-store'})
+
+
+@main_routes.route('/readyz')
+def readyz() -> tuple[Response, int]:
+    """
+    Return the JSON progress of the warm-up of the worker (see warmup.Warmup.status), with status 200 once its index
+    is loaded and 503 until then (or if loading failed), so that a load balancer only sends searches to warm workers.
+    With shard servers, the shards that did not answer the last request are listed in "missing_shards".
+    """
+    status = WARMUP.status()
+    if COORDINATOR is not None:
+        status['missing_shards'] = COORDINATOR.missing_shards()
+    response = Response(json.dumps(status), mimetype='application/json', headers={'Cache-Control': 'no-store'})
+    return response, 200 if status['ready'] else 503
 
 
 @main_routes.route('/fetch_doi', methods=['POST'])
@@ -103,23 +447,13 @@ def fetch_doi() -> Union[Response | tuple[str, int]]:
 
     Return an error message if the request fails.
     """
-    title = request.form.get('title')
-    author = request.form.get('author')
-
-    url = f"https://api.crossref.org/works?query.title={title}&query.author={author}"
+    title = request.form.get('title', '')
+    author = request.form.get('author', '')
 
     try:
-        response = requests.get(url)
-        response.raise_for_status()
-        data = response.json()
-
-        items = data.get('message', {}).get('items', [])
-        if items:
-            doi_title = items[0].get('title', [''])[0]
-            doi_url = items[0].get('URL', None)
-
-            if doi_url and is_partial_match(title, doi_title):
-                return redirect(doi_url)
+        doi_url = RESOLVER.resolve(title, author)
+        if doi_url:
+            return redirect(doi_url)
 
         # Fallback to Google Scholar if no DOI found
         scholar_query = f"{title} {author}"
@@ -5,12 +5,30 @@ It is responsible for tokenizing the text, calculating the BM25 scores, and buil
 weighted papers with the highest scores (i.e. most related to the given query).
 """
 
+from __future__ import annotations
+
 import math
+import time
+from array import array
 from collections import defaultdict
+from collections.abc import Iterable, Sequence
+from typing import Callable, Mapping, NamedTuple, Optional
+
+import numpy as np
+from scipy import sparse
 
-from graph import Graph, load_research_graph
+from graph import CompactGraph, Graph, Paper, _Vertex, load_research_graph
+from metrics import RESULT_PAPERS, STAGE_SECONDS
+from postings import CompressedPostings
 from utils import tokenize
-import heapq
+from vocabulary import TokenizedCorpus
+
+
+class CollectionStatistics(NamedTuple):
+    """The statistics of a whole corpus that BM25 weights depend on, for a model over only part of it (a shard)."""
+    doc_count: int
+    average_doc_length: float
+    document_frequencies: Mapping[str, int]
 
 
 class BM25:
@@ -20,122 +38,554 @@ class BM25:
     Instance Attributes:
     - k1: Term frequency saturation parameter.
     - b: Document length normalization parameter.
-    - tokenized_corpus: Tokenized documents.
     - doc_count: Total number of documents.
     - doc_lengths: Lengths of documents.
     - average_doc_length: Average document length.
     - frequencies: (DF: doc frequency, IDF: inverse doc frequency).
+    - vocabulary: Maps each term to its column in weights (its term id in the TokenizedCorpus the model was built from).
+    - weights: A (doc_count x len(vocabulary)) sparse matrix in CSC form holding IDF * saturated TF for k1 and b.
+      The column of a term is its postings list: indices are the document ids and data the BM25 weights.
+    - term_upper_bounds: The maximum weight in each column, i.e. the most a term can add to any document's score.
     """
 
     k1: float
     b: float
-    tokenized_corpus: list
     doc_count: int
-    doc_lengths: list[int]
+    doc_lengths: np.ndarray
     average_doc_length: float
-    frequencies: tuple[dict, dict]
-
-    def __init__(self, tokenized_corpus_list: list, k1: float = 1.25, b: float = 0.75) -> None:
+    frequencies: tuple[Mapping, Mapping]
+    vocabulary: Mapping[str, int]
+    weights: sparse.csc_matrix
+    term_upper_bounds: np.ndarray
+
+    def __init__(self, tokenized_corpus: TokenizedCorpus | Sequence[list[str]], k1: float = 1.25, b: float = 0.75,
+                 collection: Optional[CollectionStatistics] = None) -> None:
+        """Initialize a model of the given documents (a list of token lists is interned into a TokenizedCorpus
+        first). The model keeps the vocabulary of the documents, but not the documents themselves.
+
+        If collection is given, the documents are part of a larger corpus, and their weights are computed with its
+        IDF and average document length, so that their scores are those they have in a model of the whole corpus.
+
+        >>> model = BM25([[], []])
+        >>> model.average_doc_length, model.get_scores('graph').tolist()
+        (1, [0.0, 0.0])
+        """
+        if not isinstance(tokenized_corpus, TokenizedCorpus):
+            tokenized_corpus = TokenizedCorpus.from_token_lists(tokenized_corpus)
         self.k1 = k1
         self.b = b
-        self.tokenized_corpus = tokenized_corpus_list
-        self.doc_count = len(tokenized_corpus_list)
-        self.doc_lengths = [len(doc) for doc in tokenized_corpus_list]
-        self.average_doc_length = sum(self.doc_lengths) / self.doc_count if self.doc_count > 0 else 1
-        self.frequencies = (defaultdict(int), {})  # (DF, IDF)
-
-        # Calculate document frequencies (DF)
-        for doc_tokens in tokenized_corpus_list:
-            unique_tokens = set(doc_tokens)
-            for token in unique_tokens:
-                self.frequencies[0][token] += 1
-
-        self.calculate_idf()
-
-    def calculate_idf(self) -> None:
+        self.doc_count = len(tokenized_corpus)
+        self.doc_lengths = tokenized_corpus.doc_lengths().astype(np.int32)
+        # A corpus of empty documents (or no documents) has no average length, and its length norms are all 1 - b
+        total_length = int(self.doc_lengths.sum())
+        self.average_doc_length = total_length / self.doc_count if total_length > 0 else 1
+        if collection is not None and collection.average_doc_length > 0:
+            self.average_doc_length = collection.average_doc_length
+        self.vocabulary = tokenized_corpus.vocabulary
+
+        # Collect the (document, term, TF) triples of the doc-term matrix: the distinct (document, term id) pairs of
+        # the corpus, in document then term id order, with their counts
+        term_count = max(len(self.vocabulary), 1)
+        doc_ids = np.repeat(np.arange(self.doc_count, dtype=np.int64), self.doc_lengths)
+        pairs, tfs = np.unique(doc_ids * term_count + tokenized_corpus.term_ids, return_counts=True)
+        rows, cols = (pairs // term_count).astype(np.int32), (pairs % term_count).astype(np.int32)
+        self._compute_weights(rows, cols, tfs, collection)
+
+    @classmethod
+    def from_term_frequencies(cls, vocabulary: dict[str, int], rows: np.ndarray, cols: np.ndarray, tfs: np.ndarray,
+                              doc_lengths: np.ndarray, k1: float = 1.25, b: float = 0.75) -> BM25:
+        """Return the model of the documents with the given (document, term id, TF) triples, which is the model built
+        from their tokens (with its terms in the order of vocabulary).
+
+        Preconditions:
+            - The ids of vocabulary are 0 to len(vocabulary) - 1, in iteration order, and each of them is in cols.
+            - The (rows[i], cols[i]) pairs are distinct and sorted by document, then term id.
+            - doc_lengths[d] is the number of tokens of document d, i.e. the sum of the TFs of its triples.
+        """
+        model = cls.__new__(cls)
+        model.k1, model.b = k1, b
+        model.doc_count = len(doc_lengths)
+        model.doc_lengths = doc_lengths.astype(np.int32)
+        total_length = int(model.doc_lengths.sum())
+        model.average_doc_length = total_length / model.doc_count if total_length > 0 else 1
+        model.vocabulary = vocabulary
+        model._compute_weights(rows.astype(np.int32), cols.astype(np.int32), tfs)
+        return model
+
+    def _compute_weights(self, rows: np.ndarray, cols: np.ndarray, tfs: np.ndarray,
+                         collection: Optional[CollectionStatistics] = None) -> None:
+        """Compute the DF, IDF, weights and term upper bounds of the model from the (document, term id, TF) triples
+        of its documents, sorted by document then term id."""
+        document_frequencies = np.bincount(cols, minlength=len(self.vocabulary))
+        self.frequencies = (defaultdict(int, zip(self.vocabulary, document_frequencies.tolist())), {})  # (DF, IDF)
+
+        if collection is None:
+            self.calculate_idf()
+        else:
+            for token in self.frequencies[0]:
+                self.frequencies[0][token] = collection.document_frequencies[token]
+            self.calculate_idf(collection.doc_count)
+
+        idf = np.array([self.frequencies[1][token] for token in self.vocabulary], dtype=np.float64)
+        length_norms = self.k1 * (1 - self.b + self.b * (self.doc_lengths / self.average_doc_length))
+        data = idf[cols] * (tfs * (self.k1 + 1)) / (tfs + length_norms[rows])
+        self.weights = sparse.csc_matrix((data, (rows, cols)), shape=(self.doc_count, len(self.vocabulary)))
+        self.term_upper_bounds = self.weights.max(axis=0).toarray().ravel()
+
+    @classmethod
+    def from_arrays(cls, vocabulary: Mapping[str, int], weights: sparse.csc_matrix, term_upper_bounds: np.ndarray,
+                    doc_lengths: np.ndarray, frequencies: tuple[Mapping, Mapping], k1: float, b: float,
+                    average_doc_length: float) -> BM25:
+        """Return a BM25 model over already computed weights (e.g. memory-mapped from an index).
+
+        Preconditions:
+            - weights holds the BM25 weights of doc_lengths.shape[0] documents for the given k1, b and frequencies.
+        """
+        model = cls.__new__(cls)
+        model.k1, model.b = k1, b
+        model.doc_count = weights.shape[0]
+        model.doc_lengths = doc_lengths
+        model.average_doc_length = average_doc_length
+        model.frequencies = frequencies
+        model.vocabulary = vocabulary
+        model.weights = weights
+        model.term_upper_bounds = term_upper_bounds
+        return model
+
+    def calculate_idf(self, collection_size: Optional[int] = None) -> None:
         """Compute IDF scores for all query items
 
         The formula for IDF is: log((N - n + 0.5) / (n + 0.5) + 1),
-        where N is the total number of documents, n is the number of documents containing the term.
+        where N is the total number of documents (collection_size, by default doc_count), n is the number of documents
+        containing the term.
         """
+        total = self.doc_count if collection_size is None else collection_size
         for token, freq in self.frequencies[0].items():
-            self.frequencies[1][token] = math.log((self.doc_count - freq + 0.5) / (freq + 0.5) + 1)
+            self.frequencies[1][token] = math.log((total - freq + 0.5) / (freq + 0.5) + 1)
+
+    def term_frequencies(self, token: str) -> tuple[np.ndarray, np.ndarray]:
+        """Return the (document ids, term frequencies) postings of token, or empty arrays if it is not in the corpus.
 
-    def get_scores(self, query: str) -> list[float]:
+        The term frequencies are not stored; they are recovered exactly from the weights by inverting the BM25
+        formula, TF = w * norm / (IDF * (k1 + 1) - w), where norm = k1 * (1 - b + b * (doc_length / avg_doc_length)).
+        """
+        if token not in self.vocabulary:
+            return np.array([], dtype=np.int32), np.array([], dtype=np.int64)
+        col = self.vocabulary[token]
+        start, end = self.weights.indptr[col], self.weights.indptr[col + 1]
+        doc_ids, weights = self.weights.indices[start:end], self.weights.data[start:end]
+        norms = self.k1 * (1 - self.b + self.b * (self.doc_lengths[doc_ids] / self.average_doc_length))
+        tfs = weights * norms / (self.frequencies[1][token] * (self.k1 + 1) - weights)
+        return doc_ids, np.rint(tfs).astype(np.int64)
+
+    def postings(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Return the (document ids, columns, term frequencies) of all the postings of the model, column by column,
+        with the term frequencies recovered like term_frequencies does."""
+        idf = np.empty(len(self.vocabulary), dtype=np.float64)
+        for token, col in self.vocabulary.items():
+            idf[col] = self.frequencies[1][token]
+        cols = np.repeat(np.arange(len(self.vocabulary), dtype=np.int64), np.diff(self.weights.indptr))
+        doc_ids, weights = self.weights.indices.astype(np.int64), self.weights.data
+        norms = self.k1 * (1 - self.b + self.b * (self.doc_lengths[doc_ids] / self.average_doc_length))
+        tfs = weights * norms / (idf[cols] * (self.k1 + 1) - weights)
+        return doc_ids, cols, np.rint(tfs).astype(np.int64)
+
+    def get_scores(self, query: str) -> np.ndarray:
         """Calculate BM25 scores for all documents
 
         The formula for BM25 scores is: IDF * (TF * (k1 + 1)) / (TF + k1 * (1 - b + b * (doc_length / avg_doc_length))).
+        The weights are precomputed, so scoring adds the column of each query token into a dense score vector.
         """
-        query_tokens = tokenize(query)
-        scores = [0.0] * self.doc_count
-
-        for i, doc_tokens in enumerate(self.tokenized_corpus):
-            doc_length = self.doc_lengths[i]
-            for token in query_tokens:
-                if token not in self.frequencies[1]:
-                    continue
-                tf = doc_tokens.count(token)
-                numer = tf * (self.k1 + 1)
-                denom = tf + self.k1 * (1 - self.b + self.b * (doc_length / self.average_doc_length))
-                scores[i] += self.frequencies[1][token] * numer / denom
+        scores = np.zeros(self.doc_count, dtype=np.float64)
+        indptr, indices, data = self.weights.indptr, self.weights.indices, self.weights.data
+
+        for token in tokenize(query):
+            if token not in self.vocabulary:
+                continue
+            col = self.vocabulary[token]
+            start, end = indptr[col], indptr[col + 1]
+            scores[indices[start:end]] += data[start:end]
 
         return scores
 
-    def get_top_n_paper_score(self, query: str, corpus_list: list, n: int = 200) -> list:
+    def get_top_n_paper_score(self, query: str, corpus_list: list, n: int = 200, exhaustive: bool = False,
+                              mask: Optional[np.ndarray] = None) -> list:
         """
         Return a list of the top N papers with scores
+
+        By default the top N are found with MaxScore dynamic pruning (see get_top_n_pruned). Set exhaustive to score
+        every document instead; both return the same ranking, so the exhaustive path is the check for the pruned one.
+        If mask (a boolean array over the documents, e.g. from filter_index.FilterIndex) is given, the top N are
+        chosen among the documents where it is True that match the query, so there may be fewer than N of them;
+        without a mask, the top N are padded with documents of score 0 as before.
+
+        >>> model = BM25([['graph', 'search'], ['sorting'], ['graph', 'theory'], ['search']])
+        >>> corpus = [(str(i), '') for i in range(4)]
+        >>> mask = np.array([True, True, False, True])
+        >>> [paper[0] for paper in model.get_top_n_paper_score('graph', corpus, 3, mask=mask)]
+        ['0']
+        >>> [paper[0] for paper in model.get_top_n_paper_score('graph', corpus, 3)]
+        ['0', '2', '1']
         """
-        # Ensure corpus_list and scores have the same length
-        scores = self.get_scores(query)
-        if len(corpus_list) != len(scores):
+        if len(corpus_list) != self.doc_count:
             raise ValueError("Mismatch between corpus_list and scores length.")
 
-        # Get the top N scores
-        top_n = heapq.nlargest(n, enumerate(scores), key=lambda x: x[1])
+        if exhaustive or mask is not None:
+            scores = self.get_scores(query)
+            top_n = [(i, float(scores[i])) for i in _top_n_indices(scores, n, mask)]
+        else:
+            top_n = self.get_top_n_pruned(query, n)
         return [[corpus_list[i][0], corpus_list[i][1], score, 0] for i, score in top_n]
 
+    def get_top_n_pruned(self, query: str, n: int = 200) -> list[tuple[int, float]]:
+        """
+        Return the top N (document id, score) pairs for query using MaxScore dynamic pruning.
 
-def get_corpus(g: Graph):
+        Query terms are visited from the highest to the lowest upper bound. Once the upper bounds of the unvisited
+        terms sum to less than the current N-th best partial score, documents that have not been seen yet cannot
+        enter the top N, so the remaining terms are only looked up (by binary search) for the surviving candidates,
+        and candidates whose partial score plus the remaining upper bounds falls below the threshold are dropped.
+        The survivors are then rescored in query order, so scores and ties match get_scores exactly.
+        """
+        indptr, indices, data = self.weights.indptr, self.weights.indices, self.weights.data
+        # Terms without postings (in the documents of a shard, see ShardedBM25) add nothing to any score
+        cols = [self.vocabulary[token] for token in tokenize(query) if token in self.vocabulary]
+        cols = [col for col in cols if indptr[col + 1] > indptr[col]]
+        term_counts = defaultdict(int)
+        for col in cols:
+            term_counts[col] += 1
+
+        # A term repeated in the query contributes its weight once per occurrence
+        terms = sorted(term_counts, key=lambda c: self.term_upper_bounds[c] * term_counts[c], reverse=True)
+        remaining_bound = sum(float(self.term_upper_bounds[c] * term_counts[c]) for c in terms)
+
+        candidates = np.array([], dtype=indices.dtype)
+        partial = np.array([], dtype=np.float64)
+        threshold = 0.0
+        for col in terms:
+            start, end = indptr[col], indptr[col + 1]
+            term_ids, term_weights = indices[start:end], data[start:end] * term_counts[col]
+            if remaining_bound >= threshold * (1 - _PRUNING_TOLERANCE):
+                # Essential term: any of its documents could still reach the top N
+                all_ids = np.concatenate((candidates, term_ids))
+                candidates, inverse = np.unique(all_ids, return_inverse=True)
+                partial = np.bincount(inverse, weights=np.concatenate((partial, term_weights)),
+                                      minlength=len(candidates))
+            else:
+                # Non-essential term: only add its weights to the existing candidates
+                pos = np.minimum(np.searchsorted(term_ids, candidates), len(term_ids) - 1)
+                hit = term_ids[pos] == candidates
+                partial[hit] += term_weights[pos[hit]]
+
+            remaining_bound -= float(self.term_upper_bounds[col] * term_counts[col])
+            if len(partial) >= n > 0:
+                threshold = float(partial[np.argpartition(partial, -n)[-n:]].min())
+                keep = partial + remaining_bound >= threshold * (1 - _PRUNING_TOLERANCE)
+                candidates, partial = candidates[keep], partial[keep]
+
+        scores = np.zeros(len(candidates), dtype=np.float64)
+        for col in cols:
+            term_ids = indices[indptr[col]:indptr[col + 1]]
+            pos = np.minimum(np.searchsorted(term_ids, candidates), len(term_ids) - 1)
+            hit = term_ids[pos] == candidates
+            scores[hit] += data[indptr[col] + pos[hit]]
+
+        top_n = [(int(candidates[i]), float(scores[i])) for i in _top_n_indices(scores, n)]
+        return top_n + _zero_score_padding(candidates, n - len(top_n), self.doc_count)
+
+    def get_top_n_batch(self, queries: list[str], n: int = 200) -> list[list[tuple[int, float]]]:
+        """
+        Return the top N (document id, score) pairs of every query in queries.
+
+        All queries are scored with a single sparse (queries x terms) by (terms x documents) product, so this is the
+        entry point for offline jobs and warm-up that score many queries at once.
+        Like get_top_n_paper_score, results with fewer than N matching documents are padded with zero-score documents.
+        """
+        query_rows, query_cols = array('i'), array('i')
+        for row, query in enumerate(queries):
+            for token in tokenize(query):
+                if token in self.vocabulary:
+                    query_rows.append(row)
+                    query_cols.append(self.vocabulary[token])
+
+        query_matrix = sparse.csr_matrix((np.ones(len(query_rows)), (np.frombuffer(query_rows, dtype=np.int32),
+                                                                     np.frombuffer(query_cols, dtype=np.int32))),
+                                         shape=(len(queries), len(self.vocabulary)))
+        score_matrix = (query_matrix @ self.weights.T).tocsr()
+        score_matrix.sort_indices()
+
+        results = []
+        for row in range(len(queries)):
+            start, end = score_matrix.indptr[row], score_matrix.indptr[row + 1]
+            doc_ids, scores = score_matrix.indices[start:end], score_matrix.data[start:end]
+            top_n = [(int(doc_ids[i]), float(scores[i])) for i in _top_n_indices(scores, n)]
+            results.append(top_n + _zero_score_padding(doc_ids, n - len(top_n), self.doc_count))
+        return results
+
+
+class BM25F:
+    """A BM25F model over the title and abstract fields of papers, with compressed postings lists.
+
+    The term frequency of a term in a paper is the sum over the fields of the field weight times the term frequency in
+    the field, normalized by the field length; it is then saturated once with k1 and multiplied by the IDF of the term
+    over all papers, so a term found in both fields is not counted twice. The postings of each field are stored
+    compressed and decoded block by block at query time.
+
+    With the title field alone, it ranks like BM25 with the same k1 and b, but its scores are not guaranteed to be
+    identical: the average field lengths are taken to be at least 1 (so a corpus of mostly empty titles scores
+    differently), and the length normalization is applied in another order, which may change the last bits of a score.
+
+    Instance Attributes:
+        - k1: Term frequency saturation parameter.
+        - fields: The names of the fields, in the order of the tuples given to the constructor.
+        - field_weights: The weight of each field.
+        - field_b: The length normalization parameter of each field.
+        - doc_count: The number of documents in the corpus.
+        - vocabulary: Maps each term to its term id.
+        - postings: The compressed postings lists of each field, indexed by term id.
+        - field_lengths: The number of tokens of each document in each field.
+        - average_field_lengths: The average number of tokens of each field.
+        - idf: The IDF of each term id.
+
+    >>> model = BM25F([(['graph', 'search'], ['we', 'search', 'graphs']), (['sorting'], ['graph', 'sorting'])])
+    >>> [round(score, 3) for _, _, score, _ in model.get_top_n_paper_score('graph', [('a', ''), ('b', '')], n=2)]
+    [0.16, 0.09]
+    """
+    k1: float
+    fields: tuple[str, ...]
+    field_weights: tuple[float, ...]
+    field_b: tuple[float, ...]
+    doc_count: int
+    vocabulary: dict[str, int]
+    postings: tuple[CompressedPostings, ...]
+    field_lengths: tuple[np.ndarray, ...]
+    average_field_lengths: tuple[float, ...]
+    idf: np.ndarray
+    # Private Instance Attributes:
+    #     - _query_count: The number of queries scored so far.
+    #     - _query_seconds: The total time spent scoring them.
+    _query_count: int
+    _query_seconds: float
+
+    def __init__(self, documents: Iterable[tuple[list[str], ...]], k1: float = 1.25,
+                 fields: tuple[str, ...] = ('title', 'abstract'), field_weights: tuple[float, ...] = (1.0, 0.3),
+                 field_b: tuple[float, ...] = (0.75, 0.75)) -> None:
+        self.k1 = k1
+        self.fields, self.field_weights, self.field_b = fields, field_weights, field_b
+        self.vocabulary = {}
+        raw_postings = tuple([] for _ in fields)
+        lengths = tuple(array('I') for _ in fields)
+        frequencies = array('I')
+
+        doc_id = -1
+        for doc_id, doc_fields in enumerate(documents):
+            seen = set()
+            for field, tokens in enumerate(doc_fields):
+                lengths[field].append(len(tokens))
+                counts = {}
+                for token in tokens:
+                    counts[token] = counts.get(token, 0) + 1
+                for token, tf in counts.items():
+                    term = self.vocabulary.setdefault(token, len(self.vocabulary))
+                    if term == len(frequencies):
+                        frequencies.append(0)
+                        for field_postings in raw_postings:
+                            field_postings.append((array('I'), array('I')))
+                    if term not in seen:
+                        seen.add(term)
+                        frequencies[term] += 1
+                    doc_ids, tfs = raw_postings[field][term]
+                    doc_ids.append(doc_id)
+                    tfs.append(tf)
+
+        self.doc_count = doc_id + 1
+        self.postings = tuple(CompressedPostings.from_lists(field_postings) for field_postings in raw_postings)
+        self.field_lengths = tuple(np.frombuffer(field_lengths, dtype=np.uint32).astype(np.int32)
+                                   for field_lengths in lengths)
+        self.average_field_lengths = tuple(max(float(np.mean(field_lengths)), 1.0) if self.doc_count > 0 else 1.0
+                                           for field_lengths in self.field_lengths)
+        df = np.frombuffer(frequencies, dtype=np.uint32).astype(np.float64)
+        self.idf = np.log((self.doc_count - df + 0.5) / (df + 0.5) + 1)
+        self._query_count, self._query_seconds = 0, 0.0
+
+    @classmethod
+    def from_graph(cls, g: Graph | CompactGraph, abstract_weight: float = 0.3, k1: float = 1.25) -> BM25F:
+        """Return a BM25F model over the titles and abstracts of the papers of g, in the order of get_corpus(g)."""
+        papers = (vertex.item for vertex in g.get_all_item_vertex_mappings().values())
+        return cls(((tokenize(paper.title), tokenize(paper.abstract)) for paper in papers), k1,
+                   field_weights=(1.0, abstract_weight))
+
+    def get_scores(self, query: str) -> np.ndarray:
+        """Calculate BM25F scores for all documents in the corpus."""
+        scores = np.zeros(self.doc_count, dtype=np.float64)
+        for token in tokenize(query):
+            term = self.vocabulary.get(token)
+            if term is None:
+                continue
+            doc_parts, tf_parts = [], []
+            for field, postings in enumerate(self.postings):
+                weight, b = self.field_weights[field], self.field_b[field]
+                lengths, average_length = self.field_lengths[field], self.average_field_lengths[field]
+                for doc_ids, tfs in postings.iter_blocks(term):
+                    doc_parts.append(doc_ids)
+                    tf_parts.append(weight * tfs / (1 - b + b * lengths[doc_ids] / average_length))
+            doc_ids, inverse = np.unique(np.concatenate(doc_parts), return_inverse=True)
+            tfs = np.bincount(inverse, weights=np.concatenate(tf_parts))
+            scores[doc_ids] += self.idf[term] * (tfs * (self.k1 + 1)) / (tfs + self.k1)
+        return scores
+
+    def get_top_n_paper_score(self, query: str, corpus_list: Sequence, n: int = 200, exhaustive: bool = False,
+                              mask: Optional[np.ndarray] = None) -> list:
+        """
+        Return a list of the top N papers with scores, like BM25.get_top_n_paper_score.
+
+        Every document containing a query term is scored; exhaustive is accepted for compatibility.
+        """
+        if len(corpus_list) != self.doc_count:
+            raise ValueError("Mismatch between corpus_list and scores length.")
+        start = time.perf_counter()
+        scores = self.get_scores(query)
+        top_n = [[corpus_list[i][0], corpus_list[i][1], float(scores[i]), 0] for i in _top_n_indices(scores, n, mask)]
+        self._query_count += 1
+        self._query_seconds += time.perf_counter() - start
+        return top_n
+
+    def index_stats(self) -> dict[str, float]:
+        """Return the size of the index and the mean query latency so far.
+
+        The uncompressed size is that of the same postings stored as 32-bit document ids and term frequencies.
+        """
+        posting_count = sum(postings.posting_count() for postings in self.postings)
+        compressed = sum(postings.nbytes() for postings in self.postings)
+        return {'terms': len(self.vocabulary),
+                'postings': posting_count,
+                'compressed_bytes': compressed,
+                'uncompressed_bytes': posting_count * 8,
+                'bytes_per_posting': compressed / posting_count if posting_count else 0.0,
+                'queries': self._query_count,
+                'mean_query_ms': 1000 * self._query_seconds / self._query_count if self._query_count else 0.0}
+
+
+_PRUNING_TOLERANCE = 1e-9
+
+
+def _top_n_indices(scores: np.ndarray, n: int, mask: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Return the indices of the n largest scores, in the same order as heapq.nlargest over enumerate(scores):
+    by decreasing score, with ties broken by the lower index. If mask is given, only the indices where it is True
+    and the score is positive (i.e. the document matches the query) are considered, so there may be fewer than n.
+
+    >>> _top_n_indices(np.array([1.0, 3.0, 2.0, 3.0]), 2).tolist()
+    [1, 3]
+    >>> _top_n_indices(np.array([0.0, 1.0, 0.0, 0.0]), 3).tolist()
+    [1, 0, 2]
+    >>> _top_n_indices(np.array([1.0, 3.0, 2.0, 3.0]), 2, np.array([True, False, True, False])).tolist()
+    [2, 0]
+    >>> _top_n_indices(np.array([0.0, 3.0, 2.0, 0.0]), 3, np.array([True, False, True, True])).tolist()
+    [2]
+    """
+    if mask is not None:
+        candidates = np.flatnonzero(mask & (scores > 0))
+        return candidates[_top_n_indices(scores[candidates], n)]
+    if n <= 0:
+        return np.array([], dtype=np.intp)
+    if n >= len(scores):
+        return np.argsort(-scores, kind='stable')
+
+    kth_score = scores[np.argpartition(scores, -n)[-n:]].min()
+    above = np.flatnonzero(scores > kth_score)
+    ties = np.flatnonzero(scores == kth_score)[:n - len(above)]
+    candidates = np.concatenate((above, ties))
+    return candidates[np.argsort(-scores[candidates], kind='stable')]
+
+
+def _zero_score_padding(matched_ids: np.ndarray, count: int, doc_count: int) -> list[tuple[int, float]]:
+    """
+    Return the first count (document id, 0.0) pairs for documents not in matched_ids.
+
+    >>> _zero_score_padding(np.array([0, 2]), 2, 5)
+    [(1, 0.0), (3, 0.0)]
+    """
+    matched = set(matched_ids.tolist())
+    padding = []
+    doc_id = 0
+    while len(padding) < count and doc_id < doc_count:
+        if doc_id not in matched:
+            padding.append((doc_id, 0.0))
+        doc_id += 1
+    return padding
+
+
+def get_corpus(g: Graph | CompactGraph):
     """
     Return a list of the corpus (paper titles) for the BM25 model.
-    The corpus is a list of tuples where each tuple contains the paper ID and the tokenized title.
-    This is used to calculate the BM25 scores for the papers.
+    The corpus is a list of tuples where each tuple contains the paper ID and the title.
+    This is used to calculate the BM25 scores for the papers (the titles are tokenized by TokenizedCorpus.from_texts).
     """
     for paper in g.get_all_item_vertex_mappings().values():
-        title_words = tokenize(paper.item.title)
-        yield (paper.item.paper_id, " ".join(title_words))
+        yield (paper.item.paper_id, paper.item.title)
 
 
-def get_most_cited_score(paper_scores: list, g: Graph, n: int = 75) -> list:
+def get_most_cited_score(paper_scores: list, g: Graph | CompactGraph, n: int = 75) -> list:
     """
     Return a list of the top n papers with the highest scores. The score is calculated as a weighted sum of the BM25
-    score and the number of citations.
+    score and the number of citations, i.e. of papers in g citing the paper (its in-degree).
     """
-    for paper in paper_scores:
-        paper_id = paper[0]
-        num_cited_by = len(g.get_all_item_vertex_mappings()[paper_id].neighbours)
+    citations = citation_counts(g, [paper[0] for paper in paper_scores])
+    for paper, num_cited_by in zip(paper_scores, citations.tolist()):
         paper[3] = num_cited_by
+    return rank_by_citations(paper_scores, n)
+
+
+def rank_by_citations(paper_scores: list, n: int = 75) -> list:
+    """
+    Return a list of the top n of the given [paper id, title, BM25 score, number of citations] papers by the weighted
+    sum of get_most_cited_score.
 
+    >>> rank_by_citations([['a', '', 1.0, 0], ['b', '', 0.5, 10], ['c', '', 0.9, 0]], 2)
+    [['a', '', 1.0, 0], ['b', '', 0.5, 10]]
+    """
+    citations = np.array([x[3] for x in paper_scores], dtype=np.int64)
     weight_sim = 0.7
     weight_cite = 0.3
 
-    max_sim = max(x[2] for x in paper_scores) if any(x[2] > 0 for x in paper_scores) else 1
-    max_cite = max(x[3] for x in paper_scores) if any(x[3] > 0 for x in paper_scores) else 1
+    sims = np.array([x[2] for x in paper_scores], dtype=np.float64)
+    max_sim = sims.max() if np.any(sims > 0) else 1
+    max_cite = citations.max() if np.any(citations > 0) else 1
+
+    # A stable sort by decreasing score, like sorted(..., reverse=True)
+    order = np.argsort(-(weight_sim * (sims / max_sim) + weight_cite * (citations / max_cite)), kind='stable')
+    return [paper_scores[i] for i in order[:n].tolist()]
 
-    sorted_data = sorted(
-        paper_scores,
-        key=lambda x: weight_sim * (x[2] / max_sim) + weight_cite * (x[3] / max_cite),
-        reverse=True
-    )
 
-    return sorted_data[:n]
+def citation_counts(g: Graph | CompactGraph, paper_ids: list[str]) -> np.ndarray:
+    """
+    Return the number of papers in g citing each of the papers with the given ids.
+    A CompactGraph gathers them from its precomputed in-degrees; a Graph has no reverse adjacency, so its edges are
+    counted.
+    """
+    if isinstance(g, CompactGraph):
+        return g.in_degrees_of(np.array([g.index_of(paper_id) for paper_id in paper_ids], dtype=np.int64))
 
+    wanted = dict.fromkeys(paper_ids, 0)
+    for vertex in g.get_all_item_vertex_mappings().values():
+        for neighbour in vertex.neighbours:
+            if neighbour.item.paper_id in wanted:
+                wanted[neighbour.item.paper_id] += 1
+    return np.array([wanted[paper_id] for paper_id in paper_ids], dtype=np.int64)
 
-def build_query_graph(mega_graph: Graph, weighted_papers: list) -> Graph:
+
+def build_query_graph(mega_graph: Graph | CompactGraph, weighted_papers: list, citing_per_seed: int = 0) -> Graph:
     """
     Return a query graph based on the weighted papers with the highest scores.
     This is a helper function for the return_query function meant to build the query graph based on the
     given weighted papers.
+
+    Each weighted paper is expanded to (the first 5 of) its references and, if citing_per_seed is positive, to its
+    citing_per_seed most cited citing papers, found in the reverse adjacency of mega_graph.
+
+    Preconditions:
+        - citing_per_seed == 0 or isinstance(mega_graph, CompactGraph)
     """
     query_graph = Graph()
     for paper in weighted_papers:
@@ -155,38 +605,66 @@ def build_query_graph(mega_graph: Graph, weighted_papers: list) -> Graph:
             if x in query_graph.get_all_item_vertex_mappings():
                 query_graph.add_edge(p_id, x)
 
+    if citing_per_seed > 0:
+        for paper in values:
+            citing = mega_graph.cited_by(mega_graph.index_of(paper.item.paper_id))
+            most_cited = citing[np.argsort(-mega_graph.in_degrees_of(citing), kind='stable')[:citing_per_seed]]
+            for index in most_cited.tolist():
+                citing_paper = mega_graph.paper(index)
+                if citing_paper.paper_id not in query_graph.get_all_item_vertex_mappings():
+                    query_graph.add_vertex(citing_paper)
+                query_graph.add_edge(citing_paper.paper_id, paper.item.paper_id)
+
     return query_graph
 
 
-def return_query(g: Graph, query: str, bm25_model: BM25, corpus_list: list) -> Graph:
+def return_query(g: Graph | CompactGraph, query: str, bm25_model: BM25, corpus_list: list,
+                 citing_per_seed: int = 0, mask: Optional[np.ndarray] = None) -> Graph:
     """
     Return a query graph based on the given query, BM25 model, and corpus.
+    Each of the top papers is expanded to citing_per_seed of its citing papers as well as to its references. If mask
+    is given, the top papers are chosen among the papers where it is True (see filter_index.FilterIndex.mask).
+    The time of every stage and the size of the query graph are recorded in the metrics.
     """
-    result = bm25_model.get_top_n_paper_score(query, corpus_list)
+    with STAGE_SECONDS.time(stage='bm25'):
+        result = bm25_model.get_top_n_paper_score(query, corpus_list, mask=mask)
 
-    weighted_papers = get_most_cited_score(result, g)
+    with STAGE_SECONDS.time(stage='rerank'):
+        weighted_papers = get_most_cited_score(result, g)
 
-    query_graph = build_query_graph(g, weighted_papers)
+    with STAGE_SECONDS.time(stage='graph_build'):
+        query_graph = build_query_graph(g, weighted_papers, citing_per_seed)
 
+    RESULT_PAPERS.observe(len(query_graph.get_all_item_vertex_mappings()))
     return query_graph
 
 
-def filter_query(g: Graph, citations: str, author: str, venue: str) -> Graph:
+def paper_filter(citations: str, author: str, venue: str) -> Callable[[Paper], bool]:
     """
-    Filter the query graph based on the given citations, author, and venue.
+    Return a predicate that is True for the papers passing the given citations, author, and venue filters.
+    An author or venue of "0" means that filter is not applied.
+
+    >>> p = Paper('', ['John Doe'], 10, [], 'A Study on Algorithms', 'Journal of Algorithms', '1234')
+    >>> paper_filter('5', 'John Doe', '0')(p)
+    True
+    >>> paper_filter('5', '0', 'Nature')(p)
+    False
     """
-    for paper in g.get_all_item_vertex_mappings().values():
-        if paper.item.n_citation < int(citations):
-            paper.visible = False
-    if author != "0":
-        for paper in g.get_all_item_vertex_mappings().values():
-            if author not in paper.item.authors:
-                paper.visible = False
-    if venue != "0":
-        for paper in g.get_all_item_vertex_mappings().values():
-            if venue != paper.item.venue:
-                paper.visible = False
-    return g
+    min_citations = int(citations or 0)
+    return lambda paper: (paper.n_citation >= min_citations
+                          and (author == "0" or author in paper.authors)
+                          and (venue == "0" or venue == paper.venue))
+
+
+def filter_query(g: Graph, citations: str, author: str, venue: str) -> dict[str, _Vertex]:
+    """
+    Return a view of the query graph based on the given citations, author, and venue: a dictionary mapping the id of
+    every paper that passes the filters to its vertex.
+
+    The graph itself is not changed, so the same ranked query graph can be filtered again with other filters.
+    """
+    keep = paper_filter(citations, author, venue)
+    return {paper_id: vertex for paper_id, vertex in g.get_all_item_vertex_mappings().items() if keep(vertex.item)}
 
 
 def get_all_authors(g: Graph) -> list[str]:
@@ -202,12 +680,9 @@ def get_all_authors(g: Graph) -> list[str]:
 
 def get_all_venues(g: Graph) -> list[str]:
     """
-    Return a list of all venues in the graph.
+    Return a list of all venues in the graph, without duplicates, in the order they are first found.
     """
-    venues = []
-    for paper in g.get_all_item_vertex_mappings().values():
-        if paper.item.venue not in venues:
-            venues.append(paper.item.venue)
+    venues = dict.fromkeys(paper.item.venue for paper in g.get_all_item_vertex_mappings().values())
     return [x for x in venues if x.strip()]
 
 
@@ -227,10 +702,8 @@ if __name__ == "__main__":
 
     # Example usage
     graph = load_research_graph()
-    corpus = get_corpus(graph)
-    tokenized_corpus = [tokenize(x[1]) for x in corpus]
-
-    bm25 = BM25(tokenized_corpus)
+    corpus = list(get_corpus(graph))
+    bm25 = BM25(TokenizedCorpus.from_texts(title for _, title in corpus))
 
     # Search and rank
     results = bm25.get_top_n_paper_score("artificial intelligence", corpus)
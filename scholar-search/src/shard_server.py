@@ -0,0 +1,241 @@
+"""CSC111 Winter 2025 Project 2: Shard Server
+This module contains the ShardIndex class and the entry point of a shard server, which serves one partition of the
+research papers to the search coordinator of the app (see coordinator.py).
+It is responsible for loading the papers of one shard (the papers whose id hashes to it, see sharding.shard_of) with
+their BM25 weights and number of citing papers, both computed over the whole corpus so that the scores and citation
+counts are those of a single server, and for answering the top-k and paper lookup requests of the coordinator over
+HTTP.
+
+Start shard i of n (e.g. one per machine, or several on localhost) with:
+
+    python shard_server.py --shard i --shards n --port 8100
+"""
+
+from __future__ import annotations
+
+import argparse
+import dataclasses
+import os
+from collections import defaultdict
+from typing import Optional
+
+import numpy as np
+from dotenv import load_dotenv
+from flask import Blueprint, Flask, Response, current_app, request
+
+from filter_index import FilterIndex
+from graph import CompactGraph, read_papers
+from incremental import GraphCorpus
+from logging_config import configure_logging
+from resource_loader import get_resource
+from responses import dumps
+from search import BM25, CollectionStatistics, _top_n_indices
+from sharding import shard_of
+from utils import tokenize
+from vocabulary import TokenizedCorpus
+
+DEFAULT_CSV_PATH = '../data/research-papers.csv'
+# The number of references of every top paper the coordinator expands the query graph to (see build_query_graph)
+REFERENCES_PER_PAPER = 5
+
+shard_routes = Blueprint('shard_routes', __name__)
+
+
+class ShardIndex:
+    """The papers of one shard, and the BM25 model and citation counts to search them.
+
+    Instance Attributes:
+        - shard: The index of this shard, in range(shard_count).
+        - shard_count: The number of shards the papers are split into.
+        - version: An identifier of the csv file the shard was built from.
+        - collection_size: The number of papers of all the shards.
+        - graph: The papers of this shard, with the edges between them (the other edges cross shards).
+        - rows: The position in the csv file of each paper of graph, which orders the papers of all the shards.
+        - in_degrees: The number of papers of all the shards citing each paper of graph.
+        - corpus: The (paper id, title) of each paper of graph, as in search.get_corpus.
+        - bm25: The BM25 model of the titles of graph, with the IDF and average length of all the titles.
+        - filters: The filter index of graph.
+    """
+    shard: int
+    shard_count: int
+    version: str
+    collection_size: int
+    graph: CompactGraph
+    rows: np.ndarray
+    in_degrees: np.ndarray
+    corpus: GraphCorpus
+    bm25: BM25
+    filters: FilterIndex
+
+    def __init__(self, shard: int, shard_count: int, csv_path: str = DEFAULT_CSV_PATH,
+                 workers: Optional[int] = None) -> None:
+        """Load the papers of the given shard from the csv file, reading the whole file once: the papers of the other
+        shards are only counted (their title terms, title lengths and references), never kept.
+
+        Preconditions:
+            - 0 <= shard < shard_count
+        """
+        self.shard, self.shard_count = shard, shard_count
+        document_frequencies = defaultdict(int)
+        total_length = 0
+        cited = defaultdict(int)
+        papers, first_rows = [], {}
+
+        row = -1
+        for row, paper in enumerate(read_papers(csv_path, workers)):
+            tokens = tokenize(paper.title)
+            total_length += len(tokens)
+            for token in set(tokens):
+                document_frequencies[token] += 1
+            for reference in dict.fromkeys(paper.references):
+                if shard_of(reference, shard_count) == shard:
+                    cited[reference] += 1
+            if shard_of(paper.paper_id, shard_count) == shard:
+                papers.append(paper)
+                first_rows.setdefault(paper.paper_id, row)
+
+        stat = os.stat(csv_path)
+        self.version = f'{stat.st_size}-{stat.st_mtime_ns}'
+        self.collection_size = row + 1
+        # A repeated paper id keeps the position of its first row with the fields of its last one, so the rows,
+        # citation counts and BM25 documents all follow the (deduplicated) dense ids of the graph
+        self.graph = CompactGraph(papers)
+        self.rows = np.array([first_rows[paper_id] for paper_id in self.graph.ids], dtype=np.int64)
+        self.in_degrees = np.array([cited[paper_id] for paper_id in self.graph.ids], dtype=np.int64)
+        self.corpus = GraphCorpus(self.graph)
+        collection = CollectionStatistics(self.collection_size, total_length / max(self.collection_size, 1),
+                                          document_frequencies)
+        self.bm25 = BM25(TokenizedCorpus.from_texts(title for _, title in self.corpus), collection=collection)
+        self.filters = FilterIndex(self.graph)
+
+    def top_n(self, query: str, n: int = 200, filters: Optional[tuple[str, str, str]] = None) -> list[list]:
+        """Return the [csv position, paper id, title, BM25 score, number of citing papers, first references] of the
+        top n papers of this shard for query, by decreasing score and then csv position, chosen among those passing
+        the (citations, author, venue) filters if they are given.
+
+        Every shard orders its papers like BM25.get_top_n_paper_score orders all of them, so the top n papers of the
+        whole corpus are the top n papers of the union of the answers of the shards.
+        """
+        mask = None if filters is None else self.filters.mask(self.graph, *filters)
+        if mask is None:
+            top_n = self.bm25.get_top_n_pruned(query, n)
+        else:
+            scores = self.bm25.get_scores(query)
+            top_n = [(i, float(scores[i])) for i in _top_n_indices(scores, n, mask).tolist()]
+        return [[int(self.rows[i]), self.corpus[i][0], self.corpus[i][1], score, int(self.in_degrees[i]),
+                 self.graph.paper(i).references[:REFERENCES_PER_PAPER]] for i, score in top_n]
+
+    def papers(self, paper_ids: list[str]) -> list[dict]:
+        """Return the fields of the papers of this shard with the given ids (ignoring the others), with their number of
+        citing papers (in_degree)."""
+        found = []
+        for paper_id in dict.fromkeys(paper_ids):
+            if paper_id in self.graph.ids:
+                index = self.graph.index_of(paper_id)
+                found.append({**dataclasses.asdict(self.graph.paper(index)), 'in_degree': int(self.in_degrees[index])})
+        return found
+
+    def info(self) -> dict:
+        """Return the shard, shard count and version of this index, which tag every answer of the shard server."""
+        return {'shard': self.shard, 'shards': self.shard_count, 'version': self.version}
+
+
+def json_response(payload: dict) -> Response:
+    """Return payload as a JSON response."""
+    return Response(dumps(payload), mimetype='application/json')
+
+
+def shard_index() -> ShardIndex:
+    """Return the index served by the current app."""
+    return current_app.config['SHARD_INDEX']
+
+
+@shard_routes.route('/shard')
+def info() -> Response:
+    """
+    Return the JSON {"shard", "shards", "version", "papers", "collection_size"} describing the shard, which also
+    tells the coordinator the shard is up.
+    """
+    index = shard_index()
+    return json_response({**index.info(), 'papers': len(index.graph), 'collection_size': index.collection_size})
+
+
+@shard_routes.route('/shard/topk')
+def top_k() -> Response:
+    """
+    Return the JSON {"shard", "shards", "version", "hits": [...]} of the top n papers of the shard for the query (see
+    ShardIndex.top_n), restricted to the papers passing the filters if any of them is given.
+    """
+    query = request.args.get('query', '')
+    n = request.args.get('n', 200, type=int)
+    citations_filter = request.args.get('citations_filter', '')
+    author_filter = request.args.get('author_filter', '0')
+    venue_filter = request.args.get('venue_filter', '0')
+    filters = None
+    if int(citations_filter or 0) > 0 or author_filter != "0" or venue_filter != "0":
+        filters = (citations_filter, author_filter, venue_filter)
+
+    index = shard_index()
+    return json_response({**index.info(), 'hits': index.top_n(query, n, filters)})
+
+
+@shard_routes.route('/shard/papers', methods=['POST'])
+def papers() -> Response:
+    """
+    Return the JSON {"shard", "shards", "version", "papers": [...]} of the papers of the shard with the ids of the
+    JSON {"ids": [...]} posted.
+    """
+    index = shard_index()
+    paper_ids = (request.get_json(silent=True) or {}).get('ids', [])
+    return json_response({**index.info(), 'papers': index.papers(paper_ids)})
+
+
+@shard_routes.route('/shard/paper/<paper_id>')
+def paper(paper_id: str) -> Response | tuple[str, int]:
+    """
+    Return the JSON of the fields of the paper with the given id, or 404 if it is not in the shard.
+    """
+    found = shard_index().papers([paper_id])
+    if not found:
+        return 'Paper not found', 404
+    return json_response(found[0])
+
+
+def create_app(shard: Optional[int] = None, shard_count: Optional[int] = None, workers: Optional[int] = None) -> Flask:
+    """
+    Return the Flask app of a shard server serving the given shard (by default, the SHARD environment variable) of
+    shard_count shards (by default, SHARD_COUNT), e.g. for gunicorn "shard_server:create_app()".
+
+    The index of the shard is cached like the resources of the app, so a restarted shard server does not read the csv
+    file again unless it changed.
+    """
+    load_dotenv()
+    shard = int(os.environ.get('SHARD', 0)) if shard is None else shard
+    shard_count = int(os.environ.get('SHARD_COUNT', 1)) if shard_count is None else shard_count
+    if not 0 <= shard < shard_count:
+        raise ValueError(f'shard {shard} is not one of {shard_count} shards')
+
+    app = Flask(__name__)
+    app.config['SHARD_INDEX'] = get_resource(f'shard_{shard}_of_{shard_count}',
+                                             lambda: ShardIndex(shard, shard_count, workers=workers))
+    app.register_blueprint(shard_routes)
+    return app
+
+
+def main() -> None:
+    """Start a shard server with the shard given on the command line."""
+    parser = argparse.ArgumentParser(description='Serve one shard of the research papers to the search coordinator.')
+    parser.add_argument('--shard', type=int, required=True, help='the index of the shard, from 0 to shards - 1')
+    parser.add_argument('--shards', type=int, required=True, help='the number of shards')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8100)
+    parser.add_argument('--workers', type=int, default=None, help='processes parsing the csv file (default: CPUs)')
+    args = parser.parse_args()
+
+    configure_logging()
+    app = create_app(args.shard, args.shards, args.workers)
+    app.run(host=args.host, port=args.port, threaded=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,200 @@
+"""CSC111 Winter 2025 Project 2: Sharded BM25 Scoring
+This module contains the ShardedBM25 class, a BM25 model whose documents are split into shards scored in parallel.
+It is responsible for splitting the BM25 weights into contiguous ranges of document ids, scoring the shards of a query
+in persistent processes, and merging the top papers of every shard into the top papers of the whole corpus.
+The weights of every shard are computed with the IDF and average document length of the whole corpus, so the scores,
+and the merged ranking, are exactly those of the unsharded model. It also assigns the papers to the shard servers of an
+app whose corpus is split across machines (see shard_server.py).
+"""
+
+from __future__ import annotations
+
+import hashlib
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+import numpy as np
+
+from search import BM25, _top_n_indices
+
+# The shards of a scoring process, by shard index, sent by its first task
+_worker_shards: dict[int, BM25] = {}
+
+
+class ShardedBM25(BM25):
+    """A BM25 model that scores its documents in shards, on a pool of processes.
+
+    It is a BM25 model over all the documents (its other methods see the whole corpus); only get_top_n_paper_score is
+    sharded. Shard i holds the documents in range(offsets[i], offsets[i + 1]); scoring process p holds the model of
+    the shards i with i % processes == p only, built when it starts, so the weights take about twice their unsharded
+    memory in all: once in the whole model, once split among the processes. The processes are started on first use,
+    so that every gunicorn worker starts its own after it is forked, and they are never forked from it (see
+    _get_pools). Scattering a query and gathering its answers costs about a millisecond, so sharding only pays off for
+    corpora whose queries take longer than that to score.
+
+    Instance Attributes:
+        - offsets: The first document id of every shard, followed by the number of documents.
+        - processes: The number of scoring processes, or 0 to score the shards one after the other in this process.
+    """
+    offsets: list[int]
+    processes: int
+    # Private Instance Attributes:
+    #     - _shards: The model of every shard if processes is 0, and None otherwise.
+    #     - _pools: The single-process pool of every scoring process, or None if they are not started.
+    #     - _pool_pid: The process that started the pools.
+    #     - _pool_lock: Guards _pools and _pool_pid.
+    _shards: Optional[list[BM25]]
+    _pools: Optional[list[ProcessPoolExecutor]]
+    _pool_pid: Optional[int]
+    _pool_lock: threading.Lock
+
+    @classmethod
+    def from_model(cls, model: BM25, shard_count: int, processes: Optional[int] = None) -> ShardedBM25:
+        """Return a sharded model over the documents of model, split into shard_count ranges of document ids of
+        (nearly) equal size, scored by processes processes (by default, one per shard).
+
+        Preconditions:
+            - shard_count >= 1
+        """
+        sharded = cls.__new__(cls)
+        sharded.__dict__.update(model.__dict__)
+        sharded.offsets = np.linspace(0, model.doc_count, shard_count + 1).astype(int).tolist()
+        # A single shard is scored in this process
+        sharded.processes = 0 if shard_count <= 1 else min(shard_count if processes is None else processes, shard_count)
+        sharded._shards = None if sharded.processes > 0 else [sharded._shard(i) for i in range(shard_count)]
+        sharded._pools = None
+        sharded._pool_pid = None
+        sharded._pool_lock = threading.Lock()
+        return sharded
+
+    def _shard(self, i: int) -> BM25:
+        """Return the model of shard i, with the global IDF and average document length (the weights are a copy of a
+        slice of the weights of the whole model)."""
+        start, end = self.offsets[i], self.offsets[i + 1]
+        weights = self.weights[start:end].tocsc()
+        weights.sort_indices()
+        upper_bounds = weights.max(axis=0).toarray().ravel() if weights.shape[0] > 0 \
+            else np.zeros(weights.shape[1])
+        return BM25.from_arrays(self.vocabulary, weights, upper_bounds, self.doc_lengths[start:end], self.frequencies,
+                                self.k1, self.b, self.average_doc_length)
+
+    def get_top_n_paper_score(self, query: str, corpus_list: list, n: int = 200, exhaustive: bool = False,
+                              mask: Optional[np.ndarray] = None) -> list:
+        """
+        Return a list of the top N papers with scores, exactly as BM25.get_top_n_paper_score.
+
+        Every shard finds its own top N (by score, then by document id), and the merged top N is the top N of their
+        union, since each paper of the global top N is in the top N of its shard.
+
+        >>> titles = ['alpha beta', 'beta gamma', 'gamma', 'beta', 'delta gamma', 'delta', 'gamma beta', 'delta beta']
+        >>> model = BM25([title.split() for title in titles])
+        >>> corpus = [(str(i), title) for i, title in enumerate(titles)]
+        >>> sharded = ShardedBM25.from_model(model, 2, processes=0)
+        >>> expected = model.get_top_n_paper_score('alpha delta', corpus, 3)
+        >>> sharded.get_top_n_paper_score('alpha delta', corpus, 3) == expected
+        True
+        >>> [paper[0] for paper in expected]
+        ['0', '5', '4']
+        """
+        if len(corpus_list) != self.doc_count:
+            raise ValueError("Mismatch between corpus_list and scores length.")
+
+        tasks = [(i, start, query, n, exhaustive, None if mask is None else mask[start:end])
+                 for i, (start, end) in enumerate(zip(self.offsets, self.offsets[1:]))]
+        pools = self._get_pools()
+        if pools is None:
+            partials = [_top_n_of_shard(self._shards[task[0]], *task[1:]) for task in tasks]
+        else:
+            futures = [pools[task[0] % len(pools)].submit(_score_shard, *task) for task in tasks]
+            partials = [future.result() for future in futures]
+
+        doc_ids = np.concatenate([ids for ids, _ in partials])
+        scores = np.concatenate([shard_scores for _, shard_scores in partials])
+        top_n = np.lexsort((doc_ids, -scores))[:n]
+        return [[corpus_list[i][0], corpus_list[i][1], score, 0]
+                for i, score in zip(doc_ids[top_n].tolist(), scores[top_n].tolist())]
+
+    def _get_pools(self) -> Optional[list[ProcessPoolExecutor]]:
+        """Return the pool of every scoring process of this process, starting them on first use, or None if the shards
+        are scored in this process."""
+        if self.processes <= 0:
+            return None
+        with self._pool_lock:
+            if self._pools is None or self._pool_pid != os.getpid():
+                # Never fork: this is called from a thread of a (threaded) gunicorn worker, and a process forked from
+                # a multi-threaded one can deadlock on a lock held by another thread at the time of the fork
+                method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+                context = multiprocessing.get_context(method)
+                shard_count = len(self.offsets) - 1
+                pools = [ProcessPoolExecutor(max_workers=1, mp_context=context) for _ in range(self.processes)]
+                # The shards are sent as a task rather than as initializer arguments, which the pool would keep
+                loads = [pool.submit(_init_worker, {i: self._shard(i) for i in range(process, shard_count,
+                                                                                      self.processes)})
+                         for process, pool in enumerate(pools)]
+                for load in loads:
+                    load.result()
+                self._pools, self._pool_pid = pools, os.getpid()
+            return self._pools
+
+    def close(self) -> None:
+        """Stop the scoring processes of this model, if they are running."""
+        with self._pool_lock:
+            if self._pools is not None and self._pool_pid == os.getpid():
+                for pool in self._pools:
+                    pool.shutdown()
+            self._pools = None
+
+    def __getstate__(self) -> dict:
+        """Return the state of this model for pickling, without its processes."""
+        state = self.__dict__.copy()
+        state['_pools'], state['_pool_pid'], state['_pool_lock'] = None, None, None
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        """Restore the state of a pickled model."""
+        self.__dict__.update(state)
+        self._pool_lock = threading.Lock()
+
+
+def _init_worker(shards: dict[int, BM25]) -> None:
+    """Set the shards of this scoring process, by shard index."""
+    global _worker_shards
+    _worker_shards = shards
+
+
+def _score_shard(shard_index: int, offset: int, query: str, n: int, exhaustive: bool,
+                 mask: Optional[np.ndarray]) -> tuple[np.ndarray, np.ndarray]:
+    """Return the (document ids, scores) of the top n documents of the given shard of this scoring process."""
+    return _top_n_of_shard(_worker_shards[shard_index], offset, query, n, exhaustive, mask)
+
+
+def _top_n_of_shard(shard: BM25, offset: int, query: str, n: int, exhaustive: bool,
+                    mask: Optional[np.ndarray]) -> tuple[np.ndarray, np.ndarray]:
+    """Return the global (document ids, scores) of the top n documents of shard, whose first document is document
+    offset of the whole corpus, for query, found like BM25.get_top_n_paper_score, restricted to the documents of the
+    shard where mask is True if it is given."""
+    if exhaustive or mask is not None:
+        scores = shard.get_scores(query)
+        top_n = _top_n_indices(scores, n, mask)
+        doc_ids, top_scores = top_n.astype(np.int64), scores[top_n]
+    else:
+        pairs = shard.get_top_n_pruned(query, n)
+        doc_ids = np.array([doc_id for doc_id, _ in pairs], dtype=np.int64)
+        top_scores = np.array([score for _, score in pairs], dtype=np.float64)
+    return doc_ids + offset, top_scores
+
+
+def shard_of(paper_id: str, shard_count: int) -> int:
+    """Return the shard that the paper with the given id belongs to when the papers are split among shard_count shard
+    servers (see shard_server.py), which is the same in every process.
+
+    >>> shard_of('1234', 1)
+    0
+    >>> shard_of('1234', 4) == shard_of('1234', 4)
+    True
+    """
+    digest = hashlib.blake2b(paper_id.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little') % shard_count
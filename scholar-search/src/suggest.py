@@ -0,0 +1,149 @@
+"""CSC111 Winter 2025 Project 2: Search Suggestions
+This module contains the PrefixIndex and Suggestions classes, which complete what the user is typing in the search box.
+It is responsible for building sorted string tables of the title vocabulary, the author names and the venues, and for
+finding the completions of a prefix by binary search, ranked by document frequency (terms) or citations (authors and
+venues).
+"""
+
+from __future__ import annotations
+
+import bisect
+from collections.abc import Iterable, Mapping
+from itertools import groupby
+
+import numpy as np
+
+from graph import CompactGraph
+from index_store import MappedStrings, encode_strings
+from search import _top_n_indices
+
+MAX_SUGGESTIONS = 20
+# The completions of prefixes matching more keys than this are precomputed, so no request ranks more keys than this
+PRECOMPUTE_THRESHOLD = 2000
+_LAST_CHAR = chr(0x10FFFF)
+
+
+class PrefixIndex:
+    """The completions of prefixes among a set of weighted strings.
+
+    The strings are stored in one UTF-8 blob, sorted by their lowercase form (their key), so the strings with a given
+    prefix (ignoring case) are a range found by binary search, and the completions are the heaviest strings of that
+    range (ties broken by key).
+
+    Instance Attributes:
+        - strings: The strings, sorted by key; strings with the same key are kept once, as the first one given.
+        - weights: The weight of each string, summed over the strings with the same key.
+
+    >>> index = PrefixIndex({'Graph': 3, 'graphs': 5, 'grammar': 1, 'tree': 9})
+    >>> index.complete('gra'), index.complete('G', 2), index.complete('x')
+    (['graphs', 'Graph', 'grammar'], ['graphs', 'Graph'], [])
+    """
+    strings: MappedStrings
+    weights: np.ndarray
+    # Private Instance Attributes:
+    #     - _precomputed: Maps each prefix matching more than PRECOMPUTE_THRESHOLD keys to its completions.
+    _precomputed: dict[str, np.ndarray]
+
+    def __init__(self, weighted_strings: Mapping[str, float]) -> None:
+        merged = {}
+        for string, weight in weighted_strings.items():
+            key = string.lower()
+            if key in merged:
+                merged[key][1] += weight
+            else:
+                merged[key] = [string, weight]
+        keys = sorted(merged)
+
+        self.strings = MappedStrings(*encode_strings([merged[key][0] for key in keys]))
+        self.weights = np.array([merged[key][1] for key in keys], dtype=np.float64)
+
+        # The keys with a prefix of length n + 1 are a subrange of those with its prefix of length n, so only the
+        # ranges that were too long at length n are split at length n + 1
+        self._precomputed = {}
+        ranges, length = [(0, len(keys))], 1
+        while ranges:
+            long_ranges = []
+            for low, high in ranges:
+                start = low
+                for prefix, group in groupby(keys[low:high], key=lambda k: k[:length]):
+                    end = start + sum(1 for _ in group)
+                    if len(prefix) == length and end - start > PRECOMPUTE_THRESHOLD:
+                        top = start + _top_n_indices(self.weights[start:end], MAX_SUGGESTIONS)
+                        self._precomputed[prefix] = top.astype(np.int32)
+                        long_ranges.append((start, end))
+                    start = end
+            ranges, length = long_ranges, length + 1
+
+    def complete(self, prefix: str, limit: int = 10) -> list[str]:
+        """Return up to limit (at most MAX_SUGGESTIONS) completions of prefix, heaviest first."""
+        prefix = prefix.lower()
+        limit = min(limit, MAX_SUGGESTIONS)
+        if not prefix or limit <= 0:
+            return []
+
+        if prefix in self._precomputed:
+            top = self._precomputed[prefix][:limit]
+        else:
+            start = bisect.bisect_left(self.strings, prefix, key=str.lower)
+            end = bisect.bisect_left(self.strings, prefix + _LAST_CHAR, lo=start, key=str.lower)
+            top = start + _top_n_indices(self.weights[start:end], limit)
+        return [self.strings[i] for i in top.tolist()]
+
+    def __len__(self) -> int:
+        return len(self.strings)
+
+    def nbytes(self) -> int:
+        """Return the approximate number of bytes used by this index."""
+        precomputed = sum(top.nbytes + 100 for top in self._precomputed.values())
+        return self.strings.nbytes() + self.weights.nbytes + precomputed
+
+
+class Suggestions:
+    """The completions of the search box: title terms by document frequency, and authors and venues by the total
+    number of citations of their papers.
+
+    Instance Attributes:
+        - terms: The prefix index of the title vocabulary.
+        - authors: The prefix index of the author names.
+        - venues: The prefix index of the venues.
+    """
+    terms: PrefixIndex
+    authors: PrefixIndex
+    venues: PrefixIndex
+
+    def __init__(self, term_frequencies: Mapping[str, int], papers: Iterable) -> None:
+        author_citations, venue_citations = {}, {}
+        for paper in papers:
+            for author in paper.authors:
+                if author.strip():
+                    author_citations[author] = author_citations.get(author, 0) + paper.n_citation
+            if paper.venue.strip():
+                venue_citations[paper.venue] = venue_citations.get(paper.venue, 0) + paper.n_citation
+
+        self.terms = PrefixIndex(term_frequencies)
+        self.authors = PrefixIndex(author_citations)
+        self.venues = PrefixIndex(venue_citations)
+
+    @classmethod
+    def from_graph(cls, graph: CompactGraph, term_frequencies: Mapping[str, int]) -> Suggestions:
+        """Return the suggestions of the papers of graph, with the document frequencies of the title terms."""
+        return cls(term_frequencies, (graph.paper(i) for i in range(len(graph))))
+
+    def suggest(self, prefix: str, limit: int = 10) -> dict[str, list[str]]:
+        """Return the completions of prefix: terms complete its last word (and include the words before it), while
+        authors and venues complete all of it.
+
+        >>> from graph import Paper
+        >>> p = Paper('', ['Ada Lovelace'], 10, [], 'Analytical engines', 'Nature', '1')
+        >>> Suggestions({'analytical': 1, 'engines': 1}, [p]).suggest('analytical en')['terms']
+        ['analytical engines']
+        """
+        head, _, last = prefix.lstrip().rpartition(' ')
+        head = ' '.join(head.split())
+        return {'terms': [f'{head} {term}' if head else term for term in self.terms.complete(last, limit)],
+                'authors': self.authors.complete(prefix.strip(), limit),
+                'venues': self.venues.complete(prefix.strip(), limit)}
+
+    def nbytes(self) -> int:
+        """Return the approximate number of bytes used by the suggestions."""
+        return self.terms.nbytes() + self.authors.nbytes() + self.venues.nbytes()
@@ -62,6 +62,26 @@ def tokenize(text: str, stop_strs: tuple[str] = STOP_WORDS) -> list[str]:
     return [word.lower() for word in text.split() if word.isalpha() and word.lower() not in stop_strs]
 
 
+def tokenize_ids(text: str, vocabulary: dict[str, int], stop_strs: tuple[str] = STOP_WORDS) -> list[int]:
+    """
+    Return the term ids of the tokens of the given text (the tokens of tokenize), adding the terms that are not in
+    vocabulary to it with the next free ids.
+
+    >>> vocabulary = {}
+    >>> tokenize_ids("Graph search and graph sorting", vocabulary)
+    [0, 1, 0, 2]
+    >>> vocabulary
+    {'graph': 0, 'search': 1, 'sorting': 2}
+    """
+    ids = []
+    for word in text.split():
+        if word.isalpha():
+            word = word.lower()
+            if word not in stop_strs:
+                ids.append(vocabulary.setdefault(word, len(vocabulary)))
+    return ids
+
+
 def save_search_history(search_history: list[str]) -> None:
     """Save the user's search history to the session."""
     session['search_history'] = search_history
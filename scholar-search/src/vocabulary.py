@@ -0,0 +1,85 @@
+"""CSC111 Winter 2025 Project 2: Term Vocabulary and Tokenized Corpus
+This module contains the TokenizedCorpus class, a compact store of the tokenized titles of the research papers.
+It is responsible for interning every term of the corpus into an integer id, and for storing the documents as one flat
+array of term ids with the offset of every document, instead of a list of lists of strings, so that the tokenized
+corpus takes a few bytes per token in memory and pickles as two arrays and one dict.
+"""
+
+from __future__ import annotations
+
+from array import array
+from collections.abc import Iterable
+
+import numpy as np
+
+from utils import tokenize_ids
+
+
+class TokenizedCorpus:
+    """The tokenized documents of a corpus, as term ids.
+
+    Instance Attributes:
+        - vocabulary: Maps each term of the documents to its id; the ids are 0 to len(vocabulary) - 1, in the order
+          the terms first occur in the documents.
+        - term_ids: The term ids of all the documents, one after the other.
+        - offsets: The start of every document in term_ids, followed by len(term_ids).
+
+    Representation Invariants:
+        - len(self.offsets) >= 1 and self.offsets[0] == 0 and self.offsets[-1] == len(self.term_ids)
+        - all(0 <= term_id < len(self.vocabulary) for term_id in self.term_ids)
+    """
+    vocabulary: dict[str, int]
+    term_ids: np.ndarray
+    offsets: np.ndarray
+
+    def __init__(self, vocabulary: dict[str, int], term_ids: np.ndarray, offsets: np.ndarray) -> None:
+        self.vocabulary = vocabulary
+        self.term_ids = term_ids
+        self.offsets = offsets
+
+    @classmethod
+    def from_texts(cls, texts: Iterable[str]) -> TokenizedCorpus:
+        """Return the corpus of the tokens (see utils.tokenize) of each of the texts.
+
+        >>> corpus = TokenizedCorpus.from_texts(['Graph search', 'The graph of graphs', ''])
+        >>> corpus.vocabulary
+        {'graph': 0, 'search': 1, 'graphs': 2}
+        >>> [corpus[i].tolist() for i in range(len(corpus))]
+        [[0, 1], [0, 2], []]
+        """
+        vocabulary = {}
+        term_ids, offsets = array('I'), array('q', [0])
+        for text in texts:
+            term_ids.extend(tokenize_ids(text, vocabulary))
+            offsets.append(len(term_ids))
+        return cls(vocabulary, np.frombuffer(term_ids, dtype=np.uint32), np.frombuffer(offsets, dtype=np.int64))
+
+    @classmethod
+    def from_token_lists(cls, documents: Iterable[list[str]]) -> TokenizedCorpus:
+        """Return the corpus of the given already tokenized documents.
+
+        >>> TokenizedCorpus.from_token_lists([['a', 'b', 'a'], ['b']]).term_ids.tolist()
+        [0, 1, 0, 1]
+        """
+        vocabulary = {}
+        term_ids, offsets = array('I'), array('q', [0])
+        for tokens in documents:
+            term_ids.extend(vocabulary.setdefault(token, len(vocabulary)) for token in tokens)
+            offsets.append(len(term_ids))
+        return cls(vocabulary, np.frombuffer(term_ids, dtype=np.uint32), np.frombuffer(offsets, dtype=np.int64))
+
+    def __len__(self) -> int:
+        """Return the number of documents."""
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> np.ndarray:
+        """Return the term ids of document i."""
+        return self.term_ids[self.offsets[i]:self.offsets[i + 1]]
+
+    def doc_lengths(self) -> np.ndarray:
+        """Return the number of tokens of every document."""
+        return np.diff(self.offsets)
+
+    def nbytes(self) -> int:
+        """Return the number of bytes of the term id and offset arrays (the vocabulary excluded)."""
+        return self.term_ids.nbytes + self.offsets.nbytes
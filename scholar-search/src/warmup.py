@@ -0,0 +1,159 @@
+"""CSC111 Winter 2025 Project 2: Background Warm-Up
+This module contains the Warmup class, which loads the resources of a worker process in the background.
+It is responsible for running the loading steps of the app in a thread of its own once the worker has started, so that
+the worker answers health checks at once instead of after minutes of loading, and for reporting the progress of the
+steps, in the logs and to the readiness endpoint, so that a load balancer only sends searches to warm workers.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+from typing import Callable, Optional
+
+try:
+    from gevent import monkey as gevent_monkey
+    from gevent.threadpool import ThreadPoolExecutor as GeventThreadPoolExecutor
+except ImportError:
+    gevent_monkey = None
+
+logger = logging.getLogger(__name__)
+
+
+class Warmup:
+    """Runs the loading steps of a worker process in a background thread, once per process.
+
+    load is called with a callback that it calls with the name of every step before starting it. Under gevent (when
+    the threading module is monkey-patched), load runs on a real thread from gevent's threadpool, so that it does not
+    block the event loop answering the health checks.
+
+    Instance Attributes:
+        - load: The function loading the resources, called with the callback announcing each of its steps.
+    """
+    load: Callable[[Callable[[str], None]], None]
+    # Private Instance Attributes:
+    #     - _lock: Guards all the other private attributes.
+    #     - _pid: The process the warm-up was started in, or None if it is not started.
+    #     - _started: The time the warm-up was started.
+    #     - _finished: The time the warm-up was over, or None if it is not over.
+    #     - _step: The step in progress and the time it started, or None if no step is in progress.
+    #     - _completed: The name and duration in seconds of every step done, in order.
+    #     - _error: The error the warm-up failed with, or None if it did not fail.
+    #     - _done: Set once the warm-up is over, whether it succeeded or failed.
+    _lock: threading.Lock
+    _pid: Optional[int]
+    _started: float
+    _finished: Optional[float]
+    _step: Optional[tuple[str, float]]
+    _completed: list[tuple[str, float]]
+    _error: Optional[str]
+    _done: threading.Event
+
+    def __init__(self, load: Callable[[Callable[[str], None]], None]) -> None:
+        self.load = load
+        self._lock = threading.Lock()
+        self._pid = None
+        self._started = 0.0
+        self._finished = None
+        self._step = None
+        self._completed = []
+        self._error = None
+        self._done = threading.Event()
+
+    def start(self) -> None:
+        """Start the warm-up of this process in the background (a no-op if it is already started, or done).
+
+        A process forked from one where the warm-up was in progress starts its own, since threads do not survive a
+        fork; one forked after the warm-up was done shares its resources.
+        """
+        with self._lock:
+            if self._pid == os.getpid() or self._succeeded():
+                return
+            self._reset()
+        if gevent_monkey is not None and gevent_monkey.is_module_patched('threading'):
+            GeventThreadPoolExecutor(max_workers=1).submit(self._run)
+        else:
+            threading.Thread(target=self._run, name='warmup', daemon=True).start()
+
+    def run(self) -> None:
+        """Run the warm-up of this process in the calling thread (a no-op if it is already started, or done).
+
+        Raise the error of a step if one fails.
+        """
+        with self._lock:
+            if self._pid == os.getpid() or self._succeeded():
+                return
+            self._reset()
+        self._run()
+        if self._error is not None:
+            raise RuntimeError(f'warm-up failed: {self._error}')
+
+    def _reset(self) -> None:
+        """Record that the warm-up of this process is starting.
+
+        Preconditions:
+            - self._lock is held by the calling thread.
+        """
+        self._pid = os.getpid()
+        self._started = time.perf_counter()
+        self._finished = None
+        self._step, self._completed, self._error = None, [], None
+        self._done = threading.Event()
+
+    def _run(self) -> None:
+        """Run every step of the warm-up, and record whether it succeeded."""
+        logger.info('warm-up started')
+        try:
+            self.load(self._begin_step)
+        except Exception as error:
+            with self._lock:
+                self._error = repr(error)
+                self._step = None
+                self._finished = time.perf_counter()
+            logger.exception('warm-up failed', extra={'seconds': self._finished - self._started})
+            self._done.set()
+            return
+
+        self._begin_step(None)
+        with self._lock:
+            self._finished = time.perf_counter()
+        logger.info('warm-up done', extra={'seconds': self._finished - self._started,
+                                           'steps': ','.join(name for name, _ in self._completed)})
+        self._done.set()
+
+    def _begin_step(self, name: Optional[str]) -> None:
+        """Record that the step in progress is done and that the step with the given name, if any, starts."""
+        now = time.perf_counter()
+        with self._lock:
+            if self._step is not None:
+                self._completed.append((self._step[0], now - self._step[1]))
+                logger.info('warm-up step done', extra={'step': self._step[0], 'seconds': now - self._step[1],
+                                                        'steps_done': len(self._completed)})
+            self._step = None if name is None else (name, now)
+
+    def _succeeded(self) -> bool:
+        """Return whether every step of the warm-up is done."""
+        return self._done.is_set() and self._error is None
+
+    def ready(self) -> bool:
+        """Return whether every step of the warm-up is done, i.e. whether the resources are loaded."""
+        return self._succeeded()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Wait for the warm-up to be over for at most timeout seconds (forever if it is None), and return whether it is
+        done, i.e. over and successful."""
+        self._done.wait(timeout)
+        return self.ready()
+
+    def status(self) -> dict:
+        """Return the progress of the warm-up: whether it is ready, the step in progress, the seconds taken by every
+        step done and by the whole warm-up (so far), and the error it failed with, if any."""
+        with self._lock:
+            end = time.perf_counter() if self._finished is None else self._finished
+            return {'ready': self._succeeded(),
+                    'step': None if self._step is None else self._step[0],
+                    'steps_done': {name: round(seconds, 3) for name, seconds in self._completed},
+                    'seconds': 0.0 if self._pid is None else round(end - self._started, 3),
+                    'error': self._error}